@@ -23,6 +23,11 @@ class Node():
     def __repr__(self):
         raise NotImplementedError()
 
+    def offset(self):
+        """ ノードの元になった字句の入力での位置。Lexer の position で (行, 列) にできる """
+        token = getattr(self, 'token', None)
+        return None if token is None else token.offset
+
 
 class Statement(Node):
     def statement_node(self):
@@ -30,6 +35,8 @@ class Statement(Node):
 
 
 class Expression(Node):
+    symbol:int=None # Identifier なら名前の b1u3token.symbols の番号。ほかは None
+
     def expression_node(self):
         raise NotImplementedError()
 
@@ -49,10 +56,19 @@ class Program(Node):
             ret += repr(s)
         return ret
 
+    def offset(self):
+        if len(self.statements) > 0:
+            return self.statements[0].offset()
+        return None
+
 
 class Identifier(Expression):
     token:Token=None # token.IDENT
     value:str=None
+    # b1u3resolver が付ける注釈
+    slot:int=None
+    depth:int=0
+    scope:str=None
 
 
     def token_literal(self):
@@ -91,6 +107,22 @@ class ReturnStatement(Statement):
         return ' '.join([self.token_literal(), repr(self.return_value)])+';'
 
 
+class AssignStatement(Statement):
+    """ x = value。let 済みの一番内側の x を書き換える """
+    token:Token=None # 左辺の識別子のトークン
+    name:Identifier=None
+    value:Expression=None
+
+    def statement_node(self):
+        pass
+
+    def token_literal(self):
+        return self.token.literal
+
+    def __repr__(self):
+        return ' '.join([repr(self.name), '=', repr(self.value)])+';'
+
+
 class ExpressionStatement(Statement):
     token:Token=None # この文の最初のトークン。 文の判別用。
     expression:Expression=None
@@ -107,6 +139,7 @@ class ExpressionStatement(Statement):
 class IntegerLiteral(Expression):
     token:Token=None
     value:int=None
+    obj=None # 評価器が作った Integer をノードごとに持っておく
 
     def token_literal(self):
         return self.token.literal
@@ -199,10 +232,43 @@ class IfExpression(Expression):
             ret += f'else {repr(self.alternative)}'
         return ret
 
+class WhileStatement(Statement):
+    token:Token=None # token.WHILE
+    condition:Expression=None
+    body:BlockStatement=None
+
+    def statement_node(self):
+        pass
+
+    def token_literal(self):
+        return self.token.literal
+
+    def __repr__(self):
+        return f'while {repr(self.condition)} {repr(self.body)}'
+
+
+class ForStatement(Statement):
+    """ for (variable in iterable) body。variable は今の環境に let される """
+    token:Token=None # token.FOR
+    variable:Identifier=None
+    iterable:Expression=None
+    body:BlockStatement=None
+
+    def statement_node(self):
+        pass
+
+    def token_literal(self):
+        return self.token.literal
+
+    def __repr__(self):
+        return f'for ({repr(self.variable)} in {repr(self.iterable)}) {repr(self.body)}'
+
 class FunctionLiteral(Expression):
     parameters=None
     body:BlockStatement=None
     env=None
+    layout=None # b1u3resolver が付ける b1u3object.FrameLayout
+    tail_marked:bool=False # 本体の末尾呼び出しに印を付けたか
 
     def expression_node(self):
         pass
@@ -224,6 +290,7 @@ class FunctionLiteral(Expression):
 class CallExpression(Expression):
     function:Expression=None
     arguments:[Expression]=None
+    tail:bool=False # 関数本体の末尾位置にあるか
 
     def expression_node(self):
         pass
@@ -242,6 +309,7 @@ class CallExpression(Expression):
 class StringLiteral(Expression):
     token=None
     value:str=None
+    obj=None # 評価器が作った String をノードごとに持っておく
     def expression_node(self):
         pass
 
@@ -319,6 +387,14 @@ def modify(node, modifier):
         node.return_value = modify(node.return_value, modifier)
     elif isinstance(node, LetStatement):
         node.value = modify(node.value, modifier)
+    elif isinstance(node, AssignStatement):
+        node.value = modify(node.value, modifier)
+    elif isinstance(node, WhileStatement):
+        node.condition = modify(node.condition, modifier)
+        node.body = modify(node.body, modifier)
+    elif isinstance(node, ForStatement):
+        node.iterable = modify(node.iterable, modifier)
+        node.body = modify(node.body, modifier)
     elif isinstance(node, FunctionLiteral):
         for i, p in enumerate(node.parameters):
             node.parameters[i] = modify(node.parameters[i], modifier)
@@ -330,7 +406,7 @@ def modify(node, modifier):
         new_pairs = {}
         for k, v in node.pairs.items():
             new_k = modify(k, modifier)
-            new_v = modify(k, modifier)
+            new_v = modify(v, modifier)
             new_pairs[new_k] = new_v
         node.pairs = new_pairs
     return modifier(node)
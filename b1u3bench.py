@@ -0,0 +1,523 @@
+""" 評価器のベンチマーク
+
+python b1u3bench.py [name ...] で実行する。name を省略すると全部走らせる。
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import b1u3token, b1u3parser, b1u3object, b1u3evaluator, b1u3resolver, b1u3engine, b1u3hamt, b1u3intvec
+
+FIB_SCRIPT = """
+let fib = fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } };
+fib(15);
+"""
+
+ARRAY_SCRIPT = """
+let build = fn(arr, n) { if (n == 0) { arr } else { build(push(arr, n), n - 1) } };
+let total = fn(arr, acc) { if (len(arr) == 0) { acc } else { total(rest(arr), acc + arr[0]) } };
+let xs = build([], 150);
+total(xs, 0) + len(xs) + xs[10] * xs[20];
+"""
+
+COUNTER_SCRIPT = """
+let inner = fn(j, acc) { if (j == 0) { acc } else { inner(j - 1, acc + 1) } };
+let outer = fn(i, total) { if (i == 0) { total } else { outer(i - 1, total + inner(20, 0) - 20) } };
+outer(500, 0);
+"""
+
+CLOSURE_SCRIPT = """
+let outer = fn(a) { fn(b) { fn(c) { fn(d) {
+    let loop = fn(n, acc) { if (n == 0) { acc } else { loop(n - 1, acc + a + b + c + d + len([])) } };
+    loop(300, 0)
+} } } };
+outer(1)(2)(3)(4);
+"""
+
+
+def parse(source):
+    p = b1u3parser.Parser(b1u3token.Lexer(source))
+    program = p.parse_program()
+    if len(p.errors) != 0:
+        raise ValueError(p.errors)
+    return program
+
+
+def timeit(fn, repeat=3):
+    """ fn を repeat 回走らせて最短の秒数を返す """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def count_nodes(program):
+    """ 1回の評価で b1u3eval が呼ばれる回数を数える """
+    counter = [0]
+    def hook(node):
+        counter[0] += 1
+    b1u3evaluator.set_trace_hook(hook)
+    try:
+        b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+    finally:
+        b1u3evaluator.set_trace_hook(None)
+    return counter[0]
+
+
+def bench_dispatch():
+    """ ノードごとの print を再現したトレースありと、本番経路(フックなし)の nodes/sec を比べる """
+    sys.setrecursionlimit(20000)
+    devnull = open(os.devnull, 'w')
+    def print_hook(node):
+        # 以前の b1u3eval は全ノードで print(node) していた
+        print(node, file=devnull)
+    for name, source in [('fib', FIB_SCRIPT), ('array', ARRAY_SCRIPT)]:
+        program = parse(source)
+        nodes = count_nodes(program)
+        run = lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+        b1u3evaluator.set_trace_hook(print_hook)
+        try:
+            before = timeit(run, repeat=1)
+        finally:
+            b1u3evaluator.set_trace_hook(None)
+        after = timeit(run)
+        print(f'{name}: {nodes} nodes, '
+              f'traced {nodes/before:,.0f} nodes/sec, '
+              f'untraced {nodes/after:,.0f} nodes/sec '
+              f'({before/after:.1f}x)')
+    devnull.close()
+
+
+def bench_resolver():
+    """ 名前で環境をたどる場合と、解決済みの Frame を使う場合の比較 """
+    sys.setrecursionlimit(20000)
+    for name, source in [('fib', FIB_SCRIPT), ('closure', CLOSURE_SCRIPT)]:
+        plain = parse(source)
+        resolved = b1u3resolver.resolve(parse(source))
+        before = timeit(lambda: b1u3evaluator.b1u3eval(plain, b1u3object.Environment()))
+        after = timeit(lambda: b1u3evaluator.b1u3eval(resolved, b1u3object.Environment()))
+        print(f'{name}: environment {before*1000:.1f}ms, frames {after*1000:.1f}ms ({before/after:.2f}x)')
+
+
+def bench_tailcall():
+    """ 末尾再帰のループを 1M 回まわす。Python の再帰上限は変えない """
+    program = parse('let loop = fn(n, acc) { if (n == 0) { acc } else { loop(n - 1, acc + 1) } }; loop(1000000, 0);')
+    b1u3resolver.resolve(program)
+    elapsed = timeit(lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment()), repeat=1)
+    print(f'1M tail calls: {elapsed:.2f}s ({1000000/elapsed:,.0f} calls/sec), recursion limit {sys.getrecursionlimit()}')
+
+
+def bench_engines():
+    """ 同じスクリプトを各エンジンで走らせた秒数 """
+    sys.setrecursionlimit(20000)
+    for name, source in [('fib', FIB_SCRIPT), ('array', ARRAY_SCRIPT)]:
+        results = []
+        for engine in b1u3engine.ENGINES:
+            elapsed = timeit(lambda: b1u3engine.run(source, engine=engine))
+            results.append(f'{engine} {elapsed*1000:.1f}ms')
+        print(f'{name}: ' + ', '.join(results))
+
+
+def bench_push():
+    """ push で n 要素の配列を作って rest でたどる。n を倍にしたときの時間の伸び """
+    source = """
+let build = fn(arr, n) { if (n == 0) { arr } else { build(push(arr, n), n - 1) } };
+let total = fn(arr, acc) { if (len(arr) == 0) { acc } else { total(rest(arr), acc + first(arr)) } };
+total(build([], N), 0);
+"""
+    for n in [5000, 10000, 20000]:
+        program = b1u3resolver.resolve(parse(source.replace('N', str(n))))
+        elapsed = timeit(lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment()), repeat=1)
+        print(f'n={n}: {elapsed*1000:.1f}ms ({elapsed/n*1e6:.2f}us/element)')
+
+
+def average_depth(m):
+    """ b1u3hamt.Map の葉の平均の深さ。根の直下が 0 """
+    total = 0
+    stack = [(m.root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        for entry in node.array:
+            if type(entry) is tuple:
+                total += depth
+            else:
+                stack.append((entry, depth + 1))
+    return total / max(len(m), 1)
+
+
+def bench_hash():
+    """ 文字列キーを set で1つずつ入れて、全部検索する
+
+    1件あたりの時間は一定ではない。経路のコピーと検索は木の深さ (log32 n) の分だけ伸び、
+    insert はそれに加えて CPython の循環 GC が生きているオブジェクト全部をなめ直す分だけ伸びる。
+    手元では 10k から 1M キーで、平均の深さ 2.3 -> 3.6、insert 4.0us -> 18.5us
+    (gc を止めると 3.0us -> 5.1us)、lookup 0.9us -> 2.0us (dict の検索も 2.6 倍になる)。
+    """
+    for n in [10000, 100000, 1000000]:
+        keys = [b1u3object.String(value=f'key{i}') for i in range(n)]
+        built = []
+        def insert():
+            h = b1u3object.Hash(pairs=b1u3hamt.EMPTY)
+            for k in keys:
+                h = b1u3evaluator.set_function(h, k, k)
+            built.append(h)
+        insert_time = timeit(insert, repeat=1)
+        gc.disable()
+        try:
+            no_gc_time = timeit(insert, repeat=1)
+        finally:
+            gc.enable()
+        h = built[0]
+        del built[1:]
+        def lookup():
+            for k in keys:
+                b1u3evaluator.eval_hash_index_expression(h, k)
+        lookup_time = timeit(lookup, repeat=1)
+        print(f'{n:,} keys: depth {average_depth(h.pairs):.2f}, insert {insert_time/n*1e9:.0f}ns/key '
+              f'({no_gc_time/n*1e9:.0f}ns/key without gc), lookup {lookup_time/n*1e9:.0f}ns/key')
+    # 値が同じでも型が違うキーは別のキー
+    values = [b1u3object.Integer(value=1), b1u3object.Integer(value=0), b1u3evaluator.TRUE, b1u3evaluator.FALSE,
+              b1u3object.String(value='1'), b1u3object.String(value='ab'), b1u3object.String(value='ba')]
+    distinct = len({v.hash_key() for v in values})
+    print(f'{len(values)} keys of mixed types: {distinct} distinct')
+
+
+def bench_lookup():
+    """ 10k キーの Hash の検索。同じキーのオブジェクトを使い回す場合と毎回作る場合 """
+    n = 10000
+    rounds = 20
+    for name, new_key in [('integer', lambda i: b1u3object.Integer(value=i)),
+                          ('string', lambda i: b1u3object.String(value=f'key{i}'))]:
+        h = b1u3object.Hash(pairs={})
+        for i in range(n):
+            h = b1u3evaluator.set_function(h, new_key(i), new_key(i))
+        keys = [new_key(i) for i in range(n)]
+        def cached():
+            for _ in range(rounds):
+                for k in keys:
+                    b1u3evaluator.eval_hash_index_expression(h, k)
+        def fresh():
+            for _ in range(rounds):
+                for k in keys:
+                    b1u3evaluator.eval_hash_index_expression(h, type(k)(value=k.value))
+        hit = timeit(cached)
+        miss = timeit(fresh)
+        print(f'{name} keys: {n*rounds/hit:,.0f} lookups/sec with cached keys, '
+              f'{n*rounds/miss:,.0f} lookups/sec with a new key object per lookup')
+
+
+def bench_concat():
+    """ 100 文字の断片を + でつないで 1MB と 10MB の文字列を作る """
+    piece = '0123456789' * 10
+    source = """
+let build = fn(n, acc) { if (n == 0) { acc } else { build(n - 1, acc + "PIECE") } };
+len(build(N, ""));
+""".replace('PIECE', piece)
+    for n in [10000, 100000]:
+        program = b1u3resolver.resolve(parse(source.replace('N', str(n))))
+        elapsed = timeit(lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment()), repeat=1)
+        print(f'{n*len(piece)/1e6:.0f}MB from {n:,} pieces: {elapsed*1000:.0f}ms')
+
+
+def bench_builtins():
+    """ 組み込みの sum と map を 1M 要素と 100k 要素の配列で各エンジンから呼ぶ """
+    tests = [
+        ('sum 1M', 'let xs = range(1000000); sum(xs);'),
+        ('map 100k', 'let xs = range(100000); len(map(xs, fn(x) { x * 2 }));'),
+        ('reduce 100k', 'reduce(range(100000), 0, fn(acc, x) { acc + x });'),
+    ]
+    for name, source in tests:
+        results = []
+        for engine in b1u3engine.ENGINES:
+            elapsed = timeit(lambda: b1u3engine.run(source, engine=engine), repeat=1)
+            results.append(f'{engine} {elapsed*1000:.0f}ms')
+        print(f'{name}: ' + ', '.join(results))
+    # 上の sum 1M はほとんどが range で Integer を作る時間なので、sum だけを測る
+    xs = b1u3evaluator.range_function(b1u3object.Integer(value=1000000))
+    elapsed = timeit(lambda: b1u3evaluator.sum_function(xs))
+    print(f'sum over a prebuilt 1M array: {elapsed*1000:.0f}ms')
+
+
+def bench_vec():
+    """ 1M 要素の整数の要素ごとの演算を、ARRAY の map と VEC で比べる """
+    xs = b1u3evaluator.range_function(b1u3object.Integer(value=1000000))
+    v = b1u3evaluator.vec_function(xs)
+    two = b1u3object.Integer(value=2)
+    double = b1u3engine.Session('eval').run('fn(x) { x * 2 }')
+    boxed = timeit(lambda: b1u3evaluator.map_function(xs, double), repeat=1)
+    typed = timeit(lambda: b1u3evaluator.eval_infix_expression('*', v, two, None))
+    boxed_sum = timeit(lambda: b1u3evaluator.sum_function(xs))
+    typed_sum = timeit(lambda: b1u3evaluator.sum_function(v))
+    backend = 'numpy' if b1u3intvec.numpy is not None else 'array'
+    print(f'1M x * 2: map {boxed*1000:.0f}ms, vec ({backend}) {typed*1000:.1f}ms ({boxed/typed:.0f}x)')
+    print(f'1M sum: array {boxed_sum*1000:.0f}ms, vec ({backend}) {typed_sum*1000:.1f}ms ({boxed_sum/typed_sum:.0f}x)')
+
+
+def bench_lazy():
+    """ range/map/filter/sum をつないだ処理の最大メモリ。遅延列は要素数によらずほぼ一定 """
+    eager = 'sum(filter(map(range(N), fn(x) { x * 3 }), fn(x) { x / 2 * 2 == x }))'
+    lazy = 'sum(lazy_filter(lazy_map(lazy_range(N), fn(x) { x * 3 }), fn(x) { x / 2 * 2 == x }))'
+    for n in [10000, 100000]:
+        results = []
+        for name, source in [('eager', eager), ('lazy', lazy)]:
+            program = b1u3resolver.resolve(parse(source.replace('N', str(n))))
+            tracemalloc.start()
+            try:
+                start = time.perf_counter()
+                b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append(f'{name} {elapsed:.2f}s peak {peak/1e6:.1f}MB')
+        print(f'{n:,} elements: ' + ', '.join(results))
+
+
+def bench_loops():
+    """ 末尾再帰と while で同じ回数まわすカウンタを各エンジンで比べる """
+    n = 100000
+    recursive = f'let loop = fn(n, acc) {{ if (n == 0) {{ acc }} else {{ loop(n - 1, acc + 1) }} }}; loop({n}, 0);'
+    loop = f'let i = 0; let acc = 0; while (i < {n}) {{ i = i + 1; acc = acc + 1; }}; acc'
+    for engine in b1u3engine.ENGINES:
+        results = []
+        for name, source in [('recursive', recursive), ('while', loop)]:
+            start = time.perf_counter()
+            result = b1u3engine.run(source, engine=engine)
+            elapsed = time.perf_counter() - start
+            if isinstance(result, b1u3object.Error):
+                results.append(f'{name} failed ({result.msg})')
+            else:
+                results.append(f'{name} {elapsed*1000:.0f}ms')
+        print(f'{engine}: ' + ', '.join(results))
+
+
+def bench_memo():
+    """ 素朴な再帰の fib と memo で包んだ fib の秒数 """
+    plain = 'let fib = fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }; fib(22);'
+    cached = 'let fib = memo(fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }, 64); fib(22);'
+    results = []
+    for name, source in [('plain', plain), ('memo', cached)]:
+        program = b1u3resolver.resolve(parse(source))
+        elapsed = timeit(lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment()), repeat=1)
+        results.append(elapsed)
+    print(f'fib(22): plain {results[0]*1000:.1f}ms, memo {results[1]*1000:.2f}ms ({results[0]/results[1]:.0f}x)')
+
+
+def generated_script(size):
+    """ size 文字ほどのスクリプトを既存のサンプルをつないで作る """
+    sample = FIB_SCRIPT + ARRAY_SCRIPT + COUNTER_SCRIPT + CLOSURE_SCRIPT + 'let s = "hello, world"; s != "bye";\n'
+    return sample * (size // len(sample) + 1)
+
+
+def bench_lexer():
+    """ 10 MB の入力を字句に分ける速さ """
+    source = generated_script(10 * 1000 * 1000)
+    start = time.perf_counter()
+    next_token = b1u3token.Lexer(source).next_token
+    eof = b1u3token.EOF
+    count = 0
+    while next_token().type != eof:
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f'{len(source)/1e6:.1f}MB: {count:,} tokens in {elapsed:.2f}s ({count/elapsed:,.0f} tokens/sec)')
+
+
+def bench_stream_lexer():
+    """ 10 MB のファイルを全部読んでから分ける場合と、mmap を少しずつ分ける場合の秒数と最大メモリ """
+    import mmap, tempfile
+    with tempfile.TemporaryFile() as f:
+        f.write(generated_script(10 * 1000 * 1000).encode('utf-8'))
+        f.flush()
+        def whole():
+            f.seek(0)
+            return b1u3token.Lexer(f.read().decode('utf-8'))
+        def stream():
+            return b1u3token.StreamLexer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        results = []
+        for name, make in [('whole', whole), ('stream', stream)]:
+            tracemalloc.start()
+            try:
+                start = time.perf_counter()
+                next_token = make().next_token
+                eof = b1u3token.EOF
+                count = 0
+                while next_token().type != eof:
+                    count += 1
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append(f'{name} {elapsed:.2f}s peak {peak/1e6:.1f}MB')
+        print(f'{count:,} tokens: ' + ', '.join(results))
+
+
+def bench_token_buffer():
+    """ Token のリストと TokenBuffer の大きさ、それぞれを使った構文解析の秒数
+
+    BufferParser は AST に入る位置の Token しか作らないが、字句ごとの Python の仕事は
+    字句解析から構文解析に移るだけで、GC を止めない場合は Lexer とほぼ同じ秒数になる。
+    速くなるのは AST を作る間 GC を止める分で、2MB では Lexer 1.73s、TokenBuffer 1.27s
+    (build 0.39s + parse 0.86s。GC を止めない parse は 1.30s)。Token は 89 万字句に 56 万個。
+    """
+    source = generated_script(2 * 1000 * 1000)
+    tracemalloc.start()
+    try:
+        next_token = b1u3token.Lexer(source).next_token
+        tokens = [next_token()]
+        while tokens[-1].type != b1u3token.EOF:
+            tokens.append(next_token())
+        listed = tracemalloc.get_traced_memory()[0]
+        del tokens, next_token
+        before = tracemalloc.get_traced_memory()[0]
+        buffer = b1u3token.TokenBuffer(source)
+        buffered = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    n = len(buffer)
+    print(f'{n:,} tokens: Token list {listed/1e6:.1f}MB ({listed/n:.0f} bytes/token), '
+          f'TokenBuffer {buffered/1e6:.1f}MB ({buffered/n:.0f} bytes/token)')
+    lexed = timeit(lambda: b1u3parser.Parser(b1u3token.Lexer(source)).parse_program(), repeat=3)
+    indexed = timeit(lambda: b1u3parser.BufferParser(b1u3token.TokenBuffer(source)).parse_program(), repeat=3)
+    print(f'parse {len(source)/1e6:.1f}MB: Lexer {lexed:.2f}s, TokenBuffer {indexed:.2f}s')
+    built = timeit(lambda: b1u3token.TokenBuffer(source), repeat=3)
+    parsed = timeit(lambda: b1u3parser.BufferParser(buffer).parse_program(), repeat=3)
+    # Parser.parse_program は GC を止めない
+    collected = timeit(lambda: b1u3parser.Parser.parse_program(b1u3parser.BufferParser(buffer)), repeat=3)
+    class Counting(b1u3parser.BufferParser):
+        created:int = 0
+        def token_at(self, pos):
+            if pos != self.last_pos:
+                self.created += 1
+            return super().token_at(pos)
+    counting = Counting(buffer)
+    counting.parse_program()
+    created = counting.created
+    print(f'TokenBuffer: build {built:.2f}s, parse {parsed:.2f}s ({collected:.2f}s with gc), '
+          f'{created:,} Tokens for {n:,} tokens')
+
+
+def bench_lines():
+    """ トレースフックでノードの位置を行にして、行ごとの評価回数を数える """
+    source = ARRAY_SCRIPT
+    lexer = b1u3token.Lexer(source)
+    p = b1u3parser.Parser(lexer)
+    program = b1u3resolver.resolve(p.parse_program())
+    counts = {}
+    def hook(node):
+        offset = node.offset()
+        if offset is not None:
+            line = lexer.position(offset)[0]
+            counts[line] = counts.get(line, 0) + 1
+    b1u3evaluator.set_trace_hook(hook)
+    try:
+        start = time.perf_counter()
+        b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+        elapsed = time.perf_counter() - start
+    finally:
+        b1u3evaluator.set_trace_hook(None)
+    lines = source.split('\n')
+    print(f'{sum(counts.values()):,} nodes in {elapsed*1000:.1f}ms')
+    for line, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+        print(f'{n:8,} line {line}: {lines[line-1].strip()[:60]}')
+
+
+def bench_symbols():
+    """ 識別子の str が名前ごとに一つになっているかと、名前で環境を引く評価器の秒数 """
+    next_token = b1u3token.Lexer(generated_script(1000 * 1000)).next_token
+    idents = []
+    token = next_token()
+    while token.type != b1u3token.EOF:
+        if token.type == b1u3token.IDENT:
+            idents.append(token.literal)
+        token = next_token()
+    objects = len({id(v) for v in idents})
+    print(f'{len(idents):,} identifiers: {len(set(idents)):,} names, {objects:,} str objects')
+    # resolve しないので変数は毎回 Environment の dict を名前で引く
+    program = parse(FIB_SCRIPT.replace('fib(15)', 'fib(18)'))
+    elapsed = timeit(lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment()))
+    print(f'fib(18) with name lookups: {elapsed*1000:.1f}ms')
+
+
+def count_integers(fn):
+    """ fn を走らせる間に作られた Integer の数を数える """
+    counter = [0]
+    init = b1u3object.Integer.__init__
+    def counting_init(self, value=None):
+        counter[0] += 1
+        init(self, value)
+    b1u3object.Integer.__init__ = counting_init
+    try:
+        fn()
+    finally:
+        b1u3object.Integer.__init__ = init
+    return counter[0]
+
+
+def bench_alloc():
+    """ 小さい整数を使い回さない場合と使い回す場合の Integer の生成数 """
+    lo, hi = b1u3object.SMALL_INT_MIN, b1u3object.SMALL_INT_MAX
+    for name, source in [('counter', COUNTER_SCRIPT), ('fib', FIB_SCRIPT)]:
+        program = b1u3resolver.resolve(parse(source))
+        run = lambda: b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+        b1u3object.set_small_int_range(0, -1)
+        try:
+            before = count_integers(run)
+        finally:
+            b1u3object.set_small_int_range(lo, hi)
+        program = b1u3resolver.resolve(parse(source))
+        after = count_integers(run)
+        print(f'{name}: {before:,} Integers without the cache, {after:,} with [{lo}, {hi}] cached')
+
+
+def bench_memory():
+    """ 1M 要素の整数の Array が使うメモリを要素あたりのバイト数で出す """
+    n = 1000000
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        arr = b1u3object.Array(elements=[b1u3object.Integer(value=i) for i in range(n)])
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    print(f'{len(arr.elements):,} integers: {used/1e6:.1f}MB, {used/n:.1f} bytes/element '
+          f'(Integer {sys.getsizeof(arr.elements[0])} bytes + int + vector slot)')
+
+
+benchmarks = {
+        'dispatch': bench_dispatch,
+        'resolver': bench_resolver,
+        'tailcall': bench_tailcall,
+        'engines': bench_engines,
+        'memory': bench_memory,
+        'alloc': bench_alloc,
+        'push': bench_push,
+        'hash': bench_hash,
+        'lookup': bench_lookup,
+        'concat': bench_concat,
+        'builtins': bench_builtins,
+        'vec': bench_vec,
+        'lazy': bench_lazy,
+        'loops': bench_loops,
+        'memo': bench_memo,
+        'lexer': bench_lexer,
+        'stream_lexer': bench_stream_lexer,
+        'token_buffer': bench_token_buffer,
+        'lines': bench_lines,
+        'symbols': bench_symbols,
+}
+
+
+def main(argv):
+    names = argv or list(benchmarks)
+    for name in names:
+        print(f'== {name}')
+        benchmarks[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+""" バイトコードの定義
+
+命令列は int のリストで、オペコードのあとにオペランドが 1 ワードずつ続く。
+"""
+
+""" Opcode """
+OpConstant = 0
+OpPop = 1
+OpAdd = 2
+OpSub = 3
+OpMul = 4
+OpDiv = 5
+OpTrue = 6
+OpFalse = 7
+OpNull = 8
+OpEqual = 9
+OpNotEqual = 10
+OpGreaterThan = 11
+OpLessThan = 12
+OpMinus = 13
+OpBang = 14
+OpJumpNotTruthy = 15
+OpJump = 16
+OpGetGlobal = 17
+OpSetGlobal = 18
+OpGetLocal = 19
+OpSetLocal = 20
+OpGetBuiltin = 21
+OpGetFree = 22
+OpCurrentClosure = 23
+OpArray = 24
+OpHash = 25
+OpIndex = 26
+OpCall = 27
+OpReturnValue = 28
+OpReturn = 29
+OpClosure = 30
+# superinstructions: 直前の OpConstant と融合したもの
+OpAddConst = 31
+OpSubConst = 32
+OpEqualConst = 33
+OpNotEqualConst = 34
+OpGreaterThanConst = 35
+OpLessThanConst = 36
+# for 文: OpIter はスタックの値をイテレータにし、OpIterNext は次の要素を積む
+OpIter = 37
+OpIterNext = 38
+# セル: クロージャに捕まえられて束縛し直されるローカル変数は、スロットに Cell を置いて共有する
+OpMakeCell = 39
+OpGetCell = 40
+OpSetCell = 41
+OpGetFreeCell = 42
+OpSetFreeCell = 43
+# let される前かもしれない変数の読み出し。値があれば積んで 2 番目のオペランドへ飛び、
+# なければ次に続く外側の変数の読み出しを実行する
+OpGetLocalOr = 44
+OpGetCellOr = 45
+OpGetFreeOr = 46
+OpGetFreeCellOr = 47
+
+
+class Definition():
+    """ オペコードの名前とオペランドの数 """
+    name:str=None
+    operand_count:int=None
+
+    def __init__(self, name, operand_count):
+        self.name = name
+        self.operand_count = operand_count
+
+
+definitions = {
+        OpConstant: Definition('OpConstant', 1),
+        OpPop: Definition('OpPop', 0),
+        OpAdd: Definition('OpAdd', 0),
+        OpSub: Definition('OpSub', 0),
+        OpMul: Definition('OpMul', 0),
+        OpDiv: Definition('OpDiv', 0),
+        OpTrue: Definition('OpTrue', 0),
+        OpFalse: Definition('OpFalse', 0),
+        OpNull: Definition('OpNull', 0),
+        OpEqual: Definition('OpEqual', 0),
+        OpNotEqual: Definition('OpNotEqual', 0),
+        OpGreaterThan: Definition('OpGreaterThan', 0),
+        OpLessThan: Definition('OpLessThan', 0),
+        OpMinus: Definition('OpMinus', 0),
+        OpBang: Definition('OpBang', 0),
+        OpJumpNotTruthy: Definition('OpJumpNotTruthy', 1),
+        OpJump: Definition('OpJump', 1),
+        OpGetGlobal: Definition('OpGetGlobal', 1),
+        OpSetGlobal: Definition('OpSetGlobal', 1),
+        OpGetLocal: Definition('OpGetLocal', 1),
+        OpSetLocal: Definition('OpSetLocal', 1),
+        OpGetBuiltin: Definition('OpGetBuiltin', 1),
+        OpGetFree: Definition('OpGetFree', 1),
+        OpCurrentClosure: Definition('OpCurrentClosure', 0),
+        OpArray: Definition('OpArray', 1),
+        OpHash: Definition('OpHash', 1),
+        OpIndex: Definition('OpIndex', 0),
+        OpCall: Definition('OpCall', 1),
+        OpReturnValue: Definition('OpReturnValue', 0),
+        OpReturn: Definition('OpReturn', 0),
+        OpClosure: Definition('OpClosure', 2),
+        OpAddConst: Definition('OpAddConst', 1),
+        OpSubConst: Definition('OpSubConst', 1),
+        OpEqualConst: Definition('OpEqualConst', 1),
+        OpNotEqualConst: Definition('OpNotEqualConst', 1),
+        OpGreaterThanConst: Definition('OpGreaterThanConst', 1),
+        OpLessThanConst: Definition('OpLessThanConst', 1),
+        OpIter: Definition('OpIter', 0),
+        OpIterNext: Definition('OpIterNext', 1),
+        OpMakeCell: Definition('OpMakeCell', 1),
+        OpGetCell: Definition('OpGetCell', 1),
+        OpSetCell: Definition('OpSetCell', 1),
+        OpGetFreeCell: Definition('OpGetFreeCell', 1),
+        OpSetFreeCell: Definition('OpSetFreeCell', 1),
+        OpGetLocalOr: Definition('OpGetLocalOr', 2),
+        OpGetCellOr: Definition('OpGetCellOr', 2),
+        OpGetFreeOr: Definition('OpGetFreeOr', 2),
+        OpGetFreeCellOr: Definition('OpGetFreeCellOr', 2),
+}
+
+# 二項演算と、定数を右辺に取る融合命令の対応
+fused_const_ops = {
+        OpAdd: OpAddConst,
+        OpSub: OpSubConst,
+        OpEqual: OpEqualConst,
+        OpNotEqual: OpNotEqualConst,
+        OpGreaterThan: OpGreaterThanConst,
+        OpLessThan: OpLessThanConst,
+}
+
+
+def lookup(op):
+    try:
+        return definitions[op]
+    except KeyError:
+        raise ValueError(f'opcode {op} undefined')
+
+
+def make(op, *operands):
+    """ 1 命令分のワード列を作る """
+    definition = lookup(op)
+    if len(operands) != definition.operand_count:
+        raise ValueError(f'{definition.name} takes {definition.operand_count} operands, got {len(operands)}')
+    return [op, *operands]
+
+
+def instructions_string(ins):
+    """ 命令列を逆アセンブルする。テストとデバッグ用 """
+    out = []
+    i = 0
+    while i < len(ins):
+        definition = lookup(ins[i])
+        operands = ins[i+1:i+1+definition.operand_count]
+        line = f'{i:04} {definition.name}'
+        if operands:
+            line += ' ' + ' '.join(str(o) for o in operands)
+        out.append(line)
+        i += 1 + definition.operand_count
+    return '\n'.join(out) + '\n' if out else ''
@@ -0,0 +1,669 @@
+""" AST をバイトコードに変換するコンパイラ """
+import b1u3ast, b1u3object, b1u3evaluator, b1u3code, b1u3resolver
+from b1u3code import make
+
+GLOBAL_SCOPE = 'GLOBAL'
+LOCAL_SCOPE = 'LOCAL'
+BUILTIN_SCOPE = 'BUILTIN'
+FREE_SCOPE = 'FREE'
+FUNCTION_SCOPE = 'FUNCTION'
+CELL_SCOPE = 'CELL' # スロットに Cell が入っているローカル変数
+FREE_CELL_SCOPE = 'FREE_CELL' # Cell を捕まえた自由変数
+
+
+class CompileError(Exception):
+    pass
+
+
+class Symbol():
+    name:str=None
+    scope:str=None
+    index:int=None
+    bound:bool=True # 自由変数のとき、値が入っていることがわかっているか
+
+    def __init__(self, name, scope, index, bound=True):
+        self.name = name
+        self.scope = scope
+        self.index = index
+        self.bound = bound
+
+    def __eq__(self, other):
+        return (self.name, self.scope, self.index) == (other.name, other.scope, other.index)
+
+    def __repr__(self):
+        return f'Symbol({self.name}, {self.scope}, {self.index})'
+
+
+class SymbolTable():
+    outer=None
+    store:dict=None
+    num_definitions:int=0
+    free_symbols:list=None
+    names:list=None # GLOBAL のインデックスから名前を引く
+    definite:set=None # コンパイル中の位置で必ず let されているローカル変数
+    captures:dict=None
+
+    def __init__(self, outer=None):
+        self.outer = outer
+        self.store = {}
+        self.num_definitions = 0
+        self.free_symbols = []
+        self.names = []
+        self.definite = set()
+        self.captures = {}
+
+    def define(self, name):
+        """ 同じスコープで再定義した場合は同じスロットを使う """
+        symbol = self.store.get(name)
+        if symbol is not None and symbol.scope in (GLOBAL_SCOPE, LOCAL_SCOPE, CELL_SCOPE):
+            return symbol
+        scope = GLOBAL_SCOPE if self.outer is None else LOCAL_SCOPE
+        symbol = Symbol(name, scope, self.num_definitions)
+        self.store[name] = symbol
+        self.names.append(name)
+        self.num_definitions += 1
+        return symbol
+
+    def define_builtin(self, index, name):
+        symbol = Symbol(name, BUILTIN_SCOPE, index)
+        self.store[name] = symbol
+        return symbol
+
+    def define_function_name(self, name):
+        symbol = Symbol(name, FUNCTION_SCOPE, 0)
+        self.store[name] = symbol
+        return symbol
+
+    def define_cell(self, name):
+        symbol = Symbol(name, CELL_SCOPE, self.define(name).index)
+        self.store[name] = symbol
+        return symbol
+
+    def define_free(self, original):
+        self.free_symbols.append(original)
+        if original.scope == CELL_SCOPE:
+            symbol = Symbol(original.name, FREE_CELL_SCOPE, len(self.free_symbols)-1,
+                    bound=original.name in self.outer.definite)
+        elif original.scope == FREE_CELL_SCOPE:
+            symbol = Symbol(original.name, FREE_CELL_SCOPE, len(self.free_symbols)-1, bound=original.bound)
+        else:
+            symbol = Symbol(original.name, FREE_SCOPE, len(self.free_symbols)-1)
+        self.store[original.name] = symbol
+        return symbol
+
+    def capture(self, original):
+        """ store には登録せずに外側の変数を自由変数にする。let より前の読み出しの代わりに使う """
+        key = (original.name, original.scope, original.index)
+        symbol = self.captures.get(key)
+        if symbol is None:
+            self.free_symbols.append(original)
+            scope = FREE_CELL_SCOPE if original.scope in (CELL_SCOPE, FREE_CELL_SCOPE) else FREE_SCOPE
+            bound = original.scope == FUNCTION_SCOPE or (original.scope in (FREE_SCOPE, FREE_CELL_SCOPE) and original.bound)
+            symbol = self.captures[key] = Symbol(original.name, scope, len(self.free_symbols)-1, bound=bound)
+        return symbol
+
+    def define_global(self, name):
+        """ まだ定義されていない名前を、実行時に解決するグローバルとして登録する """
+        table = self
+        while table.outer is not None:
+            table = table.outer
+        return table.define(name)
+
+    def resolve(self, name):
+        symbol = self.store.get(name)
+        if symbol is not None:
+            return symbol
+        if self.outer is None:
+            return None
+        symbol = self.outer.resolve(name)
+        if symbol is None:
+            return None
+        if symbol.scope in (GLOBAL_SCOPE, BUILTIN_SCOPE):
+            return symbol
+        return self.define_free(symbol)
+
+
+def function_slots(node):
+    """ 関数の本体をコンパイルする前に調べて (先に定義するローカル変数, セルにする変数) を返す
+
+    let より前に読まれうる変数は先に定義しておき、まだ値がなければ外側を読む。
+    内側の fn から参照される変数のうち、let し直されるか代入されるもの、let より前に
+    捕まえられうるものはセルにして、評価器と同じく後からの束縛が見えるようにする。
+    """
+    params = {p.value for p in node.parameters}
+    lets, rebound, captured = set(params), set(), set()
+    collect_bindings(node.body, lets, rebound, captured, False)
+    late = b1u3resolver.collect_late_reads(node.body.statements, set(params), set())
+    cells = lets & captured & (rebound | late)
+    return (lets & late) | (cells - params), cells
+
+
+def collect_bindings(node, lets, rebound, captured, in_loop):
+    """ 関数本体の let を lets に、束縛し直される名前を rebound に、内側の fn が参照する名前を captured に集める """
+    if isinstance(node, b1u3ast.LetStatement):
+        if in_loop or node.name.value in lets:
+            rebound.add(node.name.value)
+        lets.add(node.name.value)
+        collect_bindings(node.value, lets, rebound, captured, in_loop)
+    elif isinstance(node, b1u3ast.AssignStatement):
+        rebound.add(node.name.value)
+        collect_bindings(node.value, lets, rebound, captured, in_loop)
+    elif isinstance(node, b1u3ast.ForStatement):
+        lets.add(node.variable.value)
+        rebound.add(node.variable.value)
+        collect_bindings(node.iterable, lets, rebound, captured, in_loop)
+        collect_bindings(node.body, lets, rebound, captured, True)
+    elif isinstance(node, b1u3ast.WhileStatement):
+        collect_bindings(node.condition, lets, rebound, captured, True)
+        collect_bindings(node.body, lets, rebound, captured, True)
+    elif isinstance(node, b1u3ast.FunctionLiteral):
+        collect_references(node.body, captured, rebound)
+    elif not b1u3evaluator.is_quote_call(node):
+        for child in b1u3resolver.children(node):
+            collect_bindings(child, lets, rebound, captured, in_loop)
+
+
+def collect_references(node, names, assigned):
+    """ 内側の fn の中で読み書きされる名前を names に、代入される名前を assigned に集める """
+    if isinstance(node, b1u3ast.Identifier):
+        names.add(node.value)
+    elif isinstance(node, b1u3ast.AssignStatement):
+        names.add(node.name.value)
+        assigned.add(node.name.value)
+        collect_references(node.value, names, assigned)
+    elif isinstance(node, b1u3ast.FunctionLiteral):
+        collect_references(node.body, names, assigned)
+    elif not b1u3evaluator.is_quote_call(node):
+        for child in b1u3resolver.children(node):
+            collect_references(child, names, assigned)
+
+
+def new_symbol_table_with_builtins():
+    table = SymbolTable()
+    for i, name in enumerate(b1u3evaluator.builtins):
+        table.define_builtin(i, name)
+    return table
+
+
+class CompilationScope():
+    instructions:list=None
+    emitted:list=None # (opcode, position) の履歴。ピープホール最適化で使う
+    labels:set=None # ジャンプ先になっている位置
+
+    def __init__(self):
+        self.instructions = []
+        self.emitted = []
+        self.labels = set()
+
+
+class Bytecode():
+    instructions:list=None
+    constants:list=None
+    global_names:list=None
+
+    def __init__(self, instructions, constants, global_names):
+        self.instructions = instructions
+        self.constants = constants
+        self.global_names = global_names
+
+
+# 定数畳み込みに使う整数演算
+folding_ops = {
+        b1u3code.OpAdd: lambda a, b: a + b,
+        b1u3code.OpSub: lambda a, b: a - b,
+        b1u3code.OpMul: lambda a, b: a * b,
+        b1u3code.OpDiv: lambda a, b: a // b,
+        b1u3code.OpEqual: lambda a, b: a == b,
+        b1u3code.OpNotEqual: lambda a, b: a != b,
+        b1u3code.OpGreaterThan: lambda a, b: a > b,
+        b1u3code.OpLessThan: lambda a, b: a < b,
+}
+
+# let される前かもしれない変数を読む命令
+unbound_ops = {
+        LOCAL_SCOPE: b1u3code.OpGetLocalOr,
+        CELL_SCOPE: b1u3code.OpGetCellOr,
+        FREE_SCOPE: b1u3code.OpGetFreeOr,
+        FREE_CELL_SCOPE: b1u3code.OpGetFreeCellOr,
+}
+
+infix_ops = {
+        '+': b1u3code.OpAdd,
+        '-': b1u3code.OpSub,
+        '*': b1u3code.OpMul,
+        '/': b1u3code.OpDiv,
+        '==': b1u3code.OpEqual,
+        '!=': b1u3code.OpNotEqual,
+        '>': b1u3code.OpGreaterThan,
+        '<': b1u3code.OpLessThan,
+}
+
+
+class Compiler():
+    constants:list=None
+    symbol_table:SymbolTable=None
+    scopes:list=None
+    optimize:bool=True
+    handlers=None
+
+    def __init__(self, symbol_table=None, constants=None, optimize=True):
+        """ REPL では前回の symbol_table と constants を引き継ぐ """
+        self.constants = constants if constants is not None else []
+        self.symbol_table = symbol_table if symbol_table is not None else new_symbol_table_with_builtins()
+        self.scopes = [CompilationScope()]
+        self.optimize = optimize
+        self.function_name = None
+        self.handlers = {
+                b1u3ast.Program: self.compile_program,
+                b1u3ast.ExpressionStatement: self.compile_expression_statement,
+                b1u3ast.BlockStatement: self.compile_block_statement,
+                b1u3ast.LetStatement: self.compile_let_statement,
+                b1u3ast.ReturnStatement: self.compile_return_statement,
+                b1u3ast.AssignStatement: self.compile_assign_statement,
+                b1u3ast.WhileStatement: self.compile_while_statement,
+                b1u3ast.ForStatement: self.compile_for_statement,
+                b1u3ast.IntegerLiteral: self.compile_integer_literal,
+                b1u3ast.StringLiteral: self.compile_string_literal,
+                b1u3ast.Boolean: self.compile_boolean,
+                b1u3ast.PrefixExpression: self.compile_prefix_expression,
+                b1u3ast.InfixExpression: self.compile_infix_expression,
+                b1u3ast.IfExpression: self.compile_if_expression,
+                b1u3ast.Identifier: self.compile_identifier,
+                b1u3ast.ArrayLiteral: self.compile_array_literal,
+                b1u3ast.HashLiteral: self.compile_hash_literal,
+                b1u3ast.IndexExpression: self.compile_index_expression,
+                b1u3ast.FunctionLiteral: self.compile_function_literal,
+                b1u3ast.CallExpression: self.compile_call_expression,
+        }
+
+    def compile(self, node):
+        try:
+            handler = self.handlers[node.__class__]
+        except KeyError:
+            raise CompileError(f'cannot compile {node.__class__.__name__}')
+        handler(node)
+
+    def bytecode(self):
+        return Bytecode(self.current_instructions(), self.constants, self.global_names())
+
+    def global_names(self):
+        table = self.symbol_table
+        while table.outer is not None:
+            table = table.outer
+        return table.names
+
+    # --- statements ---
+
+    def compile_program(self, node):
+        for s in node.statements:
+            self.compile(s)
+        # トップレベルの最後の式が評価結果になる
+        if self.last_instruction_is(b1u3code.OpPop) and len(node.statements) > 0 \
+                and isinstance(node.statements[-1], b1u3ast.ExpressionStatement):
+            self.replace_last_pop_with_return()
+        elif not self.last_instruction_is(b1u3code.OpReturnValue):
+            self.emit(b1u3code.OpReturn)
+
+    def compile_expression_statement(self, node):
+        self.compile(node.expression)
+        self.emit(b1u3code.OpPop)
+
+    def compile_block_statement(self, node):
+        for s in node.statements:
+            self.compile(s)
+
+    def compile_let_statement(self, node):
+        if isinstance(node.value, b1u3ast.FunctionLiteral):
+            # 再帰呼び出しのために先に定義する
+            symbol = self.symbol_table.define(node.name.value)
+            self.function_name = node.name.value
+            self.compile(node.value)
+        else:
+            self.compile(node.value)
+            symbol = self.symbol_table.define(node.name.value)
+        self.store_symbol(symbol)
+        self.symbol_table.definite.add(node.name.value)
+
+    def compile_return_statement(self, node):
+        self.compile(node.return_value)
+        self.emit(b1u3code.OpReturnValue)
+
+    def compile_assign_statement(self, node):
+        """ 自由変数はセルになっているものだけ書き換えられる。function_slots が内側から代入される変数をセルにする """
+        symbol = self.symbol_table.resolve(node.name.value)
+        if symbol is None:
+            # まだ定義されていないグローバル。実行時にも未定義なら identifier not found になる
+            symbol = self.symbol_table.define_global(node.name.value)
+            self.load_symbol(symbol)
+            self.emit(b1u3code.OpPop)
+        elif symbol.scope not in (GLOBAL_SCOPE, LOCAL_SCOPE, CELL_SCOPE, FREE_CELL_SCOPE):
+            raise CompileError(f'cannot assign to {symbol.scope.lower()} variable {node.name.value}')
+        self.compile(node.value)
+        self.store_symbol(symbol)
+
+    def compile_while_statement(self, node):
+        loop_start = self.mark_label()
+        self.compile(node.condition)
+        exit_pos = self.emit(b1u3code.OpJumpNotTruthy, 9999)
+        definite = self.enter_block()
+        self.compile(node.body)
+        self.symbol_table.definite = definite
+        self.emit(b1u3code.OpJump, loop_start)
+        self.change_operand(exit_pos, self.mark_label())
+
+    def compile_for_statement(self, node):
+        """ ループの間はイテレータをスタックに置いておく """
+        self.compile(node.iterable)
+        self.emit(b1u3code.OpIter)
+        loop_start = self.mark_label()
+        next_pos = self.emit(b1u3code.OpIterNext, 9999)
+        definite = self.enter_block()
+        self.store_symbol(self.symbol_table.define(node.variable.value))
+        self.symbol_table.definite.add(node.variable.value)
+        self.compile(node.body)
+        self.symbol_table.definite = definite
+        self.emit(b1u3code.OpJump, loop_start)
+        self.change_operand(next_pos, self.mark_label())
+
+    # --- expressions ---
+
+    def compile_integer_literal(self, node):
+        self.emit(b1u3code.OpConstant, self.add_constant(b1u3object.Integer(value=node.value)))
+
+    def compile_string_literal(self, node):
+        self.emit(b1u3code.OpConstant, self.add_constant(b1u3object.String(value=node.value)))
+
+    def compile_boolean(self, node):
+        self.emit(b1u3code.OpTrue if node.value else b1u3code.OpFalse)
+
+    def compile_prefix_expression(self, node):
+        self.compile(node.right)
+        if node.operator == '!':
+            self.emit(b1u3code.OpBang)
+        elif node.operator == '-':
+            self.emit(b1u3code.OpMinus)
+        else:
+            raise CompileError(f'unknown operator {node.operator}')
+
+    def compile_infix_expression(self, node):
+        try:
+            op = infix_ops[node.operator]
+        except KeyError:
+            raise CompileError(f'unknown operator {node.operator}')
+        self.compile(node.left)
+        self.compile(node.right)
+        self.emit(op)
+
+    def compile_if_expression(self, node):
+        self.compile(node.condition)
+        jump_not_truthy_pos = self.emit(b1u3code.OpJumpNotTruthy, 9999)
+        self.compile_branch(node.consequence)
+        jump_pos = self.emit(b1u3code.OpJump, 9999)
+        self.change_operand(jump_not_truthy_pos, self.mark_label())
+        if node.alternative is None:
+            self.emit(b1u3code.OpNull)
+        else:
+            self.compile_branch(node.alternative)
+        self.change_operand(jump_pos, self.mark_label())
+
+    def compile_branch(self, block):
+        """ if の各分岐は値を 1 つスタックに残す """
+        definite = self.enter_block()
+        self.compile(block)
+        self.symbol_table.definite = definite
+        if self.last_instruction_is(b1u3code.OpPop) and len(block.statements) > 0 \
+                and isinstance(block.statements[-1], b1u3ast.ExpressionStatement):
+            self.remove_last_pop()
+        else:
+            self.emit(b1u3code.OpNull)
+
+    def compile_identifier(self, node):
+        symbol = self.symbol_table.resolve(node.value)
+        if symbol is None:
+            # 実行時に定義されていなければ identifier not found になる
+            symbol = self.symbol_table.define_global(node.value)
+        self.load_variable(symbol)
+
+    def compile_array_literal(self, node):
+        for e in node.elements:
+            self.compile(e)
+        self.emit(b1u3code.OpArray, len(node.elements))
+
+    def compile_hash_literal(self, node):
+        for k, v in node.pairs.items():
+            self.compile(k)
+            self.compile(v)
+        self.emit(b1u3code.OpHash, len(node.pairs)*2)
+
+    def compile_index_expression(self, node):
+        self.compile(node.left)
+        self.compile(node.index)
+        self.emit(b1u3code.OpIndex)
+
+    def compile_function_literal(self, node):
+        name, self.function_name = self.function_name, None
+        self.enter_scope()
+        if name is not None:
+            self.symbol_table.define_function_name(name)
+        for p in node.parameters:
+            self.symbol_table.define(p.value)
+            self.symbol_table.definite.add(p.value)
+        hoisted, cells = function_slots(node)
+        for n in sorted(hoisted | cells):
+            symbol = self.symbol_table.define_cell(n) if n in cells else self.symbol_table.define(n)
+            if n in cells:
+                self.emit(b1u3code.OpMakeCell, symbol.index)
+        self.compile(node.body)
+        if self.last_instruction_is(b1u3code.OpPop) and len(node.body.statements) > 0 \
+                and isinstance(node.body.statements[-1], b1u3ast.ExpressionStatement):
+            self.replace_last_pop_with_return()
+        if not self.last_instruction_is(b1u3code.OpReturnValue):
+            self.emit(b1u3code.OpReturn)
+        free_symbols = self.symbol_table.free_symbols
+        num_locals = self.symbol_table.num_definitions
+        instructions = self.leave_scope()
+        for s in free_symbols:
+            # セルは中身ではなく Cell そのものを渡す
+            if s.scope == CELL_SCOPE:
+                self.emit(b1u3code.OpGetLocal, s.index)
+            elif s.scope == FREE_CELL_SCOPE:
+                self.emit(b1u3code.OpGetFree, s.index)
+            else:
+                self.load_symbol(s)
+        fn = b1u3object.CompiledFunction(
+                instructions=instructions,
+                num_locals=num_locals,
+                num_parameters=len(node.parameters),
+                parameters=node.parameters,
+                body=node.body)
+        self.emit(b1u3code.OpClosure, self.add_constant(fn), len(free_symbols))
+
+    def compile_call_expression(self, node):
+        if node.function.symbol == b1u3evaluator.QUOTE_SYMBOL:
+            self.compile_quote(node)
+            return
+        self.compile(node.function)
+        for a in node.arguments:
+            self.compile(a)
+        self.emit(b1u3code.OpCall, len(node.arguments))
+
+    def compile_quote(self, node):
+        """ unquote を含まない quote だけは定数にできる """
+        def check(n):
+            if b1u3evaluator.is_unquote_call(n):
+                raise CompileError('unquote is only supported by the tree-walking evaluator')
+            return n
+        b1u3ast.modify(node.arguments[0], check)
+        self.emit(b1u3code.OpConstant, self.add_constant(b1u3object.Quote(node=node.arguments[0])))
+
+    # --- helpers ---
+
+    def load_symbol(self, symbol):
+        if symbol.scope == GLOBAL_SCOPE:
+            self.emit(b1u3code.OpGetGlobal, symbol.index)
+        elif symbol.scope == LOCAL_SCOPE:
+            self.emit(b1u3code.OpGetLocal, symbol.index)
+        elif symbol.scope == BUILTIN_SCOPE:
+            self.emit(b1u3code.OpGetBuiltin, symbol.index)
+        elif symbol.scope == FREE_SCOPE:
+            self.emit(b1u3code.OpGetFree, symbol.index)
+        elif symbol.scope == FUNCTION_SCOPE:
+            self.emit(b1u3code.OpCurrentClosure)
+        elif symbol.scope == CELL_SCOPE:
+            self.emit(b1u3code.OpGetCell, symbol.index)
+        elif symbol.scope == FREE_CELL_SCOPE:
+            self.emit(b1u3code.OpGetFreeCell, symbol.index)
+
+    def load_variable(self, symbol):
+        """ 変数を読む。let される前かもしれなければ、値がないときは外側の束縛を読む """
+        if symbol.scope in (LOCAL_SCOPE, CELL_SCOPE):
+            bound = symbol.name in self.symbol_table.definite
+        else:
+            bound = symbol.bound
+        if bound:
+            self.load_symbol(symbol)
+            return
+        pos = self.emit(unbound_ops[symbol.scope], symbol.index, 9999)
+        self.load_variable(self.resolve_outer(symbol))
+        self.current_instructions()[pos+2] = self.mark_label()
+
+    def resolve_outer(self, symbol):
+        """ symbol の変数を持つ関数の外側で同じ名前を解決し、今の関数から読める Symbol にする """
+        tables = [self.symbol_table]
+        s = symbol
+        while s.scope in (FREE_SCOPE, FREE_CELL_SCOPE):
+            s = tables[-1].free_symbols[s.index]
+            tables.append(tables[-1].outer)
+        outer = tables[-1].outer.resolve(symbol.name)
+        if outer is None:
+            return self.symbol_table.define_global(symbol.name)
+        if outer.scope in (GLOBAL_SCOPE, BUILTIN_SCOPE):
+            return outer
+        for table in reversed(tables):
+            outer = table.capture(outer)
+        return outer
+
+    def store_symbol(self, symbol):
+        if symbol.scope == GLOBAL_SCOPE:
+            self.emit(b1u3code.OpSetGlobal, symbol.index)
+        elif symbol.scope == CELL_SCOPE:
+            self.emit(b1u3code.OpSetCell, symbol.index)
+        elif symbol.scope == FREE_CELL_SCOPE:
+            self.emit(b1u3code.OpSetFreeCell, symbol.index)
+        else:
+            self.emit(b1u3code.OpSetLocal, symbol.index)
+
+    def add_constant(self, obj):
+        self.constants.append(obj)
+        return len(self.constants)-1
+
+    def current_scope(self):
+        return self.scopes[-1]
+
+    def current_instructions(self):
+        return self.current_scope().instructions
+
+    def emit(self, op, *operands):
+        """ 命令を追加し、その位置を返す """
+        if self.optimize:
+            pos = self.optimize_emit(op, operands)
+            if pos is not None:
+                return pos
+        return self.add_instruction(op, make(op, *operands))
+
+    def add_instruction(self, op, ins):
+        scope = self.current_scope()
+        pos = len(scope.instructions)
+        scope.instructions.extend(ins)
+        scope.emitted.append((op, pos))
+        return pos
+
+    def mark_label(self):
+        """ 現在位置をジャンプ先として記録する。ラベルを跨いだ命令は融合しない """
+        scope = self.current_scope()
+        pos = len(scope.instructions)
+        scope.labels.add(pos)
+        return pos
+
+    def trailing_constants(self, n):
+        """ 命令列の末尾が、間にジャンプ先を挟まない n 個の OpConstant ならその (位置, 定数) を返す """
+        scope = self.current_scope()
+        if len(scope.emitted) < n:
+            return None
+        tail = scope.emitted[-n:]
+        res = []
+        for op, pos in tail:
+            if op != b1u3code.OpConstant:
+                return None
+            res.append((pos, self.constants[scope.instructions[pos+1]]))
+        for pos, _ in res[1:]:
+            if pos in scope.labels:
+                return None
+        if len(scope.instructions) in scope.labels:
+            return None
+        return res
+
+    def truncate(self, pos, count):
+        scope = self.current_scope()
+        del scope.instructions[pos:]
+        del scope.emitted[-count:]
+
+    def optimize_emit(self, op, operands):
+        """ ピープホール最適化。定数畳み込みと、OpConstant + 二項演算の融合 """
+        if op == b1u3code.OpMinus:
+            consts = self.trailing_constants(1)
+            if consts is not None and isinstance(consts[0][1], b1u3object.Integer):
+                pos = consts[0][0]
+                self.truncate(pos, 1)
+                return self.emit(b1u3code.OpConstant, self.add_constant(b1u3object.Integer(value=-consts[0][1].value)))
+        if op in folding_ops:
+            consts = self.trailing_constants(2)
+            if consts is not None and isinstance(consts[0][1], b1u3object.Integer) \
+                    and isinstance(consts[1][1], b1u3object.Integer) \
+                    and not (op == b1u3code.OpDiv and consts[1][1].value == 0):
+                value = folding_ops[op](consts[0][1].value, consts[1][1].value)
+                self.truncate(consts[0][0], 2)
+                if isinstance(value, bool):
+                    return self.emit(b1u3code.OpTrue if value else b1u3code.OpFalse)
+                return self.emit(b1u3code.OpConstant, self.add_constant(b1u3object.Integer(value=value)))
+        if op in b1u3code.fused_const_ops:
+            consts = self.trailing_constants(1)
+            if consts is not None:
+                pos = consts[0][0]
+                const_index = self.current_instructions()[pos+1]
+                self.truncate(pos, 1)
+                fused = b1u3code.fused_const_ops[op]
+                return self.add_instruction(fused, make(fused, const_index))
+        return None
+
+    def last_instruction_is(self, op):
+        scope = self.current_scope()
+        if len(scope.emitted) == 0:
+            return False
+        return scope.emitted[-1][0] == op
+
+    def remove_last_pop(self):
+        _, pos = self.current_scope().emitted[-1]
+        self.truncate(pos, 1)
+
+    def replace_last_pop_with_return(self):
+        self.remove_last_pop()
+        self.add_instruction(b1u3code.OpReturnValue, make(b1u3code.OpReturnValue))
+
+    def change_operand(self, pos, operand):
+        self.current_instructions()[pos+1] = operand
+
+    def enter_block(self):
+        """ if や loop の本体に入る。中の let は外では必ずされているとは言えないので、戻すための集合を返す """
+        definite = self.symbol_table.definite
+        self.symbol_table.definite = set(definite)
+        return definite
+
+    def enter_scope(self):
+        self.scopes.append(CompilationScope())
+        self.symbol_table = SymbolTable(self.symbol_table)
+
+    def leave_scope(self):
+        scope = self.scopes.pop()
+        self.symbol_table = self.symbol_table.outer
+        return scope.instructions
@@ -0,0 +1,96 @@
+""" Monkey を Python から埋め込んで使うための入口
+
+    session = Session(engine='vm')
+    session.run('let a = 1;')
+    session.run('a + 1').inspect()  # '2'
+
+engine は 'eval' (木をたどる評価器)、'vm' (バイトコードコンパイラ + VM)、
+'py' (Python のコードに変換して実行)、'stack' (Python の再帰を使わない評価器)
+のどれか。
+"""
+import b1u3token, b1u3parser, b1u3object, b1u3evaluator, b1u3resolver, b1u3compiler, b1u3vm, b1u3transpiler, b1u3stackeval
+
+ENGINES = ('eval', 'vm', 'py', 'stack')
+
+
+class ParseError(Exception):
+    errors:list=None
+
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class Session():
+    """ 複数回の run の間で変数とマクロを引き継ぐ """
+    engine:str=None
+    env:b1u3object.Environment=None
+    macro_env:b1u3object.Environment=None
+
+    def __init__(self, engine='eval', max_depth=b1u3stackeval.DEFAULT_MAX_DEPTH):
+        if engine not in ENGINES:
+            raise ValueError(f'unknown engine: {engine}, want one of {", ".join(ENGINES)}')
+        self.engine = engine
+        self.env = b1u3object.Environment()
+        self.macro_env = b1u3object.Environment()
+        # vm 用の状態
+        self.symbol_table = b1u3compiler.new_symbol_table_with_builtins()
+        self.constants = []
+        self.globals = []
+        # py 用の状態
+        self.namespace = b1u3transpiler.Namespace()
+        # stack 用の状態
+        self.max_depth = max_depth
+
+    def parse(self, source):
+        """ source は str か、b1u3token.StreamLexer が読めるファイルやバッファ """
+        if type(source) is str:
+            lexer = b1u3token.Lexer(source)
+        else:
+            lexer = b1u3token.StreamLexer(source)
+        p = b1u3parser.Parser(lexer)
+        program = p.parse_program()
+        if len(p.errors) != 0:
+            raise ParseError(p.errors)
+        return program
+
+    def run(self, source):
+        """ source を評価して結果の Object を返す。構文エラーなら ParseError を投げる """
+        return self.eval_program(self.parse(source))
+
+    def run_file(self, path):
+        """ path のファイルを少しずつ読みながら字句に分けて評価する """
+        with open(path, 'rb') as f:
+            return self.eval_program(self.parse(f))
+
+    def eval_program(self, program):
+        b1u3evaluator.define_macros(program, self.macro_env)
+        expanded = b1u3evaluator.expand_macros(program, self.macro_env)
+        if self.engine == 'vm':
+            return self.run_vm(expanded)
+        elif self.engine == 'py':
+            return self.run_py(expanded)
+        b1u3resolver.resolve(expanded)
+        if self.engine == 'stack':
+            return b1u3stackeval.b1u3eval(expanded, self.env, max_depth=self.max_depth)
+        return b1u3evaluator.b1u3eval(expanded, self.env)
+
+    def run_vm(self, program):
+        compiler = b1u3compiler.Compiler(symbol_table=self.symbol_table, constants=self.constants)
+        try:
+            compiler.compile(program)
+        except b1u3compiler.CompileError as e:
+            return b1u3evaluator.new_error(f'compile error: {e}')
+        vm = b1u3vm.VM(compiler.bytecode(), globals=self.globals)
+        return vm.run()
+
+    def run_py(self, program):
+        try:
+            return self.namespace.run(program)
+        except b1u3compiler.CompileError as e:
+            return b1u3evaluator.new_error(f'compile error: {e}')
+
+
+def run(source, engine='eval', **kwargs):
+    """ source を新しい Session で評価する """
+    return Session(engine=engine, **kwargs).run(source)
@@ -1,95 +1,366 @@
-import b1u3ast, b1u3object, b1u3token
+import itertools
+import b1u3ast, b1u3object, b1u3token, b1u3intvec
 from typing import List, Dict
 
 TRUE = b1u3object.Boolean(value=True)
 FALSE = b1u3object.Boolean(value=False)
 NULL = b1u3object.Null()
+Frame = b1u3object.Frame
+UNSET = b1u3object.UNSET
+Integer = b1u3object.Integer
+new_integer = b1u3object.new_integer
+QUOTE_SYMBOL = b1u3token.QUOTE_SYMBOL
+
+# Opt-in tracing: a callable taking the node about to be evaluated.
+trace_hook = None
+
+
+def set_trace_hook(hook):
+    """ hook(node) を b1u3eval の呼び出しごとに呼ぶ。None で無効化 """
+    global trace_hook
+    trace_hook = hook
+
 
 def b1u3eval(node:b1u3ast.Node, env:Dict[str, b1u3object.Object]) -> b1u3object.Object:
-    print(node)
-    if isinstance(node, b1u3ast.Program):
+    if trace_hook is not None:
+        trace_hook(node)
+    try:
+        handler = handlers[node.__class__]
+    except KeyError:
+        handler = lookup_handler(node.__class__)
+    return handler(node, env)
+
+
+def lookup_handler(cls):
+    """ AST ノードのサブクラス用に MRO をたどってハンドラを探し、キャッシュする """
+    for base in cls.__mro__:
+        if base in handlers:
+            handlers[cls] = handlers[base]
+            return handlers[base]
+    handlers[cls] = eval_unknown_node
+    return eval_unknown_node
+
+
+def eval_program_node(node, env):
+    try:
         return eval_program(node.statements, env)
-    elif isinstance(node, b1u3ast.ExpressionStatement):
-        return b1u3eval(node.expression, env)
-    elif isinstance(node, b1u3ast.IntegerLiteral):
-        return b1u3object.Integer(value=node.value)
-    elif isinstance(node, b1u3ast.Boolean):
-        if node.value:
-            return TRUE
+    except RecursionError:
+        # Monkey の呼び出しは Python の再帰になるので、深すぎる再帰はここで Error にする
+        return new_error("maximum recursion depth exceeded")
+
+def eval_expression_statement(node, env):
+    return b1u3eval(node.expression, env)
+
+def eval_integer_literal(node, env):
+    obj = node.obj
+    if obj is None:
+        obj = node.obj = new_integer(node.value)
+    return obj
+
+def eval_boolean_literal(node, env):
+    if node.value:
+        return TRUE
+    else:
+        return FALSE
+
+def eval_prefix_node(node, env):
+    # then already ast node has right expression
+    right = b1u3eval(node.right, env)
+    if is_error(right):
+        return right
+    return eval_prefix_expression(node.operator, right, env)
+
+def eval_infix_node(node, env):
+    left = b1u3eval(node.left, env)
+    if type(left) is not Integer and is_error(left):
+        return left
+    right = b1u3eval(node.right, env)
+    if type(right) is Integer:
+        if type(left) is Integer:
+            # 型を調べ直さずに整数の演算をする
+            return eval_integer_infix_expression(node.operator, left, right, env)
+    elif is_error(right):
+        return right
+    return eval_infix_expression(node.operator, left, right, env)
+
+def eval_return_statement(node, env):
+    val = b1u3eval(node.return_value, env)
+    if is_error(val):
+        return val
+    return b1u3object.ReturnValue(value=val)
+
+def eval_let_statement(node, env):
+    val = b1u3eval(node.value, env)
+    if is_error(val):
+        return val
+    name = node.name
+    if name.slot is not None and type(env) is Frame:
+        env.slots[name.slot] = val
+    else:
+        env[name.value] = val
+
+def assign(name, val, env):
+    """ let 済みの name を val にする。どこにも let されていなければ Error を返す """
+    if name.slot is not None and type(env) is Frame:
+        frame = env
+        depth = name.depth
+        while depth:
+            frame = frame.outer
+            depth -= 1
+        if frame.slots[name.slot] is not UNSET:
+            frame.slots[name.slot] = val
+            return None
+    if not env.rebind(name.value, val):
+        return new_error("identifier not found: " + name.value)
+    return None
+
+def eval_assign_statement(node, env):
+    val = b1u3eval(node.value, env)
+    if is_error(val):
+        return val
+    return assign(node.name, val, env)
+
+def eval_while_statement(node, env):
+    condition = node.condition
+    statements = node.body.statements
+    while True:
+        cond = b1u3eval(condition, env)
+        if cond is FALSE or cond is NULL:
+            return None
+        if cond.tag is b1u3object.ERROR_OBJ:
+            return cond
+        # eval_block_statement と同じだが、1周ごとの呼び出しを減らすためにここに書く
+        for s in statements:
+            res = b1u3eval(s, env)
+            if res is not None and (res.tag is b1u3object.RETURN_VALUE_OBJ or res.tag is b1u3object.ERROR_OBJ):
+                return res
+
+def eval_for_statement(node, env):
+    seq = b1u3eval(node.iterable, env)
+    if is_error(seq):
+        return seq
+    elements = iterate(seq)
+    if type(elements) is b1u3object.Error:
+        return elements
+    name = node.variable
+    statements = node.body.statements
+    slot = name.slot if type(env) is Frame else None
+    for e in elements:
+        if e.tag is b1u3object.ERROR_OBJ:
+            return e
+        if slot is not None:
+            env.slots[slot] = e
         else:
-            return FALSE
-    elif isinstance(node, b1u3ast.PrefixExpression):
-        # then already ast node has right expression
-        right = b1u3eval(node.right, env)
-        if is_error(right):
-            return right
-        return eval_prefix_expression(node.operator, right, env)
-    elif isinstance(node, b1u3ast.InfixExpression):
-        left = b1u3eval(node.left, env)
-        if is_error(left):
-            return left
-        right = b1u3eval(node.right, env)
-        if is_error(right):
-            return right
-        return eval_infix_expression(node.operator, left, right, env)
-    elif isinstance(node, b1u3ast.BlockStatement):
-        return eval_block_statement(node, env)
+            env[name.value] = e
+        for s in statements:
+            res = b1u3eval(s, env)
+            if res is not None and (res.tag is b1u3object.RETURN_VALUE_OBJ or res.tag is b1u3object.ERROR_OBJ):
+                return res
+    return None
+
+def iterate(seq):
+    """ for 文で回す要素のイテレータを返す。回せない値なら Error """
+    if seq.tag is b1u3object.ARRAY_OBJ:
+        return iter(seq.elements)
+    elif seq.tag is b1u3object.LAZY_OBJ:
+        return seq.source()
+    elif seq.tag is b1u3object.VEC_OBJ:
+        return map(new_integer, seq.data.tolist())
+    return new_error(f"for loop over {seq.type()} not supported")
+
+def eval_function_literal(node, env):
+    if not node.tail_marked:
+        mark_tail_calls(node.body)
+        node.tail_marked = True
+    params = node.parameters
+    body = node.body
+    return b1u3object.Function(parameters=params, env=env, body=body, layout=node.layout)
+
+def eval_call_expression(node, env):
+    if node.function.symbol == QUOTE_SYMBOL:
+        return quote(node.arguments[0], env)
+    function = b1u3eval(node.function, env)
+    if is_error(function):
+        return function
+    args = eval_expressions(node.arguments, env)
+    if len(args) == 1 and is_error(args[0]):
+        return args[0]
+    if node.tail and isinstance(function, b1u3object.Function):
+        # 末尾呼び出しは呼び出し元の apply_function のループで実行する
+        return b1u3object.TailCall(fn=function, args=args)
+    return apply_function(function, args)
+
+def eval_string_literal(node, env):
+    obj = node.obj
+    if obj is None:
+        obj = node.obj = b1u3object.String(value=node.value)
+    return obj
+
+def eval_array_literal(node, env):
+    elements = eval_expressions(node.elements, env)
+    if len(elements) == 1 and is_error(elements[0]):
+        return elements[0]
+    return b1u3object.Array(elements=elements)
+
+def eval_index_node(node, env):
+    left = b1u3eval(node.left, env)
+    if is_error(left):
+        return left
+    index = b1u3eval(node.index, env)
+    if is_error(index):
+        return index
+    return eval_index_expression(left, index)
+
+def eval_unknown_node(node, env):
+    return NULL
+
+
+# Function と Builtin 以外の関数の呼び方。b1u3vm と b1u3transpiler が自分の関数の
+# クラスに apply(fn, args) を登録し、map などの組み込み関数から呼べるようにする
+appliers = {}
+
+
+def apply_function(fn, args):
+    while True:
+        applier = appliers.get(fn.__class__)
+        if applier is not None:
+            return applier(fn, args)
+        if isinstance(fn, b1u3object.Function):
+            if len(args) != len(fn.parameters):
+                return new_error(f"wrong number of arguments: want={len(fn.parameters)}, got={len(args)}")
+            if fn.layout is not None:
+                extended_env = b1u3object.new_frame(fn, args)
+            else:
+                extended_env = extend_function_env(fn, args)
+            evaluated = unwrap_return_value(b1u3eval(fn.body, extended_env))
+            if type(evaluated) is b1u3object.TailCall:
+                # トランポリン: Python のスタックを伸ばさずに次の関数を呼ぶ
+                fn = evaluated.fn
+                args = evaluated.args
+                continue
+            return evaluated
+        elif isinstance(fn, b1u3object.Builtin):
+            return fn.fn(*args)
+        elif type(fn) is b1u3object.Memo:
+            return apply_memo(fn, args)
+        else:
+            return new_error(f"not a function: {fn.type()}")
+
+
+def apply_memo(memo, args):
+    """ キャッシュにあれば環境を作らずに返す。Error はキャッシュしない """
+    key = memo_key(args)
+    if type(key) is b1u3object.Error:
+        return key
+    val = memo_lookup(memo, key)
+    if val is not None:
+        return val
+    val = apply_function(memo.fn, args)
+    if val is None or is_error(val):
+        return val
+    memo_store(memo, key, val)
+    return val
+
+
+def memo_key(args):
+    """ 引数の HashKey の組。キーにできない引数があれば Error """
+    key = []
+    for a in args:
+        if not isinstance(a, b1u3object.Hashable):
+            return new_error(f"unusable as memo key: {a.type()}")
+        key.append(a.hash_key())
+    return tuple(key)
+
+
+def memo_lookup(memo, key):
+    """ キャッシュにあればその値を、なければ None を返し、hits か misses を数える """
+    cache = memo.cache
+    val = cache.get(key)
+    if val is not None:
+        cache.move_to_end(key)
+        memo.hits += 1
+        return val
+    memo.misses += 1
+    return None
+
+
+def memo_store(memo, key, val):
+    """ 結果をキャッシュに入れ、max_entries を超えたら一番古いものを捨てる
+
+    b1u3stackeval と b1u3vm は関数の呼び出しを自分のスタックに積み、戻ったときにこれを呼ぶ。
+    """
+    cache = memo.cache
+    cache[key] = val
+    if len(cache) > memo.max_entries:
+        cache.popitem(last=False)
+        memo.evictions += 1
+
+
+def mark_tail_calls(body):
+    """ 関数本体の末尾位置にある CallExpression に tail を付ける
+
+    末尾位置は、本体の最後の式と、本体のどこかにある return の式。
+    if 式が末尾位置にあれば、その各分岐の最後の式も末尾位置になる。
+    """
+    if len(body.statements) > 0 and isinstance(body.statements[-1], b1u3ast.ExpressionStatement):
+        mark_tail_expression(body.statements[-1].expression)
+    mark_returns(body)
+
+
+def mark_tail_expression(exp):
+    if isinstance(exp, b1u3ast.CallExpression):
+        exp.tail = True
+    elif isinstance(exp, b1u3ast.IfExpression):
+        for block in (exp.consequence, exp.alternative):
+            if block is not None and len(block.statements) > 0 \
+                    and isinstance(block.statements[-1], b1u3ast.ExpressionStatement):
+                mark_tail_expression(block.statements[-1].expression)
+
+
+def mark_returns(node):
+    """ 内側の関数リテラルと quote の中は見ない """
+    if isinstance(node, b1u3ast.ReturnStatement):
+        mark_tail_expression(node.return_value)
+        mark_returns(node.return_value)
+    elif isinstance(node, (b1u3ast.BlockStatement, b1u3ast.Program)):
+        for s in node.statements:
+            mark_returns(s)
+    elif isinstance(node, b1u3ast.ExpressionStatement):
+        mark_returns(node.expression)
+    elif isinstance(node, (b1u3ast.LetStatement, b1u3ast.AssignStatement)):
+        mark_returns(node.value)
+    elif isinstance(node, b1u3ast.WhileStatement):
+        mark_returns(node.condition)
+        mark_returns(node.body)
+    elif isinstance(node, b1u3ast.ForStatement):
+        mark_returns(node.iterable)
+        mark_returns(node.body)
     elif isinstance(node, b1u3ast.IfExpression):
-        return eval_if_expression(node, env)
-    elif isinstance(node, b1u3ast.ReturnStatement):
-        val = b1u3eval(node.return_value, env)
-        if is_error(val):
-            return val
-        return b1u3object.ReturnValue(value=val)
-    elif isinstance(node, b1u3ast.LetStatement):
-        val = b1u3eval(node.value, env)
-        if is_error(val):
-            return val
-        env[node.name.value] = val
-    elif isinstance(node, b1u3ast.Identifier):
-        return eval_identifier(node, env)
-    elif isinstance(node, b1u3ast.FunctionLiteral):
-        params = node.parameters
-        body = node.body
-        return b1u3object.Function(parameters=params, env=env, body=body)
+        mark_returns(node.condition)
+        mark_returns(node.consequence)
+        if node.alternative is not None:
+            mark_returns(node.alternative)
+    elif isinstance(node, b1u3ast.InfixExpression):
+        mark_returns(node.left)
+        mark_returns(node.right)
+    elif isinstance(node, b1u3ast.PrefixExpression):
+        mark_returns(node.right)
+    elif isinstance(node, b1u3ast.IndexExpression):
+        mark_returns(node.left)
+        mark_returns(node.index)
     elif isinstance(node, b1u3ast.CallExpression):
-        if node.function.token_literal() == "quote":
-            return quote(node.arguments[0], env)
-        function = b1u3eval(node.function, env)
-        if is_error(function):
-            return function
-        args = eval_expressions(node.arguments, env)
-        if len(args) == 1 and is_error(args[0]):
-            return args[0]
-        return apply_function(function, args)
-    elif isinstance(node, b1u3ast.StringLiteral):
-        return b1u3object.String(value=node.value)
+        if node.function.symbol == QUOTE_SYMBOL:
+            return
+        mark_returns(node.function)
+        for a in node.arguments:
+            mark_returns(a)
     elif isinstance(node, b1u3ast.ArrayLiteral):
-        elements = eval_expressions(node.elements, env)
-        if len(elements) == 1 and is_error(elements[0]):
-            return [0]
-        return b1u3object.Array(elements=elements)
-    elif isinstance(node, b1u3ast.IndexExpression):
-        left = b1u3eval(node.left, env)
-        if is_error(left):
-            return left
-        index = b1u3eval(node.index, env)
-        if is_error(index):
-            return index
-        return eval_index_expression(left, index)
+        for e in node.elements:
+            mark_returns(e)
     elif isinstance(node, b1u3ast.HashLiteral):
-        return eval_hash_literal(node, env)
-    return NULL
-
-def apply_function(fn, args):
-    if isinstance(fn, b1u3object.Function):
-        extended_env = extend_function_env(fn, args)
-        evaluated = b1u3eval(fn.body, extended_env)
-        return unwrap_return_value(evaluated)
-    elif isinstance(fn, b1u3object.Builtin):
-        return fn.fn(*args)
-    else:
-        return new_error(f"not a function: {fn.type()}")
+        for k, v in node.pairs.items():
+            mark_returns(k)
+            mark_returns(v)
 
 
 def extend_function_env(fn, args):
@@ -111,16 +382,10 @@ def eval_expressions(exps, env):
     for e in exps:
         evaluated = b1u3eval(e, env)
         if is_error(evaluated):
-            return b1u3object.Object(evaluated=evaluated)
+            return [evaluated]
         res.append(evaluated)
     return res
 
-def eval_identifier(node: b1u3ast.Node, env:Dict[str, b1u3object.Object]):
-    try:
-        return env[node.value]
-    except KeyError:
-        return new_error(f"identifier not found: {node.value}")
-
 def eval_prefix_expression(operator, right, env):
     if operator == '!':
         return eval_bang_operator_expression(right, env)
@@ -130,10 +395,10 @@ def eval_prefix_expression(operator, right, env):
         return new_error(f'unknown operator: {operator}{right.type()}')
 
 def eval_minus_operator_expression(right, env):
-    if right.type() != b1u3object.INTEGER_OBJ:
+    if right.tag is not b1u3object.INTEGER_OBJ:
         return new_error(f'unknown operator: -{right.type()}')
     value = right.value
-    return b1u3object.Integer(value=-value)
+    return new_integer(-value)
 
 def eval_bang_operator_expression(right, env):
     if right == TRUE:
@@ -147,7 +412,7 @@ def eval_bang_operator_expression(right, env):
 
 
 def eval_program(stmts:List[b1u3ast.Statement], env) -> b1u3object.Object:
-    res = b1u3object.Object()
+    res = None
     for statement in stmts:
         res = b1u3eval(statement, env)
         if isinstance(res, b1u3object.ReturnValue):
@@ -158,15 +423,18 @@ def eval_program(stmts:List[b1u3ast.Statement], env) -> b1u3object.Object:
 
 
 def eval_infix_expression(operator, left, right, env):
-    if left.type() == b1u3object.INTEGER_OBJ and right.type() == b1u3object.INTEGER_OBJ:
+    if left.tag is b1u3object.INTEGER_OBJ and right.tag is b1u3object.INTEGER_OBJ:
         return eval_integer_infix_expression(operator, left, right, env)
-    elif left.type() == b1u3object.STRING_OBJ and right.type() == b1u3object.STRING_OBJ:
+    elif left.tag is b1u3object.STRING_OBJ and right.tag is b1u3object.STRING_OBJ:
         return eval_string_infix_expression(operator, left, right, env)
+    elif (left.tag is b1u3object.VEC_OBJ or right.tag is b1u3object.VEC_OBJ) and \
+            left.tag in vec_operands and right.tag in vec_operands:
+        return eval_vec_infix_expression(operator, left, right, env)
     elif operator == '==':
         return TRUE if left == right else FALSE
     elif operator == '!=':
         return TRUE if left != right else FALSE
-    elif left.type() != right.type():
+    elif left.tag is not right.tag:
         return new_error(f"type mismatch: {left.type()} {operator} {right.type()}")
     else:
         return new_error(f"unknown operator: {left.type()} {operator} {right.type()}")
@@ -174,13 +442,13 @@ def eval_infix_expression(operator, left, right, env):
 
 def eval_integer_infix_expression(operator, left, right, env):
     if operator == '+':
-        return b1u3object.Integer(value=left.value+right.value)
+        return new_integer(left.value+right.value)
     elif operator == '-':
-        return b1u3object.Integer(value=left.value-right.value)
+        return new_integer(left.value-right.value)
     elif operator == '*':
-        return b1u3object.Integer(value=left.value*right.value)
+        return new_integer(left.value*right.value)
     elif operator == '/':
-        return b1u3object.Integer(value=left.value//right.value)
+        return new_integer(left.value//right.value)
     elif operator == '<':
         return TRUE if left.value < right.value else FALSE
     elif operator == '>':
@@ -218,7 +486,7 @@ def eval_block_statement(block, env):
     res = None
     for s in block.statements:
         res = b1u3eval(s, env)
-        if res is not None and (res.type() == b1u3object.RETURN_VALUE_OBJ or res.type() == b1u3object.ERROR_OBJ):
+        if res is not None and (res.tag is b1u3object.RETURN_VALUE_OBJ or res.tag is b1u3object.ERROR_OBJ):
             return res
     return res
 
@@ -228,24 +496,48 @@ def new_error(msg:str):
 
 def is_error(obj)->bool:
     if obj is not None:
-        return obj.type() == b1u3object.ERROR_OBJ
+        return obj.tag is b1u3object.ERROR_OBJ
     return False
 
 
 def eval_string_infix_expression(operator, left, right, env):
     if operator == '+':
-        return b1u3object.String(value=left.value+right.value)
+        return b1u3object.concat_strings(left, right)
     else:
         return new_error(f"unknown operator: {left.type()} {operator} {right.type()}")
 
 
+# VEC と組み合わせて要素ごとに計算できる型
+vec_operands = (b1u3object.VEC_OBJ, b1u3object.INTEGER_OBJ)
+
+
+def eval_vec_infix_expression(operator, left, right, env):
+    """ VEC と VEC、VEC と INTEGER の要素ごとの演算。比較は BOOLEAN の ARRAY を返す """
+    a = left.data if left.tag is b1u3object.VEC_OBJ else left.value
+    b = right.data if right.tag is b1u3object.VEC_OBJ else right.value
+    if left.tag is right.tag and len(a) != len(b):
+        return new_error(f"length mismatch: VEC({len(a)}) {operator} VEC({len(b)})")
+    try:
+        if operator in b1u3intvec.arithmetic:
+            return b1u3object.Vec(data=b1u3intvec.arith(operator, a, b))
+        elif operator in b1u3intvec.comparisons:
+            return b1u3object.Array(elements=[TRUE if v else FALSE for v in b1u3intvec.compare(operator, a, b)])
+    except ZeroDivisionError:
+        return new_error(f"division by zero: {left.type()} / {right.type()}")
+    except OverflowError:
+        return new_error(f"integer overflow: {left.type()} {operator} {right.type()}")
+    return new_error(f"unknown operator: {left.type()} {operator} {right.type()}")
+
+
 def len_function(*args):
     if len(args) != 1:
         return new_error(f"wrong number of arguments. got={len(args)}, want=1")
     if isinstance(args[0], b1u3object.String):
-        return b1u3object.Integer(value=len(args[0].value))
+        return new_integer(args[0].length)
     elif isinstance(args[0], b1u3object.Array):
-        return b1u3object.Integer(value=len(args[0].elements))
+        return new_integer(len(args[0].elements))
+    elif args[0].tag is b1u3object.VEC_OBJ:
+        return new_integer(len(args[0].data))
     return new_error(f"argument to `len` not supported, got {args[0].type()}")
 
 def first_function(*args):
@@ -253,38 +545,407 @@ def first_function(*args):
         return new_error(f"wrong number of arguments. got={len(args)}, want=1")
     if not isinstance(args[0], b1u3object.Array):
         return new_error(f"argument to `first` must be ARRAY, got {args[0].type()}")
-    if len(args[0].Elements) > 0:
-        return arr.elements[0]
+    elements = args[0].elements
+    if len(elements) > 0:
+        return elements[0]
     return NULL
 
 def last_function(*args):
     if len(args) != 1:
         return new_error(f"wrong number of arguments. got={len(args)}, want=1")
     if not isinstance(args[0], b1u3object.Array):
-        return new_error(f"argument to `first` must be ARRAY, got {args[0].type()}")
-    if len(args[0].elements) > 0:
-        return arr.elements[len(arr.elements)-1]
+        return new_error(f"argument to `last` must be ARRAY, got {args[0].type()}")
+    elements = args[0].elements
+    if len(elements) > 0:
+        return elements[len(elements)-1]
     return NULL
 
 def rest_function(*args):
     if len(args) != 1:
         return new_error(f"wrong number of arguments. got={len(args)}, want=1")
-    if args[0].type () != b1u3object.ARRAY_OBJ:
+    if args[0].tag is not b1u3object.ARRAY_OBJ:
         return new_error(f"argument to `rest` must be ARRAY, got {args[0].type()}")
     if len(args[0].elements) > 0:
-        new_elements = args[0].elements.copy()[1:len(args[0].elements)]
-        return b1u3object.Array(elements=new_elements)
+        return b1u3object.Array(elements=args[0].elements.rest())
     return NULL
 
+def slice_function(*args):
+    if len(args) != 3:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=3")
+    if args[0].tag is not b1u3object.ARRAY_OBJ:
+        return new_error(f"argument to `slice` must be ARRAY, got {args[0].type()}")
+    for a in args[1:]:
+        if a.tag is not b1u3object.INTEGER_OBJ:
+            return new_error(f"argument to `slice` must be INTEGER, got {a.type()}")
+    return b1u3object.Array(elements=args[0].elements.slice(args[1].value, args[2].value))
+
 def push_function(*args):
     if len(args) != 2:
         return new_error(f"wrong number of arguments. got={len(args)}, want=2")
-    if args[0].type() != b1u3object.ARRAY_OBJ:
+    if args[0].tag is not b1u3object.ARRAY_OBJ:
         return new_error(f"argument to `push` must be ARRAY, got {args[0].type()}")
+    return b1u3object.Array(elements=args[0].elements.append(args[1]))
+
+
+def check_hash_args(name, args, want, key=True):
+    """ Hash を受け取る組み込み関数の引数を調べる。問題があれば Error を返す
+
+    key が真なら 2 番目の引数をキーとして使えるか調べる。
+    """
+    if len(args) != want:
+        return new_error(f"wrong number of arguments. got={len(args)}, want={want}")
+    if args[0].tag is not b1u3object.HASH_OBJ:
+        return new_error(f"argument to `{name}` must be HASH, got {args[0].type()}")
+    if want > 1 and key and not isinstance(args[1], b1u3object.Hashable):
+        return new_error(f"unusable as hash key: {args[1].type()}")
+    return None
+
+def set_function(*args):
+    err = check_hash_args('set', args, 3)
+    if err is not None:
+        return err
+    key = args[1]
+    return b1u3object.Hash(pairs=args[0].pairs.set(key.hash_key(), b1u3object.HashPair(key=key, value=args[2])))
+
+def delete_function(*args):
+    err = check_hash_args('delete', args, 2)
+    if err is not None:
+        return err
+    pairs = args[0].pairs.delete(args[1].hash_key())
+    if pairs is args[0].pairs:
+        return args[0]
+    return b1u3object.Hash(pairs=pairs)
+
+def merge_function(*args):
+    err = check_hash_args('merge', args, 2, key=False)
+    if err is not None:
+        return err
+    if args[1].tag is not b1u3object.HASH_OBJ:
+        return new_error(f"argument to `merge` must be HASH, got {args[1].type()}")
+    return b1u3object.Hash(pairs=args[0].pairs.merge(args[1].pairs))
+
+def keys_function(*args):
+    err = check_hash_args('keys', args, 1)
+    if err is not None:
+        return err
+    return b1u3object.Array(elements=[p.key for p in args[0].sorted_pairs()])
+
+def values_function(*args):
+    err = check_hash_args('values', args, 1)
+    if err is not None:
+        return err
+    return b1u3object.Array(elements=[p.value for p in args[0].sorted_pairs()])
+
+def has_function(*args):
+    err = check_hash_args('has', args, 2)
+    if err is not None:
+        return err
+    return TRUE if args[1].hash_key() in args[0].pairs else FALSE
+
+
+def check_string_args(name, args, want):
+    """ 引数が want 個の STRING か調べる。問題があれば Error を返す """
+    if len(args) != want:
+        return new_error(f"wrong number of arguments. got={len(args)}, want={want}")
+    for a in args:
+        if a.tag is not b1u3object.STRING_OBJ:
+            return new_error(f"argument to `{name}` must be STRING, got {a.type()}")
+    return None
+
+def split_function(*args):
+    err = check_string_args('split', args, 2)
+    if err is not None:
+        return err
+    s, sep = args[0].value, args[1].value
+    parts = s.split(sep) if sep != "" else list(s)
+    return b1u3object.Array(elements=[b1u3object.String(value=p) for p in parts])
+
+def join_function(*args):
+    if len(args) != 2:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=2")
+    if args[0].tag is not b1u3object.ARRAY_OBJ:
+        return new_error(f"argument to `join` must be ARRAY, got {args[0].type()}")
+    if args[1].tag is not b1u3object.STRING_OBJ:
+        return new_error(f"argument to `join` must be STRING, got {args[1].type()}")
+    parts = []
+    for e in args[0].elements:
+        if e.tag is not b1u3object.STRING_OBJ:
+            return new_error(f"argument to `join` must be ARRAY of STRING, got {e.type()}")
+        parts.append(e.value)
+    return b1u3object.String(value=args[1].value.join(parts))
+
+def substr_function(*args):
+    if len(args) != 3:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=3")
+    if args[0].tag is not b1u3object.STRING_OBJ:
+        return new_error(f"argument to `substr` must be STRING, got {args[0].type()}")
+    for a in args[1:]:
+        if a.tag is not b1u3object.INTEGER_OBJ:
+            return new_error(f"argument to `substr` must be INTEGER, got {a.type()}")
+    # substr(s, start, length)。範囲は文字列の中に丸める
+    start = max(args[1].value, 0)
+    length = max(args[2].value, 0)
+    return b1u3object.String(value=args[0].value[start:start+length])
+
+def index_of_function(*args):
+    err = check_string_args('index_of', args, 2)
+    if err is not None:
+        return err
+    return new_integer(args[0].value.find(args[1].value))
+
+def replace_function(*args):
+    err = check_string_args('replace', args, 3)
+    if err is not None:
+        return err
+    return b1u3object.String(value=args[0].value.replace(args[1].value, args[2].value))
+
+def upper_function(*args):
+    err = check_string_args('upper', args, 1)
+    if err is not None:
+        return err
+    return b1u3object.String(value=args[0].value.upper())
+
+def lower_function(*args):
+    err = check_string_args('lower', args, 1)
+    if err is not None:
+        return err
+    return b1u3object.String(value=args[0].value.lower())
+
+def contains_function(*args):
+    err = check_string_args('contains', args, 2)
+    if err is not None:
+        return err
+    return TRUE if args[1].value in args[0].value else FALSE
+
+
+# map などが要素を順に取り出せる型
+sequence_tags = (b1u3object.ARRAY_OBJ, b1u3object.LAZY_OBJ)
+
+
+def check_callback_args(name, args, want):
+    """ (ARRAY か LAZY, ..., 関数) を受け取る組み込み関数の引数を調べる """
+    if len(args) not in want:
+        return new_error(f"wrong number of arguments. got={len(args)}, want={want[-1]}")
+    if args[0].tag not in sequence_tags:
+        return new_error(f"argument to `{name}` must be ARRAY, got {args[0].type()}")
+    return None
+
+def elements_of(seq):
+    """ ARRAY なら要素の Vector、LAZY なら要素を作るイテレータ """
+    if seq.tag is b1u3object.ARRAY_OBJ:
+        return seq.elements
+    return seq.source()
+
+def map_function(*args):
+    err = check_callback_args('map', args, (2,))
+    if err is not None:
+        return err
+    fn = args[1]
+    res = []
+    for e in elements_of(args[0]):
+        if e.tag is b1u3object.ERROR_OBJ:
+            return e
+        v = apply_function(fn, [e])
+        if is_error(v):
+            return v
+        res.append(v)
+    return b1u3object.Array(elements=res)
+
+def filter_function(*args):
+    err = check_callback_args('filter', args, (2,))
+    if err is not None:
+        return err
+    fn = args[1]
+    res = []
+    for e in elements_of(args[0]):
+        if e.tag is b1u3object.ERROR_OBJ:
+            return e
+        v = apply_function(fn, [e])
+        if is_error(v):
+            return v
+        if is_truthy(v):
+            res.append(e)
+    return b1u3object.Array(elements=res)
+
+def reduce_function(*args):
+    err = check_callback_args('reduce', args, (3,))
+    if err is not None:
+        return err
+    acc = args[1]
+    fn = args[2]
+    for e in elements_of(args[0]):
+        if e.tag is b1u3object.ERROR_OBJ:
+            return e
+        acc = apply_function(fn, [acc, e])
+        if is_error(acc):
+            return acc
+    return acc
+
+def sum_function(*args):
+    if len(args) == 1 and args[0].tag is b1u3object.VEC_OBJ:
+        return new_integer(b1u3intvec.total(args[0].data))
+    err = check_callback_args('sum', args, (1,))
+    if err is not None:
+        return err
+    total = 0
+    for e in elements_of(args[0]):
+        if e.tag is not b1u3object.INTEGER_OBJ:
+            if e.tag is b1u3object.ERROR_OBJ:
+                return e
+            return new_error(f"argument to `sum` must be ARRAY of INTEGER, got {e.type()}")
+        total += e.value
+    return new_integer(total)
+
+def any_function(*args):
+    """ any(arr) は要素そのもの、any(arr, f) は f(要素) が真のものがあるか """
+    err = check_callback_args('any', args, (1, 2))
+    if err is not None:
+        return err
+    for e in elements_of(args[0]):
+        v = apply_function(args[1], [e]) if len(args) == 2 and e.tag is not b1u3object.ERROR_OBJ else e
+        if is_error(v):
+            return v
+        if is_truthy(v):
+            return TRUE
+    return FALSE
+
+def all_function(*args):
+    """ all(arr) は要素そのもの、all(arr, f) は f(要素) が全部真か """
+    err = check_callback_args('all', args, (1, 2))
+    if err is not None:
+        return err
+    for e in elements_of(args[0]):
+        v = apply_function(args[1], [e]) if len(args) == 2 and e.tag is not b1u3object.ERROR_OBJ else e
+        if is_error(v):
+            return v
+        if not is_truthy(v):
+            return FALSE
+    return TRUE
+
+def check_range_args(name, args):
+    """ range の引数を調べる。問題があれば Error を返す """
+    if len(args) not in (1, 2, 3):
+        return new_error(f"wrong number of arguments. got={len(args)}, want=3")
+    for a in args:
+        if a.tag is not b1u3object.INTEGER_OBJ:
+            return new_error(f"argument to `{name}` must be INTEGER, got {a.type()}")
+    if len(args) == 3 and args[2].value == 0:
+        return new_error(f"argument to `{name}` must not be zero step")
+    return None
+
+def range_function(*args):
+    """ range(end), range(start, end), range(start, end, step) """
+    err = check_range_args('range', args)
+    if err is not None:
+        return err
+    bounds = [a.value for a in args]
+    return b1u3object.Array(elements=[new_integer(i) for i in range(*bounds)])
+
+def lazy_range_function(*args):
+    """ range と同じ引数で、要素を取り出すときに作る LAZY を返す """
+    err = check_range_args('lazy_range', args)
+    if err is not None:
+        return err
+    bounds = [a.value for a in args]
+    return b1u3object.Lazy(source=lambda: map(new_integer, range(*bounds)))
+
+def lazy_map_function(*args):
+    err = check_callback_args('lazy_map', args, (2,))
+    if err is not None:
+        return err
+    seq, fn = args
+    def source():
+        for e in elements_of(seq):
+            v = e if e.tag is b1u3object.ERROR_OBJ else apply_function(fn, [e])
+            yield v
+            if is_error(v):
+                return
+    return b1u3object.Lazy(source=source)
+
+def lazy_filter_function(*args):
+    err = check_callback_args('lazy_filter', args, (2,))
+    if err is not None:
+        return err
+    seq, fn = args
+    def source():
+        for e in elements_of(seq):
+            v = e if e.tag is b1u3object.ERROR_OBJ else apply_function(fn, [e])
+            if is_error(v):
+                yield v
+                return
+            if is_truthy(v):
+                yield e
+    return b1u3object.Lazy(source=source)
+
+def take_function(*args):
+    """ 先頭の n 個だけの LAZY を返す。残りの要素は作らない """
+    err = check_callback_args('take', args, (2,))
+    if err is not None:
+        return err
+    seq, n = args
+    if n.tag is not b1u3object.INTEGER_OBJ or n.value < 0:
+        return new_error(f"argument to `take` must be non-negative INTEGER, got {n.inspect()}")
+    return b1u3object.Lazy(source=lambda: itertools.islice(elements_of(seq), n.value))
+
+def collect_function(*args):
+    """ LAZY の要素を全部作って ARRAY にする """
+    err = check_callback_args('collect', args, (1,))
+    if err is not None:
+        return err
+    if args[0].tag is b1u3object.ARRAY_OBJ:
+        return args[0]
+    res = []
+    for e in args[0].source():
+        if e.tag is b1u3object.ERROR_OBJ:
+            return e
+        res.append(e)
+    return b1u3object.Array(elements=res)
+
+
+def vec_function(*args):
+    """ INTEGER だけの ARRAY を VEC にする。ほかの要素や int64 に入らない値があれば ARRAY のまま返す """
+    if len(args) != 1:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=1")
     arr = args[0]
-    new_ele = arr.elements.copy()
-    new_ele.append(args[1])
-    return b1u3object.Array(elements=new_ele)
+    if arr.tag is b1u3object.VEC_OBJ:
+        return arr
+    if arr.tag is not b1u3object.ARRAY_OBJ:
+        return new_error(f"argument to `vec` must be ARRAY, got {arr.type()}")
+    values = []
+    for e in arr.elements:
+        if e.tag is not b1u3object.INTEGER_OBJ:
+            return arr
+        values.append(e.value)
+    data = b1u3intvec.from_ints(values)
+    if data is None:
+        return arr
+    return b1u3object.Vec(data=data)
+
+
+def memo_function(*args):
+    """ fn の結果を引数ごとに最大 max_entries 個まで覚える関数を返す """
+    if len(args) != 2:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=2")
+    fn, n = args
+    if not isinstance(fn, (b1u3object.Function, b1u3object.Builtin, b1u3object.Memo)):
+        return new_error(f"argument to `memo` must be FUNCTION, got {fn.type()}")
+    if n.tag is not b1u3object.INTEGER_OBJ or n.value < 1:
+        return new_error(f"argument to `memo` must be positive INTEGER, got {n.inspect()}")
+    return b1u3object.Memo(fn=fn, max_entries=n.value)
+
+def memo_stats_function(*args):
+    """ {"hits": ..., "misses": ..., "evictions": ..., "size": ...} を返す """
+    if len(args) != 1:
+        return new_error(f"wrong number of arguments. got={len(args)}, want=1")
+    memo = args[0]
+    if type(memo) is not b1u3object.Memo:
+        return new_error(f"argument to `memo_stats` must be memo, got {memo.type()}")
+    pairs = {}
+    for name, value in [('hits', memo.hits), ('misses', memo.misses),
+                        ('evictions', memo.evictions), ('size', len(memo.cache))]:
+        key = b1u3object.String(value=name)
+        pairs[key.hash_key()] = b1u3object.HashPair(key=key, value=new_integer(value))
+    return b1u3object.Hash(pairs=pairs)
 
 
 def puts_function(*args):
@@ -299,10 +960,58 @@ builtins = {
         "last": b1u3object.Builtin(fn=last_function),
         "rest": b1u3object.Builtin(fn=rest_function),
         "push": b1u3object.Builtin(fn=push_function),
+        "slice": b1u3object.Builtin(fn=slice_function),
+        "set": b1u3object.Builtin(fn=set_function),
+        "delete": b1u3object.Builtin(fn=delete_function),
+        "merge": b1u3object.Builtin(fn=merge_function),
+        "keys": b1u3object.Builtin(fn=keys_function),
+        "values": b1u3object.Builtin(fn=values_function),
+        "has": b1u3object.Builtin(fn=has_function),
+        "split": b1u3object.Builtin(fn=split_function),
+        "join": b1u3object.Builtin(fn=join_function),
+        "substr": b1u3object.Builtin(fn=substr_function),
+        "index_of": b1u3object.Builtin(fn=index_of_function),
+        "replace": b1u3object.Builtin(fn=replace_function),
+        "upper": b1u3object.Builtin(fn=upper_function),
+        "lower": b1u3object.Builtin(fn=lower_function),
+        "contains": b1u3object.Builtin(fn=contains_function),
+        "map": b1u3object.Builtin(fn=map_function),
+        "filter": b1u3object.Builtin(fn=filter_function),
+        "reduce": b1u3object.Builtin(fn=reduce_function),
+        "sum": b1u3object.Builtin(fn=sum_function),
+        "any": b1u3object.Builtin(fn=any_function),
+        "all": b1u3object.Builtin(fn=all_function),
+        "range": b1u3object.Builtin(fn=range_function),
+        "vec": b1u3object.Builtin(fn=vec_function),
+        "lazy_range": b1u3object.Builtin(fn=lazy_range_function),
+        "lazy_map": b1u3object.Builtin(fn=lazy_map_function),
+        "lazy_filter": b1u3object.Builtin(fn=lazy_filter_function),
+        "take": b1u3object.Builtin(fn=take_function),
+        "collect": b1u3object.Builtin(fn=collect_function),
+        "memo": b1u3object.Builtin(fn=memo_function),
+        "memo_stats": b1u3object.Builtin(fn=memo_stats_function),
         "puts": b1u3object.Builtin(fn=puts_function)
 }
 
 def eval_identifier(node, env):
+    # b1u3resolver で解決済みなら名前で探さない
+    if type(env) is Frame:
+        if node.slot is not None:
+            frame = env
+            depth = node.depth
+            while depth:
+                frame = frame.outer
+                depth -= 1
+            val = frame.slots[node.slot]
+            if val is not UNSET:
+                return val
+        elif node.scope is not None:
+            val = env.globals.store.get(node.value, UNSET)
+            if val is not UNSET:
+                return val
+            val = builtins.get(node.value)
+            if val is not None:
+                return val
     try:
         return env[node.value]
     except KeyError:
@@ -312,12 +1021,14 @@ def eval_identifier(node, env):
             return new_error("identifier not found: " + node.value)
 
 def eval_index_expression(left, index):
-    if left.type() == b1u3object.ARRAY_OBJ and index.type() == b1u3object.INTEGER_OBJ:
+    if left.tag is b1u3object.ARRAY_OBJ and index.tag is b1u3object.INTEGER_OBJ:
         return eval_array_index_expression(left, index)
-    elif left.type() == b1u3object.HASH_OBJ:
+    elif left.tag is b1u3object.VEC_OBJ and index.tag is b1u3object.INTEGER_OBJ:
+        return eval_vec_index_expression(left, index)
+    elif left.tag is b1u3object.HASH_OBJ:
         return eval_hash_index_expression(left, index)
     else:
-        return new_error("index operator not supported {left.type()}")
+        return new_error(f"index operator not supported: {left.type()}")
 
 def eval_array_index_expression(array, index):
     idx = index.value
@@ -326,6 +1037,12 @@ def eval_array_index_expression(array, index):
         return NULL
     return array.elements[idx]
 
+def eval_vec_index_expression(vec, index):
+    idx = index.value
+    if idx < 0 or idx >= len(vec.data):
+        return NULL
+    return new_integer(int(vec.data[idx]))
+
 def eval_hash_index_expression(hashobj, index):
     if not isinstance(index, b1u3object.Hashable):
         return new_error(f"unusable as hash key: {index.type()}")
@@ -390,10 +1107,13 @@ def eval_unquote_calls(quoted, env):
     return b1u3ast.modify(quoted, extend_unquote)
 
 
+def is_quote_call(node):
+    return isinstance(node, b1u3ast.CallExpression) and node.function.symbol == QUOTE_SYMBOL
+
 def is_unquote_call(node):
     if not isinstance(node, b1u3ast.CallExpression):
         return False
-    return node.function.token_literal() == "unquote"
+    return node.function.symbol == b1u3token.UNQUOTE_SYMBOL
 
 def define_macros(program, env):
     definitions = []
@@ -479,3 +1199,28 @@ def extend_macro_env(macro, args):
         extended[param.value] = args[i]
     return extended
 
+
+# ノードのクラスから評価関数を引くテーブル
+handlers = {
+        b1u3ast.Program: eval_program_node,
+        b1u3ast.ExpressionStatement: eval_expression_statement,
+        b1u3ast.IntegerLiteral: eval_integer_literal,
+        b1u3ast.Boolean: eval_boolean_literal,
+        b1u3ast.PrefixExpression: eval_prefix_node,
+        b1u3ast.InfixExpression: eval_infix_node,
+        b1u3ast.BlockStatement: eval_block_statement,
+        b1u3ast.IfExpression: eval_if_expression,
+        b1u3ast.ReturnStatement: eval_return_statement,
+        b1u3ast.LetStatement: eval_let_statement,
+        b1u3ast.AssignStatement: eval_assign_statement,
+        b1u3ast.WhileStatement: eval_while_statement,
+        b1u3ast.ForStatement: eval_for_statement,
+        b1u3ast.Identifier: eval_identifier,
+        b1u3ast.FunctionLiteral: eval_function_literal,
+        b1u3ast.CallExpression: eval_call_expression,
+        b1u3ast.StringLiteral: eval_string_literal,
+        b1u3ast.ArrayLiteral: eval_array_literal,
+        b1u3ast.IndexExpression: eval_index_node,
+        b1u3ast.HashLiteral: eval_hash_literal,
+        b1u3ast.MacroLiteral: eval_unknown_node
+}
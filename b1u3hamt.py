@@ -0,0 +1,210 @@
+""" Monkey の Hash の中身に使う永続ハッシュマップ (HAMT)
+
+ハッシュ値を 5 ビットずつ使う 32 分木。各ノードはビットマップと、立っている
+ビットの数だけの要素を持つ。要素は (hash, key, value) のタプルか子ノード。
+set と delete は根から変更した位置までの経路だけをコピーするので O(log32 n)
+で新しい Map を返し、元の Map はそのまま使える。順序はハッシュ値の順で、
+挿入順ではない。
+
+O(log32 n) は定数ではない。1M キーで平均の深さは 3.6 になり、作ったノードの分だけ
+CPython の GC の仕事も増える。実測は b1u3bench.py hash にある。
+"""
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+# get で見つからなかったことを表す
+MISSING = object()
+
+
+class BitmapNode:
+    __slots__ = ('bitmap', 'array')
+
+    def __init__(self, bitmap, array):
+        self.bitmap = bitmap
+        self.array = array
+
+
+class CollisionNode:
+    """ ハッシュ値が全部同じキーを並べておく """
+    __slots__ = ('hash', 'array')
+
+    def __init__(self, hash, array):
+        self.hash = hash
+        self.array = array
+
+
+def lookup(node, shift, h, key):
+    while True:
+        if type(node) is BitmapNode:
+            bit = 1 << ((h >> shift) & MASK)
+            if not node.bitmap & bit:
+                return MISSING
+            entry = node.array[(node.bitmap & (bit - 1)).bit_count()]
+            if type(entry) is tuple:
+                if entry[0] == h and entry[1] == key:
+                    return entry[2]
+                return MISSING
+            node = entry
+            shift += BITS
+        else:
+            for entry in node.array:
+                if entry[1] == key:
+                    return entry[2]
+            return MISSING
+
+
+def assoc(node, shift, leaf):
+    """ leaf を入れたノードと、キーが増えたかどうかを返す """
+    h = leaf[0]
+    if type(node) is CollisionNode:
+        if h != node.hash:
+            # 別のハッシュ値が来たので、この位置を分岐にする
+            node = BitmapNode(1 << ((node.hash >> shift) & MASK), [node])
+            return assoc(node, shift, leaf)
+        array = list(node.array)
+        for i, entry in enumerate(array):
+            if entry[1] == leaf[1]:
+                array[i] = leaf
+                return CollisionNode(h, array), False
+        array.append(leaf)
+        return CollisionNode(h, array), True
+    bit = 1 << ((h >> shift) & MASK)
+    pos = (node.bitmap & (bit - 1)).bit_count()
+    if not node.bitmap & bit:
+        array = node.array[:pos] + [leaf] + node.array[pos:]
+        return BitmapNode(node.bitmap | bit, array), True
+    entry = node.array[pos]
+    if type(entry) is tuple:
+        if entry[0] == h and entry[1] == leaf[1]:
+            child, added = leaf, False
+        else:
+            child, added = merge_leaves(shift + BITS, entry, leaf), True
+    else:
+        child, added = assoc(entry, shift + BITS, leaf)
+    array = list(node.array)
+    array[pos] = child
+    return BitmapNode(node.bitmap, array), added
+
+
+def merge_leaves(shift, a, b):
+    """ 同じ位置に来た2つの葉から下のノードを作る """
+    if a[0] == b[0]:
+        return CollisionNode(a[0], [a, b])
+    node = BitmapNode(1 << ((a[0] >> shift) & MASK), [a])
+    return assoc(node, shift, b)[0]
+
+
+def dissoc(node, shift, h, key):
+    """ key を除いたノードを返す。なければ node そのもの、空になったら None
+
+    要素が1つだけになった子は葉のタプルを返し、親がそれを直接持つ。
+    """
+    if type(node) is CollisionNode:
+        array = [entry for entry in node.array if entry[1] != key]
+        if len(array) == len(node.array):
+            return node
+        if len(array) == 1:
+            return array[0]
+        return CollisionNode(node.hash, array)
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+        return node
+    pos = (node.bitmap & (bit - 1)).bit_count()
+    entry = node.array[pos]
+    if type(entry) is tuple:
+        if entry[0] != h or entry[1] != key:
+            return node
+        child = None
+    else:
+        child = dissoc(entry, shift + BITS, h, key)
+        if child is entry:
+            return node
+        if type(child) is BitmapNode and len(child.array) == 1 and type(child.array[0]) is tuple:
+            child = child.array[0]
+    if child is None:
+        if len(node.array) == 1:
+            return None
+        return BitmapNode(node.bitmap ^ bit, node.array[:pos] + node.array[pos+1:])
+    array = list(node.array)
+    array[pos] = child
+    return BitmapNode(node.bitmap, array)
+
+
+def leaves(node):
+    for entry in node.array:
+        if type(entry) is tuple:
+            yield entry
+        else:
+            yield from leaves(entry)
+
+
+class Map:
+    """ 中身を変更しない辞書。キーは hash と == が使えるもの """
+    __slots__ = ('root', 'count')
+
+    def __init__(self, root, count):
+        self.root = root
+        self.count = count
+
+    @staticmethod
+    def from_dict(d):
+        m = EMPTY
+        for key, value in d.items():
+            m = m.set(key, value)
+        return m
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        value = lookup(self.root, 0, hash(key) & HASH_MASK, key)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = lookup(self.root, 0, hash(key) & HASH_MASK, key)
+        if value is MISSING:
+            return default
+        return value
+
+    def __contains__(self, key):
+        return lookup(self.root, 0, hash(key) & HASH_MASK, key) is not MISSING
+
+    def __iter__(self):
+        for entry in leaves(self.root):
+            yield entry[1]
+
+    def items(self):
+        for entry in leaves(self.root):
+            yield entry[1], entry[2]
+
+    def values(self):
+        for entry in leaves(self.root):
+            yield entry[2]
+
+    def set(self, key, value):
+        """ key を value にした新しい Map を返す """
+        root, added = assoc(self.root, 0, (hash(key) & HASH_MASK, key, value))
+        return Map(root, self.count + 1 if added else self.count)
+
+    def delete(self, key):
+        """ key を除いた新しい Map を返す。key がなければ self """
+        root = dissoc(self.root, 0, hash(key) & HASH_MASK, key)
+        if root is self.root:
+            return self
+        if root is None:
+            return EMPTY
+        return Map(root, self.count - 1)
+
+    def merge(self, other):
+        """ other のキーで上書きした新しい Map を返す """
+        m = self
+        for key, value in other.items():
+            m = m.set(key, value)
+        return m
+
+
+EMPTY = Map(BitmapNode(0, []), 0)
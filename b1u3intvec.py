@@ -0,0 +1,73 @@
+""" Monkey の VEC (int64 の配列) の中身
+
+numpy があれば numpy.ndarray (int64) で要素ごとの演算をまとめて行う。なければ
+標準の array.array('q') を使い、演算は Python のループになる。どちらでも要素は
+Integer に包まずに int64 のまま持つ。numpy の演算は int64 の範囲を超えると
+折り返すが、array.array は OverflowError になる。
+"""
+from array import array
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+arithmetic = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.floordiv,
+}
+
+comparisons = {
+        '<': operator.lt,
+        '>': operator.gt,
+        '==': operator.eq,
+        '!=': operator.ne,
+}
+
+
+def from_ints(values):
+    """ int の list からバッファを作る。int64 に入らない値があれば None """
+    try:
+        if numpy is not None:
+            return numpy.array(values, dtype=numpy.int64)
+        return array('q', values)
+    except OverflowError:
+        return None
+
+
+def apply(f, a, b):
+    """ a と b はバッファか int。少なくとも一方はバッファで、両方なら同じ長さ """
+    if numpy is not None:
+        return f(a, b)
+    if type(a) is int:
+        return [f(a, y) for y in b]
+    if type(b) is int:
+        return [f(x, b) for x in a]
+    return list(map(f, a, b))
+
+
+def arith(op, a, b):
+    """ 四則演算の結果のバッファを返す。/ は Monkey と同じく切り捨て """
+    if op == '/' and (b == 0 if type(b) is int else 0 in b):
+        raise ZeroDivisionError(op)
+    res = apply(arithmetic[op], a, b)
+    if numpy is not None:
+        return res
+    return array('q', res)
+
+
+def compare(op, a, b):
+    """ 比較の結果を bool の list で返す """
+    res = apply(comparisons[op], a, b)
+    if numpy is not None:
+        return res.tolist()
+    return res
+
+
+def total(a):
+    if numpy is not None:
+        return int(a.sum())
+    return sum(a)
@@ -1,14 +1,20 @@
 import b1u3repl
+import b1u3engine
+import argparse
 import getpass
 import sys
 
 def main():
+    argparser = argparse.ArgumentParser(description='the Monkey programming language')
+    argparser.add_argument('--engine', choices=b1u3engine.ENGINES, default='eval',
+            help='eval: tree-walking evaluator, vm: bytecode compiler and virtual machine, '
+            'py: translate to Python code objects, stack: evaluator without Python recursion')
+    args = argparser.parse_args()
     user = getpass.getuser()
     print(f'Hello {user}! This is the Monkey programming language')
     print('Feel free to type in commands')
-    b1u3repl.start(sys.stdin, sys.stdout)
+    b1u3repl.start(sys.stdin, sys.stdout, engine=args.engine)
 
 
 if __name__ == '__main__':
     main()
-
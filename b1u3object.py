@@ -1,3 +1,7 @@
+from collections import OrderedDict
+from b1u3vector import Vector
+from b1u3hamt import Map
+
 # identify type as str
 INTEGER_OBJ = 'INTEGER'
 BOOLEAN_OBJ = 'BOOLEAN'
@@ -11,79 +15,128 @@ ARRAY_OBJ = 'ARRAY'
 HASH_OBJ = 'HASH'
 QUOTE_OBJ = 'QUOTE'
 MACRO_OBJ = 'MACRO'
+COMPILED_FUNCTION_OBJ = 'COMPILED_FUNCTION'
+TAIL_CALL_OBJ = 'TAIL_CALL'
+VEC_OBJ = 'VEC'
+LAZY_OBJ = 'LAZY'
 
 # Object Interface
+# 値のクラスは __slots__ を持ち、型はクラス属性の tag で表す。tag は上の定数そのもの
+# なので obj.tag is INTEGER_OBJ のように呼び出しなしで比べられる。
 class Object:
-    def __init__(self,**kwargs):
-        for name in kwargs:
-            setattr(self, name, kwargs[name])
+    __slots__ = ()
+    tag:str=None
 
     def type(self) -> str:
-        raise NotImplementedError()
+        return self.tag
 
     def inspect(self) -> str:
         raise NotImplementedError()
 
 class Hashable:
+    __slots__ = ()
+
     def hash_key(self):
         raise NotImplementedError()
 
 class HashKey(Object):
-    type=None
-    value=None
+    """ Hash の pairs のキー。型と Python の値をそのまま持ち、両方が同じときだけ等しい """
+    __slots__ = ('type', 'value', 'hash')
+
+    def __init__(self, type=None, value=None):
+        self.type = type
+        self.value = value
+        self.hash = hash((type, value))
 
     def __eq__(self, v):
-        return self.value == v.value
+        return type(v) is HashKey and self.type is v.type and self.value == v.value
 
     def __hash__(self):
-        return self.value
+        return self.hash
+
+
+def hash_key_order(item):
+    """ (HashKey, HashPair) を並べるときのキー。型が同じ値どうししか比べない """
+    key = item[0]
+    return key.type, key.value
 
 
 class Integer(Object, Hashable):
-    value:int=None
+    __slots__ = ('value', 'key')
+    tag = INTEGER_OBJ
 
-    def type(self):
-        return INTEGER_OBJ
+    def __init__(self, value=None):
+        self.value = value
+        self.key = None # hash_key の結果
 
     def inspect(self):
         return f'{self.value}'
 
     def hash_key(self):
-        return HashKey(type=self.type(), value=self.value)
+        key = self.key
+        if key is None:
+            key = self.key = HashKey(type=self.tag, value=self.value)
+        return key
+
 
 
+# new_integer が使い回す Integer の範囲 [SMALL_INT_MIN, SMALL_INT_MAX]
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 1024
+small_ints = []
+
+
+def set_small_int_range(lo, hi):
+    """ 使い回す整数の範囲を変える。lo > hi なら使い回さない """
+    global SMALL_INT_MIN, SMALL_INT_MAX, small_ints
+    SMALL_INT_MIN = lo
+    SMALL_INT_MAX = hi
+    small_ints = [Integer(value=i) for i in range(lo, hi+1)]
+
+
+def new_integer(value):
+    """ Integer はイミュータブルなので小さい値は同じオブジェクトを返す """
+    if SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+        return small_ints[value - SMALL_INT_MIN]
+    return Integer(value=value)
+
+
+set_small_int_range(SMALL_INT_MIN, SMALL_INT_MAX)
+
 
 class Boolean(Object, Hashable):
-    value:bool=None
+    __slots__ = ('value', 'key')
+    tag = BOOLEAN_OBJ
 
-    def type(self):
-        return BOOLEAN_OBJ
+    def __init__(self, value=None):
+        self.value = value
+        self.key = None # hash_key の結果
 
     def inspect(self):
         return f'{self.value}'.lower()
 
     def hash_key(self):
-        value = None
-        if self.value:
-            value = 1
-        else:
-            value = 0
-        return HashKey(type=self.type(), value=value)
+        key = self.key
+        if key is None:
+            key = self.key = HashKey(type=self.tag, value=self.value)
+        return key
 
 
 
 class Null(Object):
-
-    def type(self):
-        return NULL_OBJ
+    __slots__ = ()
+    tag = NULL_OBJ
 
     def inspect(self):
         return 'null'
 
 
 class ReturnValue(Object):
-    def type(self):
-        return RETURN_VALUE_OBJ
+    __slots__ = ('value',)
+    tag = RETURN_VALUE_OBJ
+
+    def __init__(self, value=None):
+        self.value = value
 
     def inspect(self):
         return self.value.inspect()
@@ -91,22 +144,39 @@ class ReturnValue(Object):
 
 
 
+class TailCall(Object):
+    """ 末尾位置の呼び出し。apply_function がループで実行する """
+    __slots__ = ('fn', 'args')
+    tag = TAIL_CALL_OBJ
+
+    def __init__(self, fn=None, args=None):
+        self.fn = fn
+        self.args = args
+
+    def inspect(self):
+        return 'tail call'
+
+
 class Error(Object):
-    msg:str=None
-    def type(self):
-        return ERROR_OBJ
+    __slots__ = ('msg',)
+    tag = ERROR_OBJ
+
+    def __init__(self, msg=None):
+        self.msg = msg
 
     def inspect(self):
         return f'ERROR: {self.msg}'
 
 
 class Function(Object):
-    parameters=None
-    body=None
-    env=None
+    __slots__ = ('parameters', 'body', 'env', 'layout')
+    tag = FUNCTION_OBJ
 
-    def type(self):
-        return FUNCTION_OBJ
+    def __init__(self, parameters=None, env=None, body=None, layout=None):
+        self.parameters = parameters
+        self.env = env
+        self.body = body
+        self.layout = layout # 名前解決済みなら FrameLayout
 
     def inspect(self):
         out = ""
@@ -132,18 +202,34 @@ class Environment:
             setattr(self, name, kwargs[name])
 
     def __getitem__(self, key):
-        if not isinstance(key, str):
-            raise TypeError(f'Key is not type of str, got={type(key)}')
-        try:
-            return self.store[key]
-        except KeyError:
-            return self.outer[key]
+        # outer をたどるときに KeyError を投げ直さない
+        env = self
+        while type(env) is Environment:
+            value = env.store.get(key, UNSET)
+            if value is not UNSET:
+                return value
+            env = env.outer
+        if env is None:
+            raise KeyError(key)
+        return env[key]
 
     def __setitem__(self, key, value):
         if not isinstance(key, str):
             raise TypeError(f'key is not type of str, got={type(key)}')
         self.store[key] = value
 
+    def rebind(self, key, value):
+        """ key が let されている一番内側の環境で key を value にする。どこにもなければ False """
+        env = self
+        while type(env) is Environment:
+            if key in env.store:
+                env.store[key] = value
+                return True
+            env = env.outer
+        if type(env) is not Frame:
+            return False
+        return env.rebind(key, value)
+
 
 def new_enclosed_environment(outer):
     env=Environment()
@@ -151,73 +237,263 @@ def new_enclosed_environment(outer):
     return env
 
 
-class String(Object, Hashable):
-    value:str=None
+# Frame のまだ let されていないスロット
+UNSET = object()
+
+
+class FrameLayout:
+    """ b1u3resolver が FunctionLiteral ごとに作るスロットの並び。先頭は引数 """
+    __slots__ = ('names', 'index', 'num_parameters')
+
+    def __init__(self, names, num_parameters):
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.num_parameters = num_parameters
+
+
+class Frame:
+    """ 名前解決済みの関数の環境。変数はスロットの番号で引く
+
+    名前でも引けるので Environment の代わりに使える。
+    """
+    __slots__ = ('slots', 'layout', 'outer', 'globals', 'extra')
+
+    def __init__(self, slots, layout, outer, globals):
+        self.slots = slots
+        self.layout = layout
+        self.outer = outer
+        self.globals = globals
+        self.extra = None # layout にない名前を let したとき用
+
+    def __getitem__(self, key):
+        frame = self
+        while type(frame) is Frame:
+            i = frame.layout.index.get(key)
+            if i is not None and frame.slots[i] is not UNSET:
+                return frame.slots[i]
+            if frame.extra is not None and key in frame.extra:
+                return frame.extra[key]
+            frame = frame.outer
+        return frame[key]
+
+    def __setitem__(self, key, value):
+        i = self.layout.index.get(key)
+        if i is not None:
+            self.slots[i] = value
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def rebind(self, key, value):
+        """ Environment.rebind と同じ。まだ let されていないスロットは飛ばす """
+        frame = self
+        while type(frame) is Frame:
+            i = frame.layout.index.get(key)
+            if i is not None and frame.slots[i] is not UNSET:
+                frame.slots[i] = value
+                return True
+            if frame.extra is not None and key in frame.extra:
+                frame.extra[key] = value
+                return True
+            frame = frame.outer
+        return frame.rebind(key, value)
+
+
+def new_frame(fn, args):
+    layout = fn.layout
+    n = layout.num_parameters
+    slots = list(args[:n])
+    slots.extend([UNSET] * (len(layout.names) - len(slots)))
+    env = fn.env
+    globals = env.globals if type(env) is Frame else env
+    return Frame(slots, layout, env, globals)
 
-    def type(self):
-        return STRING_OBJ
+
+class String(Object, Hashable):
+    """ 文字列。concat_strings で作ったものは左右の String を持つ rope で、
+
+    value を読んだときに初めて1つの str にする。length は rope のままわかる。
+    """
+    __slots__ = ('text', 'left', 'right', 'length', 'key')
+    tag = STRING_OBJ
+
+    def __init__(self, value=None):
+        self.text = value
+        self.left = None
+        self.right = None
+        self.length = len(value) if value is not None else 0
+        self.key = None # hash_key の結果
+
+    @property
+    def value(self):
+        text = self.text
+        if text is None:
+            text = self.flatten()
+        return text
+
+    def flatten(self):
+        """ 葉の str を左から集めて1つにし、子への参照を捨てる """
+        parts = []
+        stack = [self]
+        while stack:
+            s = stack.pop()
+            if s.text is not None:
+                parts.append(s.text)
+            else:
+                stack.append(s.right)
+                stack.append(s.left)
+        self.text = ''.join(parts)
+        self.left = None
+        self.right = None
+        return self.text
 
     def inspect(self):
         return self.value
 
     def hash_key(self):
-        return HashKey(type=self.type(), value=sum(list(self.value.encode())))
+        key = self.key
+        if key is None:
+            key = self.key = HashKey(type=self.tag, value=self.value)
+        return key
+
 
 
+# これより短い連結はその場で str にする
+ROPE_MIN_LENGTH = 256
+
+
+def concat_strings(left, right):
+    """ left + right の String を返す。長ければ中身をコピーしない rope にする """
+    length = left.length + right.length
+    if length < ROPE_MIN_LENGTH:
+        return String(value=left.value + right.value)
+    s = String()
+    s.left = left
+    s.right = right
+    s.length = length
+    return s
+
 
 class Builtin(Object):
-    fn=None
+    __slots__ = ('fn',)
+    tag = BUILTIN_OBJ
 
-    def type(self):
-        return BUILTIN_OBJ
+    def __init__(self, fn=None):
+        self.fn = fn
 
     def inspect(self):
         return 'builtin function'
 
 
 class Array(Object):
-    elements=None
+    """ elements は b1u3vector.Vector。list を渡したら Vector にする """
+    __slots__ = ('elements',)
+    tag = ARRAY_OBJ
 
-    def type(self):
-        return ARRAY_OBJ
+    def __init__(self, elements=None):
+        if type(elements) is not Vector:
+            elements = Vector.from_list(elements)
+        self.elements = elements
 
     def inspect(self):
         return f"[{', '.join([e.inspect() for e in self.elements])}]"
 
 
+class Vec(Object):
+    """ int64 だけの配列。data は b1u3intvec のバッファ (numpy.ndarray か array.array) """
+    __slots__ = ('data',)
+    tag = VEC_OBJ
+
+    def __init__(self, data=None):
+        self.data = data
+
+    def inspect(self):
+        return f"vec[{', '.join([str(v) for v in self.data.tolist()])}]"
+
+
+class Lazy(Object):
+    """ 遅延列。source は呼ぶたびに先頭から要素を作り直すイテレータを返す関数
+
+    要素を作る途中で Error が起きたら、その Error を最後の要素として返す。
+    """
+    __slots__ = ('source',)
+    tag = LAZY_OBJ
+
+    def __init__(self, source=None):
+        self.source = source
+
+    def inspect(self):
+        return 'lazy'
+
+
 class HashPair(Object):
-    key:Object=None
-    value:Object=None
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key=None, value=None):
+        self.key = key
+        self.value = value
 
 
 class Hash(Object):
-    pairs=None
+    """ pairs は HashKey から HashPair への b1u3hamt.Map。dict を渡したら Map にする """
+    __slots__ = ('pairs',)
+    tag = HASH_OBJ
+
+    def __init__(self, pairs=None):
+        if type(pairs) is not Map:
+            pairs = Map.from_dict(pairs)
+        self.pairs = pairs
 
-    def type(self):
-        return HASH_OBJ
+    def sorted_pairs(self):
+        """ HashPair をキーの型と値の順に並べる。HAMT の順は文字列のハッシュ (PYTHONHASHSEED) で変わる """
+        return [p for _, p in sorted(self.pairs.items(), key=hash_key_order)]
 
     def inspect(self):
         strs = []
-        for p in self.pairs:
+        for p in self.sorted_pairs():
             strs.append(f'{p.key.inspect()}: {p.value.inspect()}')
         return '{'+f'{", ".join(strs)}'+'}'
 
+class Memo(Object):
+    """ memo(fn, max_entries) が返す関数。引数の HashKey の組から結果への LRU キャッシュを持つ
+
+    cache は古い順の OrderedDict で、max_entries を超えたら一番古いものを捨てる。
+    """
+    __slots__ = ('fn', 'max_entries', 'cache', 'hits', 'misses', 'evictions')
+    tag = FUNCTION_OBJ
+
+    def __init__(self, fn=None, max_entries=0):
+        self.fn = fn
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def inspect(self):
+        return f'memo({len(self.cache)}/{self.max_entries} entries, {self.hits} hits, {self.misses} misses)'
+
+
 class Quote(Object):
-    node=None
+    __slots__ = ('node',)
+    tag = QUOTE_OBJ
 
-    def type(self):
-        return QUOTE_OBJ
+    def __init__(self, node=None):
+        self.node = node
 
     def inspect(self):
         return f"QUOTE({repr(self.node)})"
 
 
 class Macro(Object):
-    parameters=[]
-    body=None
-    env=None
-    def type(self):
-        return MACRO_OBJ
+    __slots__ = ('parameters', 'body', 'env')
+    tag = MACRO_OBJ
+
+    def __init__(self, parameters=None, env=None, body=None):
+        self.parameters = parameters
+        self.env = env
+        self.body = body
 
     def inspect(self):
         params = []
@@ -225,3 +501,37 @@ class Macro(Object):
             params.append(repr(p))
         return f'macro({", ".join(params)})'+'{\n'+f'{repr(self.body)}'+'\n}'
 
+
+class CompiledFunction(Object):
+    """ b1u3compiler が作る関数本体。parameters と body は inspect のために元の AST を持つ """
+    __slots__ = ('instructions', 'num_locals', 'num_parameters', 'parameters', 'body')
+    tag = COMPILED_FUNCTION_OBJ
+
+    def __init__(self, instructions=None, num_locals=0, num_parameters=0, parameters=None, body=None):
+        self.instructions = instructions
+        self.num_locals = num_locals
+        self.num_parameters = num_parameters
+        self.parameters = parameters
+        self.body = body
+
+    def inspect(self):
+        return f'CompiledFunction[{id(self):#x}]'
+
+
+class Closure(Function):
+    """ b1u3vm のクロージャ。評価器の Function と同じく FUNCTION として振る舞う """
+    __slots__ = ('fn', 'free')
+
+    def __init__(self, fn=None, free=None):
+        self.fn = fn
+        self.free = free
+        self.env = None
+        self.layout = None
+
+    @property
+    def parameters(self):
+        return self.fn.parameters
+
+    @property
+    def body(self):
+        return self.fn.body
@@ -1,3 +1,4 @@
+import gc
 import b1u3ast
 import b1u3token
 from collections import defaultdict
@@ -31,6 +32,8 @@ class Parser():
     l: b1u3token.Lexer=None
     cur_token = None
     peek_token = None
+    cur_kind:int = None # cur_token.type
+    peek_kind:int = None # peek_token.type
     errors:[str] = None
     prefix_parse_fns=None # 前置の演算子が呼ばれた時の関数
     infix_parse_fns=None # 中置の演算子が呼ばれた時の関数
@@ -69,12 +72,14 @@ class Parser():
     def next_token(self):
         """ Lexer の next_token と紛らわしいな """
         self.cur_token = self.peek_token
-        self.peek_token = self.l.next_token()
+        self.cur_kind = self.peek_kind
+        peek = self.peek_token = self.l.next_token()
+        self.peek_kind = peek.type
 
     def parse_program(self):
         program = b1u3ast.Program() # ast のルートノードを作成
         program.statements = []
-        while self.cur_token.type != b1u3token.EOF:
+        while self.cur_kind != b1u3token.EOF:
             stmt = self.parse_statement()
             if stmt != None:
                 program.statements.append(stmt)
@@ -82,12 +87,18 @@ class Parser():
         return program
 
     def parse_statement(self):
-        if self.cur_token.type == b1u3token.LET:
+        if self.cur_kind == b1u3token.LET:
             stmt = self.parse_let_statement()
             return stmt
-        elif self.cur_token.type == b1u3token.RETURN:
+        elif self.cur_kind == b1u3token.RETURN:
             stmt = self.parse_return_statement()
             return stmt
+        elif self.cur_kind == b1u3token.WHILE:
+            return self.parse_while_statement()
+        elif self.cur_kind == b1u3token.FOR:
+            return self.parse_for_statement()
+        elif self.cur_kind == b1u3token.IDENT and self.peek_token_is(b1u3token.ASSIGN):
+            return self.parse_assign_statement()
         else:
             return self.parse_expression_statement()
 
@@ -97,7 +108,7 @@ class Parser():
         if not self.expect_peek(b1u3token.IDENT):
             return None
         # value には、識別子の文字列自身を渡している
-        stmt.name = b1u3ast.Identifier(token=self.cur_token, value=self.cur_token.literal)
+        stmt.name = self.parse_identifier()
         if not self.expect_peek(b1u3token.ASSIGN):
             return None
         self.next_token()
@@ -111,17 +122,60 @@ class Parser():
         # skip return token
         self.next_token()
         stmt.return_value = self.parse_expression(LOWEST)
+        if self.peek_token_is(b1u3token.SEMICOLON):
+            self.next_token()
+        return stmt
 
+    def parse_assign_statement(self):
+        stmt = b1u3ast.AssignStatement(token=self.cur_token)
+        stmt.name = self.parse_identifier()
+        self.next_token()
+        self.next_token()
         stmt.value = self.parse_expression(LOWEST)
         if self.peek_token_is(b1u3token.SEMICOLON):
             self.next_token()
         return stmt
 
+    def parse_while_statement(self):
+        stmt = b1u3ast.WhileStatement(token=self.cur_token)
+        if not self.expect_peek(b1u3token.LPAREN):
+            return None
+        self.next_token()
+        stmt.condition = self.parse_expression(LOWEST)
+        if not self.expect_peek(b1u3token.RPAREN):
+            return None
+        if not self.expect_peek(b1u3token.LBRACE):
+            return None
+        stmt.body = self.parse_block_statement()
+        if self.peek_token_is(b1u3token.SEMICOLON):
+            self.next_token()
+        return stmt
+
+    def parse_for_statement(self):
+        stmt = b1u3ast.ForStatement(token=self.cur_token)
+        if not self.expect_peek(b1u3token.LPAREN):
+            return None
+        if not self.expect_peek(b1u3token.IDENT):
+            return None
+        stmt.variable = self.parse_identifier()
+        if not self.expect_peek(b1u3token.IN):
+            return None
+        self.next_token()
+        stmt.iterable = self.parse_expression(LOWEST)
+        if not self.expect_peek(b1u3token.RPAREN):
+            return None
+        if not self.expect_peek(b1u3token.LBRACE):
+            return None
+        stmt.body = self.parse_block_statement()
+        if self.peek_token_is(b1u3token.SEMICOLON):
+            self.next_token()
+        return stmt
+
     def cur_token_is(self, t=None):
-        return self.cur_token.type == t
+        return self.cur_kind == t
 
     def peek_token_is(self, t=None):
-        return self.peek_token.type == t
+        return self.peek_kind == t
 
     def expect_peek(self, t=None):
         if self.peek_token_is(t):
@@ -135,8 +189,20 @@ class Parser():
         return self.errors
 
     def peek_error(self, t):
-        msg = f'expected next token to be {t}, got {self.peek_token.type}'
-        self.errors.append(msg)
+        msg = f'expected next token to be {b1u3token.names[t]}, got {b1u3token.names[self.peek_kind]}'
+        self.errors.append(msg + self.where(self.peek_token))
+
+    def position(self, offset):
+        """ offset を (行, 列) にする。lexer が位置を扱えなければ None """
+        position = getattr(self.l, 'position', None)
+        return None if position is None else position(offset)
+
+    def where(self, token):
+        """ エラーメッセージの後ろに付ける位置 """
+        if token.offset is None:
+            return ''
+        pos = self.position(token.offset)
+        return '' if pos is None else f' at line {pos[0]}, column {pos[1]}'
 
 
     def register_prefix(self, token_type, fn):
@@ -154,14 +220,14 @@ class Parser():
         return stmt
 
     def parse_expression(self, precedence):
-        prefix = self.prefix_parse_fns[self.cur_token.type]
+        prefix = self.prefix_parse_fns[self.cur_kind]
         if prefix is None:
-            self.no_prefix_parse_fn_error(self.cur_token.type)
+            self.no_prefix_parse_fn_error(self.cur_kind)
             return None
         left_exp = prefix()
         # maybe error
         while not self.peek_token_is(b1u3token.SEMICOLON) and precedence < self.peek_precedence():
-            infix = self.infix_parse_fns[self.peek_token.type]
+            infix = self.infix_parse_fns[self.peek_kind]
             if infix is None:
                 return left_exp
             self.next_token()
@@ -169,42 +235,47 @@ class Parser():
         return left_exp
 
     def parse_identifier(self):
-        return b1u3ast.Identifier(token=self.cur_token, value=self.cur_token.literal)
+        token = self.cur_token
+        symbol = b1u3token.symbols.id(token.literal)
+        return b1u3ast.Identifier(token=token, value=b1u3token.symbols.names[symbol], symbol=symbol)
 
     def parse_integer_literal(self):
-        lit = b1u3ast.IntegerLiteral(token=self.cur_token)
+        token = self.cur_token
+        lit = b1u3ast.IntegerLiteral(token=token)
         try:
-            value = int(self.cur_token.literal)
+            value = int(token.literal)
             lit.value = value
-        except _:
-            self.errors.append(f'could not parse {self.cur_token.literal} as integer')
+        except ValueError:
+            self.errors.append(f'could not parse {token.literal} as integer' + self.where(token))
             return None
         return lit
 
     def no_prefix_parse_fn_error(self, t):
-        msg = f'no prefix parse function for {t} found'
-        self.errors.append(msg)
+        msg = f'no prefix parse function for {b1u3token.names[t]} found'
+        self.errors.append(msg + self.where(self.cur_token))
 
     def parse_prefix_expression(self):
-        expression = b1u3ast.PrefixExpression(token=self.cur_token, operator=self.cur_token.literal)
+        token = self.cur_token
+        expression = b1u3ast.PrefixExpression(token=token, operator=token.literal)
         self.next_token()
         expression.right = self.parse_expression(PREFIX)
         return expression
 
     def peek_precedence(self):
         try:
-            return precedences[self.peek_token.type]
+            return precedences[self.peek_kind]
         except KeyError:
             return LOWEST
 
     def cur_precedence(self):
         try:
-            return precedences[self.cur_token.type]
+            return precedences[self.cur_kind]
         except KeyError:
             return LOWEST
 
     def parse_infix_expression(self, left):
-        expression = b1u3ast.InfixExpression(token=self.cur_token, operator=self.cur_token.literal, left=left)
+        token = self.cur_token
+        expression = b1u3ast.InfixExpression(token=token, operator=token.literal, left=left)
         precedence = self.cur_precedence()
         self.next_token()
         expression.right = self.parse_expression(precedence)
@@ -267,14 +338,12 @@ class Parser():
             self.next_token()
             return identifiers
         self.next_token()
-        ident = b1u3ast.Identifier(token=self.cur_token, value=self.cur_token.literal)
-        identifiers.append(ident)
+        identifiers.append(self.parse_identifier())
 
         while self.peek_token_is(b1u3token.COMMA):
             self.next_token()
             self.next_token()
-            ident = b1u3ast.Identifier(token=self.cur_token, value=self.cur_token.literal)
-            identifiers.append(ident)
+            identifiers.append(self.parse_identifier())
 
         if not self.expect_peek(b1u3token.RPAREN):
             return None
@@ -304,7 +373,8 @@ class Parser():
         return args
 
     def parse_string_literal(self):
-        return b1u3ast.StringLiteral(token=self.cur_token, value=self.cur_token.literal)
+        token = self.cur_token
+        return b1u3ast.StringLiteral(token=token, value=token.literal)
 
     def parse_array_literal(self):
         array = b1u3ast.ArrayLiteral(token=self.cur_token)
@@ -362,3 +432,92 @@ class Parser():
         lit.body = self.parse_block_statement()
         return lit
 
+
+
+class BufferParser(Parser):
+    """ b1u3token.TokenBuffer を添字でたどる Parser
+
+    字句の種類は buffer.kinds を直接見る。Token は AST のノードに入れるときだけ token_at で作る。
+    入力は全部字句に分けてあるので、parse_program は木を作り終えるまで循環 GC を止める。
+    AST は循環しないので、作っている途中で GC が木をなめ直すのは無駄になる。
+    """
+    buffer:b1u3token.TokenBuffer = None
+    kinds = None
+    starts = None
+    lengths = None
+    source:str = None
+    pos:int = -2
+    # 直前に作った Token。ExpressionStatement とその最初の式は同じ位置の Token を続けて使う
+    last_pos:int = -1
+    last_token:b1u3token.Token = None
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.kinds = buffer.kinds
+        self.starts = buffer.starts
+        self.lengths = buffer.lengths
+        self.source = buffer.source
+        self.pos = -2
+        super().__init__(None)
+
+    def parse_program(self):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return super().parse_program()
+        finally:
+            if enabled:
+                gc.enable()
+
+    def next_token(self):
+        pos = self.pos = self.pos + 1
+        try:
+            self.cur_kind = self.kinds[pos]
+            self.peek_kind = self.kinds[pos+1]
+        except IndexError:
+            # EOF より先には進まない
+            self.pos = len(self.kinds) - 1
+            self.cur_kind = self.peek_kind = b1u3token.EOF
+
+    def token_at(self, pos):
+        if pos == self.last_pos:
+            return self.last_token
+        start = self.starts[pos]
+        kind = self.kinds[pos]
+        literal = self.source[start:start+self.lengths[pos]]
+        if kind == b1u3token.IDENT:
+            # Lexer と同じく識別子は Symbols の str を使う
+            literal = b1u3token.symbols.names[b1u3token.symbols.id(literal)]
+        elif kind == b1u3token.STRING:
+            start -= 1
+        token = self.last_token = b1u3token.Token(kind, literal, start)
+        self.last_pos = pos
+        return token
+
+    @property
+    def cur_token(self):
+        return self.token_at(self.pos)
+
+    @property
+    def peek_token(self):
+        return self.token_at(min(self.pos + 1, len(self.kinds) - 1))
+
+    def parse_expression(self, precedence):
+        prefix = self.prefix_parse_fns[self.cur_kind]
+        if prefix is None:
+            self.no_prefix_parse_fn_error(self.cur_kind)
+            return None
+        left_exp = prefix()
+        get_precedence = precedences.get
+        infix_parse_fns = self.infix_parse_fns
+        # ; と EOF は precedences にないので LOWEST になり、ここで止まる
+        while precedence < get_precedence(self.peek_kind, LOWEST):
+            infix = infix_parse_fns[self.peek_kind]
+            if infix is None:
+                return left_exp
+            self.next_token()
+            left_exp = infix(left_exp)
+        return left_exp
+
+    def position(self, offset):
+        return self.buffer.position(offset)
@@ -1,27 +1,19 @@
-from b1u3token import Lexer, EOF
-from b1u3parser import Parser
-from b1u3evaluator import b1u3eval, define_macros, expand_macros
-from b1u3object import Environment
+from b1u3engine import Session, ParseError
 PROMPT = '>> '
 
 
-def start(inp, outp):
-    env = Environment()
-    macro_env = Environment()
+def start(inp, outp, engine='eval'):
+    session = Session(engine=engine)
     while True:
         print(PROMPT, end='', flush=True)
         line = inp.readline()
         if not line:
             return
-        lexer = Lexer(line)
-        parser = Parser(lexer)
-        program = parser.parse_program()
-        if len(parser.errors) != 0:
-            print_parser_errors(outp, parser.errors)
+        try:
+            evaluated = session.run(line)
+        except ParseError as e:
+            print_parser_errors(outp, e.errors)
             continue
-        define_macros(program, macro_env)
-        expanded = expand_macros(program, macro_env)
-        evaluated = b1u3eval(expanded, env)
         if evaluated is not None:
             print(evaluated.inspect())
 
@@ -29,4 +21,3 @@ def start(inp, outp):
 def print_parser_errors(out, errors):
     for _, msg in enumerate(errors):
         print(f'\t{msg}', file=out, flush=True)
-
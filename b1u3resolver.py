@@ -0,0 +1,201 @@
+""" 変数の参照先を静的に決めておく解決パス
+
+resolve(program) は Identifier に次の注釈を付ける。
+
+- 関数の中の変数: slot (Frame のスロット番号) と depth (何段外側の Frame か)
+- それ以外: scope = GLOBAL (トップレベルの環境、なければ組み込み関数)
+
+FunctionLiteral には FrameLayout が付き、評価器はこれを使って Environment
+の代わりに Frame を作る。関数内の let と for の変数は if の中のものも含めて
+先に集めるので、let より前の参照はスロットが UNSET のまま残り、評価器が名前で
+引き直す。
+"""
+import b1u3ast, b1u3object, b1u3evaluator
+
+GLOBAL = 'GLOBAL'
+
+
+class Scope():
+    layout:b1u3object.FrameLayout=None
+    outer=None
+
+    def __init__(self, layout, outer):
+        self.layout = layout
+        self.outer = outer
+
+
+def resolve(program):
+    """ program を解決して返す """
+    Resolver().resolve(program, None)
+    return program
+
+
+def collect_lets(node, names):
+    """ 関数本体で let される名前を出現順に集める。内側の fn の中は見ない """
+    if isinstance(node, b1u3ast.LetStatement):
+        if node.name.value not in names:
+            names.append(node.name.value)
+        collect_lets(node.value, names)
+    elif isinstance(node, b1u3ast.ForStatement):
+        if node.variable.value not in names:
+            names.append(node.variable.value)
+        collect_lets(node.iterable, names)
+        collect_lets(node.body, names)
+    elif isinstance(node, (b1u3ast.FunctionLiteral, b1u3ast.MacroLiteral)):
+        return names
+    elif b1u3evaluator.is_quote_call(node):
+        return names
+    else:
+        for child in children(node):
+            collect_lets(child, names)
+    return names
+
+
+def children(node):
+    if isinstance(node, (b1u3ast.Program, b1u3ast.BlockStatement)):
+        return node.statements
+    elif isinstance(node, b1u3ast.ExpressionStatement):
+        return [node.expression]
+    elif isinstance(node, b1u3ast.ReturnStatement):
+        return [node.return_value]
+    elif isinstance(node, (b1u3ast.LetStatement, b1u3ast.AssignStatement)):
+        return [node.value]
+    elif isinstance(node, b1u3ast.WhileStatement):
+        return [node.condition, node.body]
+    elif isinstance(node, b1u3ast.ForStatement):
+        return [node.iterable, node.body]
+    elif isinstance(node, b1u3ast.PrefixExpression):
+        return [node.right]
+    elif isinstance(node, b1u3ast.InfixExpression):
+        return [node.left, node.right]
+    elif isinstance(node, b1u3ast.IfExpression):
+        res = [node.condition, node.consequence]
+        if node.alternative is not None:
+            res.append(node.alternative)
+        return res
+    elif isinstance(node, b1u3ast.CallExpression):
+        return [node.function] + node.arguments
+    elif isinstance(node, b1u3ast.ArrayLiteral):
+        return node.elements
+    elif isinstance(node, b1u3ast.IndexExpression):
+        return [node.left, node.index]
+    elif isinstance(node, b1u3ast.HashLiteral):
+        res = []
+        for k, v in node.pairs.items():
+            res.append(k)
+            res.append(v)
+        return res
+    return []
+
+
+def collect_late_reads(statements, bound, late):
+    """ 文を順に見て、その時点でまだ let されていない名前の読み出しを late に集める
+
+    bound はそこまでに let された名前。if と loop の中の let は外には持ち出さない。
+    内側の fn の本体は定義した時点で読まれるものとみなす。
+    b1u3transpiler と b1u3compiler が、let より前の読み出しを外側の束縛に回すために使う。
+    """
+    for s in statements:
+        if isinstance(s, b1u3ast.LetStatement):
+            if isinstance(s.value, b1u3ast.FunctionLiteral):
+                # 関数の中から自分の名前を読むのは呼ばれたとき、つまり let のあと
+                bound.add(s.name.value)
+            collect_late_reads_in_expression(s.value, bound, late)
+            bound.add(s.name.value)
+        elif isinstance(s, b1u3ast.ExpressionStatement):
+            collect_late_reads_in_expression(s.expression, bound, late)
+        elif isinstance(s, b1u3ast.ReturnStatement):
+            collect_late_reads_in_expression(s.return_value, bound, late)
+        elif isinstance(s, b1u3ast.AssignStatement):
+            collect_late_reads_in_expression(s.value, bound, late)
+        elif isinstance(s, b1u3ast.WhileStatement):
+            collect_late_reads_in_expression(s.condition, bound, late)
+            collect_late_reads(s.body.statements, set(bound), late)
+        elif isinstance(s, b1u3ast.ForStatement):
+            collect_late_reads_in_expression(s.iterable, bound, late)
+            collect_late_reads(s.body.statements, bound | {s.variable.value}, late)
+    return late
+
+
+def collect_late_reads_in_expression(node, bound, late):
+    if isinstance(node, b1u3ast.Identifier):
+        if node.value not in bound:
+            late.add(node.value)
+    elif isinstance(node, b1u3ast.IfExpression):
+        collect_late_reads_in_expression(node.condition, bound, late)
+        collect_late_reads(node.consequence.statements, set(bound), late)
+        if node.alternative is not None:
+            collect_late_reads(node.alternative.statements, set(bound), late)
+    elif isinstance(node, b1u3ast.FunctionLiteral):
+        collect_late_reads(node.body.statements, bound | {p.value for p in node.parameters}, late)
+    elif isinstance(node, (b1u3ast.InfixExpression, b1u3ast.IndexExpression)):
+        collect_late_reads_in_expression(node.left, bound, late)
+        collect_late_reads_in_expression(node.right if isinstance(node, b1u3ast.InfixExpression) else node.index, bound, late)
+    elif isinstance(node, b1u3ast.PrefixExpression):
+        collect_late_reads_in_expression(node.right, bound, late)
+    elif isinstance(node, b1u3ast.CallExpression):
+        if b1u3evaluator.is_quote_call(node):
+            return
+        collect_late_reads_in_expression(node.function, bound, late)
+        for a in node.arguments:
+            collect_late_reads_in_expression(a, bound, late)
+    elif isinstance(node, b1u3ast.ArrayLiteral):
+        for e in node.elements:
+            collect_late_reads_in_expression(e, bound, late)
+    elif isinstance(node, b1u3ast.HashLiteral):
+        for k, v in node.pairs.items():
+            collect_late_reads_in_expression(k, bound, late)
+            collect_late_reads_in_expression(v, bound, late)
+
+
+class Resolver():
+    def resolve(self, node, scope):
+        if isinstance(node, b1u3ast.Identifier):
+            self.resolve_identifier(node, scope)
+        elif isinstance(node, (b1u3ast.LetStatement, b1u3ast.AssignStatement)):
+            self.resolve_identifier(node.name, scope)
+            self.resolve(node.value, scope)
+        elif isinstance(node, b1u3ast.ForStatement):
+            self.resolve_identifier(node.variable, scope)
+            self.resolve(node.iterable, scope)
+            self.resolve(node.body, scope)
+        elif isinstance(node, b1u3ast.FunctionLiteral):
+            self.resolve_function(node, scope)
+        elif b1u3evaluator.is_quote_call(node):
+            # quote の中はデータ。unquote の引数だけは今の環境で評価される
+            def visit(n):
+                if b1u3evaluator.is_unquote_call(n):
+                    for a in n.arguments:
+                        self.resolve(a, scope)
+                return n
+            for a in node.arguments:
+                b1u3ast.modify(a, visit)
+        else:
+            for child in children(node):
+                self.resolve(child, scope)
+
+    def resolve_function(self, node, scope):
+        names = [p.value for p in node.parameters]
+        for name in collect_lets(node.body, []):
+            if name not in names:
+                names.append(name)
+        node.layout = b1u3object.FrameLayout(names, len(node.parameters))
+        inner = Scope(node.layout, scope)
+        for p in node.parameters:
+            self.resolve_identifier(p, inner)
+        self.resolve(node.body, inner)
+
+    def resolve_identifier(self, node, scope):
+        depth = 0
+        while scope is not None:
+            slot = scope.layout.index.get(node.value)
+            if slot is not None:
+                node.slot = slot
+                node.depth = depth
+                node.scope = None
+                return
+            scope = scope.outer
+            depth += 1
+        node.slot = None
+        node.depth = 0
+        node.scope = GLOBAL
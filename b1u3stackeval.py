@@ -0,0 +1,366 @@
+""" Python の再帰を使わない評価器
+
+b1u3evaluator.b1u3eval と同じ意味で評価するが、評価途中の状態を継続のスタック
+(todo) と値のスタック (vals) に持つ。Monkey の再帰の深さはヒープだけで決まり、
+max_depth を超えると RecursionError ではなく Monkey の Error になる。
+評価の間は b1u3evaluator.appliers に Function の呼び方を登録するので、map などの
+組み込み関数から呼ばれる関数もこの評価器で、同じ max_depth の範囲で評価される。
+"""
+import b1u3ast, b1u3object, b1u3evaluator
+from b1u3evaluator import TRUE, FALSE, NULL, new_error, is_error
+
+DEFAULT_MAX_DEPTH = 1000000
+
+# 継続の種類
+EVAL = 0 # (EVAL, node, env)
+PROGRAM = 1 # (PROGRAM, statements, next index, env) 直前の文の結果は vals にある
+BLOCK = 2 # (BLOCK, statements, next index, env)
+PREFIX = 3 # (PREFIX, operator)
+INFIX_RIGHT = 4 # (INFIX_RIGHT, node, env) 左辺を評価したあと
+INFIX = 5 # (INFIX, operator)
+IF = 6 # (IF, node, env)
+RETURN = 7 # (RETURN,)
+LET = 8 # (LET, name, env)
+CALL_ARGS = 9 # (CALL_ARGS, node, next index, env) 関数と評価済みの引数は vals にある
+CALL_RETURN = 10 # (CALL_RETURN,) 関数本体の評価が終わったところ
+ARRAY = 11 # (ARRAY, node, next index, env)
+INDEX = 12 # (INDEX,)
+INDEX_RIGHT = 13 # (INDEX_RIGHT, node, env)
+HASH_KEY = 14 # (HASH_KEY, node, keys, next index, env) キーを評価したあと
+HASH_VALUE = 15 # (HASH_VALUE, node, keys, next index, env) 値を評価したあと
+ASSIGN = 16 # (ASSIGN, name, env)
+WHILE = 17 # (WHILE, node, env) 条件を評価したあと
+WHILE_NEXT = 18 # (WHILE_NEXT, node, env) 本体を評価したあと
+FOR_ITER = 19 # (FOR_ITER, node, env) 回す値を評価したあと
+FOR_NEXT = 20 # (FOR_NEXT, node, elements, env) 直前の本体の結果は vals にある
+MEMO_STORE = 21 # (MEMO_STORE, memo, key) memo の関数から戻ったところ
+
+Integer = b1u3object.Integer
+Function = b1u3object.Function
+Memo = b1u3object.Memo
+ReturnValue = b1u3object.ReturnValue
+
+
+class StackEvaluator():
+    max_depth:int=DEFAULT_MAX_DEPTH
+    depth:int=0 # 評価を始めたときと、組み込み関数を呼んだときの呼び出しの深さ
+
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH):
+        self.max_depth = max_depth
+        self.depth = 0
+
+    def b1u3eval(self, node, env):
+        """ node を評価する。その間は組み込み関数から呼ばれる Function もこの評価器で評価する """
+        appliers = b1u3evaluator.appliers
+        previous = appliers.get(Function)
+        appliers[Function] = self.apply_function
+        try:
+            return self.run(node, env)
+        finally:
+            if previous is None:
+                del appliers[Function]
+            else:
+                appliers[Function] = previous
+
+    def apply_function(self, fn, args):
+        """ 組み込み関数から fn を呼ぶ。呼び出し元の深さから続けて本体を評価する """
+        if self.depth + 1 > self.max_depth:
+            return new_error(f"maximum call depth exceeded: {self.max_depth}")
+        if len(args) != len(fn.parameters):
+            return new_error(f"wrong number of arguments: want={len(fn.parameters)}, got={len(args)}")
+        if fn.layout is not None:
+            extended_env = b1u3object.new_frame(fn, args)
+        else:
+            extended_env = b1u3evaluator.extend_function_env(fn, args)
+        depth = self.depth
+        self.depth = depth + 1
+        try:
+            return b1u3evaluator.unwrap_return_value(self.run(fn.body, extended_env))
+        finally:
+            self.depth = depth
+
+    def run(self, node, env):
+        todo = [(EVAL, node, env)]
+        vals = []
+        depth = self.depth
+        max_depth = self.max_depth
+        while todo:
+            task = todo.pop()
+            kind = task[0]
+            if kind == EVAL:
+                node = task[1]
+                env = task[2]
+                if b1u3evaluator.trace_hook is not None:
+                    b1u3evaluator.trace_hook(node)
+                cls = node.__class__
+                if cls is b1u3ast.Identifier:
+                    val = b1u3evaluator.eval_identifier(node, env)
+                    if is_error(val):
+                        return val
+                    vals.append(val)
+                elif cls is b1u3ast.IntegerLiteral:
+                    vals.append(b1u3evaluator.eval_integer_literal(node, env))
+                elif cls is b1u3ast.InfixExpression:
+                    todo.append((INFIX_RIGHT, node, env))
+                    todo.append((EVAL, node.left, env))
+                elif cls is b1u3ast.CallExpression:
+                    if node.function.symbol == b1u3evaluator.QUOTE_SYMBOL:
+                        vals.append(b1u3evaluator.quote(node.arguments[0], env))
+                        continue
+                    todo.append((CALL_ARGS, node, 0, env))
+                    todo.append((EVAL, node.function, env))
+                elif cls is b1u3ast.ExpressionStatement:
+                    todo.append((EVAL, node.expression, env))
+                elif cls is b1u3ast.IfExpression:
+                    todo.append((IF, node, env))
+                    todo.append((EVAL, node.condition, env))
+                elif cls is b1u3ast.BlockStatement:
+                    self.start_statements(BLOCK, node.statements, env, todo, vals)
+                elif cls is b1u3ast.Boolean:
+                    vals.append(TRUE if node.value else FALSE)
+                elif cls is b1u3ast.StringLiteral:
+                    vals.append(b1u3evaluator.eval_string_literal(node, env))
+                elif cls is b1u3ast.PrefixExpression:
+                    todo.append((PREFIX, node.operator))
+                    todo.append((EVAL, node.right, env))
+                elif cls is b1u3ast.ReturnStatement:
+                    # 関数の最後の return は包んでもすぐ CALL_RETURN で外される
+                    if not (todo and todo[-1][0] == CALL_RETURN):
+                        todo.append((RETURN,))
+                    todo.append((EVAL, node.return_value, env))
+                elif cls is b1u3ast.LetStatement:
+                    todo.append((LET, node.name, env))
+                    todo.append((EVAL, node.value, env))
+                elif cls is b1u3ast.AssignStatement:
+                    todo.append((ASSIGN, node.name, env))
+                    todo.append((EVAL, node.value, env))
+                elif cls is b1u3ast.WhileStatement:
+                    todo.append((WHILE, node, env))
+                    todo.append((EVAL, node.condition, env))
+                elif cls is b1u3ast.ForStatement:
+                    todo.append((FOR_ITER, node, env))
+                    todo.append((EVAL, node.iterable, env))
+                elif cls is b1u3ast.FunctionLiteral:
+                    vals.append(b1u3evaluator.eval_function_literal(node, env))
+                elif cls is b1u3ast.ArrayLiteral:
+                    vals.append([])
+                    todo.append((ARRAY, node, 0, env))
+                elif cls is b1u3ast.IndexExpression:
+                    todo.append((INDEX_RIGHT, node, env))
+                    todo.append((EVAL, node.left, env))
+                elif cls is b1u3ast.HashLiteral:
+                    vals.append({})
+                    todo.append((HASH_KEY, node, list(node.pairs.items()), -1, env))
+                elif cls is b1u3ast.Program:
+                    self.start_statements(PROGRAM, node.statements, env, todo, vals)
+                else:
+                    val = b1u3evaluator.b1u3eval(node, env)
+                    if is_error(val):
+                        return val
+                    vals.append(val)
+            elif kind == INFIX_RIGHT:
+                todo.append((INFIX, task[1].operator))
+                todo.append((EVAL, task[1].right, task[2]))
+            elif kind == INFIX:
+                right = vals.pop()
+                left = vals.pop()
+                if type(left) is Integer and type(right) is Integer:
+                    val = b1u3evaluator.eval_integer_infix_expression(task[1], left, right, None)
+                else:
+                    val = b1u3evaluator.eval_infix_expression(task[1], left, right, None)
+                if is_error(val):
+                    return val
+                vals.append(val)
+            elif kind == CALL_ARGS:
+                node = task[1]
+                i = task[2]
+                if i < len(node.arguments):
+                    todo.append((CALL_ARGS, node, i+1, task[3]))
+                    todo.append((EVAL, node.arguments[i], task[3]))
+                    continue
+                n = len(node.arguments)
+                args = vals[len(vals)-n:]
+                del vals[len(vals)-n:]
+                fn = vals.pop()
+                if type(fn) is Memo and isinstance(fn.fn, Function):
+                    # キャッシュになければ中の関数を普通に呼び、戻ったところで結果を入れる
+                    key = b1u3evaluator.memo_key(args)
+                    if type(key) is b1u3object.Error:
+                        return key
+                    val = b1u3evaluator.memo_lookup(fn, key)
+                    if val is not None:
+                        vals.append(val)
+                        continue
+                    todo.append((MEMO_STORE, fn, key))
+                    fn = fn.fn
+                if isinstance(fn, Function):
+                    if len(args) != len(fn.parameters):
+                        return new_error(f"wrong number of arguments: want={len(fn.parameters)}, got={len(args)}")
+                    if fn.layout is not None:
+                        extended_env = b1u3object.new_frame(fn, args)
+                    else:
+                        extended_env = b1u3evaluator.extend_function_env(fn, args)
+                    # 末尾位置の呼び出しは継続を積まない
+                    if not (todo and todo[-1][0] == CALL_RETURN):
+                        depth += 1
+                        if depth > max_depth:
+                            return new_error(f"maximum call depth exceeded: {max_depth}")
+                        todo.append((CALL_RETURN,))
+                    todo.append((EVAL, fn.body, extended_env))
+                else:
+                    self.depth = depth
+                    val = b1u3evaluator.apply_function(fn, args)
+                    if is_error(val):
+                        return val
+                    vals.append(val)
+            elif kind == CALL_RETURN:
+                depth -= 1
+                val = vals[-1]
+                if type(val) is ReturnValue:
+                    vals[-1] = val.value
+            elif kind == MEMO_STORE:
+                if vals[-1] is not None:
+                    b1u3evaluator.memo_store(task[1], task[2], vals[-1])
+            elif kind == IF:
+                cond = vals.pop()
+                node = task[1]
+                if b1u3evaluator.is_truthy(cond):
+                    todo.append((EVAL, node.consequence, task[2]))
+                elif node.alternative is not None:
+                    todo.append((EVAL, node.alternative, task[2]))
+                else:
+                    vals.append(NULL)
+            elif kind == BLOCK:
+                if type(vals[-1]) is ReturnValue:
+                    continue
+                stmts = task[1]
+                i = task[2]
+                vals.pop()
+                # 最後の文には継続を積まないので、その中の呼び出しは末尾位置になる
+                if i+1 < len(stmts):
+                    todo.append((BLOCK, stmts, i+1, task[3]))
+                todo.append((EVAL, stmts[i], task[3]))
+            elif kind == PROGRAM:
+                res = vals[-1]
+                if type(res) is ReturnValue:
+                    vals[-1] = res.value
+                    continue
+                stmts = task[1]
+                i = task[2]
+                if i < len(stmts):
+                    vals.pop()
+                    todo.append((PROGRAM, stmts, i+1, task[3]))
+                    todo.append((EVAL, stmts[i], task[3]))
+            elif kind == PREFIX:
+                val = b1u3evaluator.eval_prefix_expression(task[1], vals.pop(), None)
+                if is_error(val):
+                    return val
+                vals.append(val)
+            elif kind == RETURN:
+                vals.append(ReturnValue(value=vals.pop()))
+            elif kind == LET:
+                val = vals.pop()
+                name = task[1]
+                env = task[2]
+                if name.slot is not None and type(env) is b1u3object.Frame:
+                    env.slots[name.slot] = val
+                else:
+                    env[name.value] = val
+                vals.append(None)
+            elif kind == ASSIGN:
+                err = b1u3evaluator.assign(task[1], vals.pop(), task[2])
+                if err is not None:
+                    return err
+                vals.append(None)
+            elif kind == WHILE:
+                cond = vals.pop()
+                node = task[1]
+                if cond is FALSE or cond is NULL:
+                    vals.append(None)
+                else:
+                    todo.append((WHILE_NEXT, node, task[2]))
+                    todo.append((EVAL, node.body, task[2]))
+            elif kind == WHILE_NEXT:
+                if type(vals[-1]) is ReturnValue:
+                    continue
+                vals.pop()
+                todo.append((WHILE, task[1], task[2]))
+                todo.append((EVAL, task[1].condition, task[2]))
+            elif kind == FOR_ITER:
+                elements = b1u3evaluator.iterate(vals[-1])
+                if type(elements) is b1u3object.Error:
+                    return elements
+                vals[-1] = None
+                todo.append((FOR_NEXT, task[1], elements, task[2]))
+            elif kind == FOR_NEXT:
+                if type(vals[-1]) is ReturnValue:
+                    continue
+                node, elements, env = task[1], task[2], task[3]
+                e = next(elements, None)
+                if e is None:
+                    vals[-1] = None
+                    continue
+                if e.tag is b1u3object.ERROR_OBJ:
+                    return e
+                vals.pop()
+                name = node.variable
+                if name.slot is not None and type(env) is b1u3object.Frame:
+                    env.slots[name.slot] = e
+                else:
+                    env[name.value] = e
+                todo.append((FOR_NEXT, node, elements, env))
+                todo.append((EVAL, node.body, env))
+            elif kind == ARRAY:
+                node = task[1]
+                i = task[2]
+                if i > 0:
+                    val = vals.pop()
+                    vals[-1].append(val)
+                if i < len(node.elements):
+                    todo.append((ARRAY, node, i+1, task[3]))
+                    todo.append((EVAL, node.elements[i], task[3]))
+                else:
+                    vals[-1] = b1u3object.Array(elements=vals[-1])
+            elif kind == INDEX_RIGHT:
+                todo.append((INDEX,))
+                todo.append((EVAL, task[1].index, task[2]))
+            elif kind == INDEX:
+                index = vals.pop()
+                val = b1u3evaluator.eval_index_expression(vals.pop(), index)
+                if is_error(val):
+                    return val
+                vals.append(val)
+            elif kind == HASH_KEY:
+                node, items, i, env = task[1], task[2], task[3], task[4]
+                if i >= 0:
+                    key = vals[-1]
+                    if not isinstance(key, b1u3object.Hashable):
+                        return new_error(f"unusable as hash key: {key.type()}")
+                    todo.append((HASH_VALUE, node, items, i, env))
+                    todo.append((EVAL, items[i][1], env))
+                elif len(items) > 0:
+                    todo.append((HASH_KEY, node, items, 0, env))
+                    todo.append((EVAL, items[0][0], env))
+                else:
+                    vals[-1] = b1u3object.Hash(pairs=vals[-1])
+            elif kind == HASH_VALUE:
+                node, items, i, env = task[1], task[2], task[3], task[4]
+                value = vals.pop()
+                key = vals.pop()
+                vals[-1][key.hash_key()] = b1u3object.HashPair(key=key, value=value)
+                if i+1 < len(items):
+                    todo.append((HASH_KEY, node, items, i+1, env))
+                    todo.append((EVAL, items[i+1][0], env))
+                else:
+                    vals[-1] = b1u3object.Hash(pairs=vals[-1])
+        return vals[-1] if vals else None
+
+    def start_statements(self, kind, statements, env, todo, vals):
+        """ 文の並びを評価し始める。空なら結果は None """
+        vals.append(None)
+        if len(statements) > 0:
+            todo.append((kind, statements, 0, env))
+
+
+def b1u3eval(node, env, max_depth=DEFAULT_MAX_DEPTH):
+    return StackEvaluator(max_depth=max_depth).b1u3eval(node, env)
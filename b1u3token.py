@@ -1,38 +1,89 @@
+import codecs
+import itertools
+import operator
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_right
 from collections import defaultdict
-""" Token type """
-ILLEGAL ="ILLEGAL"
-EOF = "EOF"
-IDENT = "IDENT"
-INT = "INT"
-ASSIGN = "="
-PLUS = "+"
-COMMA = ","
-SEMICOLON = ";"
-LPAREN = "("
-RPAREN = ")"
-LBRACE = "{"
-RBRACE = "}"
-LBRACKET = "["
-RBRACKET = "]"
-FUNCTION = "FUNCTION"
-LET = "LET"
-BANG = "!"
-SLASH = "/"
-ASTERISK = "*"
-MINUS = "-"
-LT = "<"
-GT = ">"
-BANG = "!"
-IF = "IF"
-TRUE = "TRUE"
-FALSE = "FALSE"
-RETURN = "RETURN"
-ELSE = "ELSE"
-EQ = "=="
-NOT_EQ = "!="
-STRING = "STRING"
-COLON = ":"
-MACRO = "MACRO"
+""" Token type
+
+種類は小さい整数で、names[kind] が表示用の名前 ("LET" や "=") になる。
+"""
+ILLEGAL = 0
+EOF = 1
+IDENT = 2
+INT = 3
+ASSIGN = 4
+PLUS = 5
+COMMA = 6
+SEMICOLON = 7
+LPAREN = 8
+RPAREN = 9
+LBRACE = 10
+RBRACE = 11
+LBRACKET = 12
+RBRACKET = 13
+FUNCTION = 14
+LET = 15
+BANG = 16
+SLASH = 17
+ASTERISK = 18
+MINUS = 19
+LT = 20
+GT = 21
+IF = 22
+TRUE = 23
+FALSE = 24
+RETURN = 25
+ELSE = 26
+EQ = 27
+NOT_EQ = 28
+STRING = 29
+COLON = 30
+MACRO = 31
+WHILE = 32
+FOR = 33
+IN = 34
+
+names = [
+        "ILLEGAL",
+        "EOF",
+        "IDENT",
+        "INT",
+        "=",
+        "+",
+        ",",
+        ";",
+        "(",
+        ")",
+        "{",
+        "}",
+        "[",
+        "]",
+        "FUNCTION",
+        "LET",
+        "!",
+        "/",
+        "*",
+        "-",
+        "<",
+        ">",
+        "IF",
+        "TRUE",
+        "FALSE",
+        "RETURN",
+        "ELSE",
+        "==",
+        "!=",
+        "STRING",
+        ":",
+        "MACRO",
+        "WHILE",
+        "FOR",
+        "IN",
+]
 
 """ str to token type """
 keywords = defaultdict(lambda: None, {
@@ -43,133 +94,335 @@ keywords = defaultdict(lambda: None, {
         'return': RETURN,
         'if': IF,
         'else': ELSE,
-        'macro': MACRO
+        'macro': MACRO,
+        'while': WHILE,
+        'for': FOR,
+        'in': IN
 })
 
 
+class Symbols():
+    """ 識別子の名前の表。同じ名前には同じ str オブジェクトと同じ番号を返す
+
+    番号はプロセスの中で変わらない。名前は sys.intern 済みなので、辞書を引くときも
+    内容を比べずに同一性で一致する。
+    """
+    ids:dict = None # 名前から番号
+    names:list = None # 番号から名前
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            name = sys.intern(name)
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def intern(self, name):
+        return self.names[self.id(name)]
+
+
+symbols = Symbols()
+QUOTE_SYMBOL = symbols.id('quote')
+UNQUOTE_SYMBOL = symbols.id('unquote')
+
+
 class Token():
-    """ 字句を表すクラス """
-    type=None
-    literal=None
+    """ 字句を表すクラス。type は上の整数の種類、offset は入力の先頭からの文字数 """
+    __slots__ = ('type', 'literal', 'offset')
 
-    def __init__(self, type, literal):
+    def __init__(self, type, literal, offset=None):
         self.type = type
         self.literal = literal
+        self.offset = offset
 
     def __str__(self):
-        return '{ '+f'type: {self.type}, literal: {self.literal}'+' }'
+        return '{ '+f'type: {names[self.type]}, literal: {self.literal}'+' }'
+
+
+# 記号のリテラルから種類へ
+operators = {
+        '=': ASSIGN, '==': EQ, '!': BANG, '!=': NOT_EQ,
+        '+': PLUS, '-': MINUS, '*': ASTERISK, '/': SLASH, '<': LT, '>': GT,
+        ',': COMMA, ';': SEMICOLON, ':': COLON,
+        '(': LPAREN, ')': RPAREN, '{': LBRACE, '}': RBRACE, '[': LBRACKET, ']': RBRACKET,
+}
+
+def _unicode_exceptions():
+    """ 正規表現の \\w, \\d と str.isalpha, str.isdigit の食い違う文字を集める
+
+    [^\\W\\d_] は isalpha でない数字 ('²' や '½') も含む。
+    戻り値は (isdigit だが \\d でない文字, どちらでもない数の文字)。
+    """
+    codec = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+    chars = array('I', range(sys.maxunicode + 1)).tobytes().decode(codec, 'surrogatepass')
+    odd = [c for c in re.findall(r'[^\W\d_]', chars) if not c.isalpha()]
+    digits = ''.join(re.escape(c) for c in odd if c.isdigit())
+    numerics = ''.join(re.escape(c) for c in odd if not c.isdigit())
+    return digits, numerics
+
+# 14.0.0 の Unicode で _unicode_exceptions() が返す文字。import のたびに
+# 全部の文字を調べると遅いので、同じ版なら正規表現の文字クラスにしたこの表を使う
+_UNIDATA_VERSION = '14.0.0'
+_EXTRA_DIGITS = (
+        r'\u00b2\u00b3\u00b9\u1369-\u1371\u19da\u2070\u2074-\u2079\u2080-\u2089\u2460-\u2468'
+        r'\u2474-\u247c\u2488-\u2490\u24ea\u24f5-\u24fd\u24ff\u2776-\u277e\u2780-\u2788'
+        r'\u278a-\u2792\U00010a40-\U00010a43\U00010e60-\U00010e68\U00011052-\U0001105a'
+        r'\U0001f100-\U0001f10a'
+)
+_NUMERICS = (
+        r'\u00bc-\u00be\u09f4-\u09f9\u0b72-\u0b77\u0bf0-\u0bf2\u0c78-\u0c7e\u0d58-\u0d5e'
+        r'\u0d70-\u0d78\u0f2a-\u0f33\u1372-\u137c\u16ee-\u16f0\u17f0-\u17f9\u2150-\u2182'
+        r'\u2185-\u2189\u2469-\u2473\u247d-\u2487\u2491-\u249b\u24eb-\u24f4\u24fe\u277f\u2789'
+        r'\u2793\u2cfd\u3007\u3021-\u3029\u3038-\u303a\u3192-\u3195\u3220-\u3229\u3248-\u324f'
+        r'\u3251-\u325f\u3280-\u3289\u32b1-\u32bf\ua6e6-\ua6ef\ua830-\ua835\U00010107-\U00010133'
+        r'\U00010140-\U00010178\U0001018a\U0001018b\U000102e1-\U000102fb\U00010320-\U00010323'
+        r'\U00010341\U0001034a\U000103d1-\U000103d5\U00010858-\U0001085f\U00010879-\U0001087f'
+        r'\U000108a7-\U000108af\U000108fb-\U000108ff\U00010916-\U0001091b\U000109bc\U000109bd'
+        r'\U000109c0-\U000109cf\U000109d2-\U000109ff\U00010a44-\U00010a48\U00010a7d\U00010a7e'
+        r'\U00010a9d-\U00010a9f\U00010aeb-\U00010aef\U00010b58-\U00010b5f\U00010b78-\U00010b7f'
+        r'\U00010ba9-\U00010baf\U00010cfa-\U00010cff\U00010e69-\U00010e7e\U00010f1d-\U00010f26'
+        r'\U00010f51-\U00010f54\U00010fc5-\U00010fcb\U0001105b-\U00011065\U000111e1-\U000111f4'
+        r'\U0001173a\U0001173b\U000118ea-\U000118f2\U00011c5a-\U00011c6c\U00011fc0-\U00011fd4'
+        r'\U00012400-\U0001246e\U00016b5b-\U00016b61\U00016e80-\U00016e96\U0001d2e0-\U0001d2f3'
+        r'\U0001d360-\U0001d378\U0001e8c7-\U0001e8cf\U0001ec71-\U0001ecab\U0001ecad-\U0001ecaf'
+        r'\U0001ecb1-\U0001ecb4\U0001ed01-\U0001ed2d\U0001ed2f-\U0001ed3d\U0001f10b\U0001f10c'
+)
+
+if unicodedata.unidata_version == _UNIDATA_VERSION:
+    _extra_digits, _numerics = _EXTRA_DIGITS, _NUMERICS
+else:
+    _extra_digits, _numerics = _unicode_exceptions()
+
+# 空白を読み飛ばして字句を一つ読む。どの字句になったかはグループの番号でわかる
+# 識別子は isalpha か _ で始まり isalpha, _, isdigit が続く。整数は isdigit の並び
+token_pattern = re.compile(r'''
+        [ \t\r\n]*
+        (?:
+            ([A-Za-z_][A-Za-z0-9_]*(?!\w|[^\x00-\x7f])   # 1: 識別子かキーワード。ASCII だけなら速い方
+             |[^\W\d%(numerics)s%(digits)s][^\W%(numerics)s]*)
+          | ([0-9]+(?![0-9]|[^\x00-\x7f])|[\d%(digits)s]+)  # 2: 整数
+          | "([^"]*)"?                            # 3: 文字列。閉じていなければ末尾まで
+          | (==|!=|[=!+\-*/<>,;:(){}\[\]])        # 4: 記号
+          | ([^ \t\r\n])                          # 5: それ以外は ILLEGAL
+        )''' % {'digits': _extra_digits, 'numerics': _numerics}, re.VERBOSE)
+
+IDENT_GROUP, INT_GROUP, STRING_GROUP, OPERATOR_GROUP = 1, 2, 3, 4
+
+
+class LineIndex():
+    """ 各行の先頭の位置の表。位置から (行, 列) を二分探索で求める。行と列は 1 から数える """
+    starts:list = None
+
+    def __init__(self, source=''):
+        self.starts = [0]
+        self.add(source, 0)
+
+    def add(self, text, base):
+        """ 入力の base の位置から始まる text の改行を表に足す """
+        ends = itertools.accumulate(map(len, text.split('\n')))
+        # k 番目の行の終わり + 改行 k+1 個が次の行の先頭。最後の断片の後ろには改行がない
+        self.starts.extend(map(operator.add, ends, itertools.count(base + 1)))
+        self.starts.pop()
+
+    def position(self, offset):
+        starts = self.starts
+        line = bisect_right(starts, offset)
+        return line, offset - starts[line-1] + 1
+
+
+def scan(matches, base=0):
+    """ token_pattern のマッチの列を Token の列にする。base はマッチした文字列の入力での位置 """
+    get_keyword = keywords.get
+    get_operator = operators.__getitem__
+    get_symbol = symbols.ids.get
+    symbol_names = symbols.names
+    for m in matches:
+        group = m.lastindex
+        text = m[group]
+        start = m.start(group) + base
+        if group == IDENT_GROUP:
+            kind = get_keyword(text)
+            if kind is not None:
+                yield Token(kind, text, start)
+                continue
+            # 識別子は Symbols の str を使う
+            i = get_symbol(text)
+            if i is None:
+                i = symbols.id(text)
+            yield Token(IDENT, symbol_names[i], start)
+        elif group == OPERATOR_GROUP:
+            yield Token(get_operator(text), text, start)
+        elif group == INT_GROUP:
+            yield Token(INT, text, start)
+        elif group == STRING_GROUP:
+            # 位置は開きの " を指す
+            yield Token(STRING, text, start - 1)
+        else:
+            yield Token(ILLEGAL, text, start)
 
 
 class Lexer():
+    """ 入力を token_pattern で先頭から一度だけなめて Token を作る
+
+    next_token は tokens() の生成器の __next__ そのもので、Python の関数呼び出しを挟まない。
+    入力が終わったあとは EOF を返し続ける。
+    """
     input:str = None
-    position:int = None # 入力における現在位置
-    read_position:int = 0 # 次に読む位置(次)
-    ch:str = None
+    next_token = None
+    line_index:LineIndex = None # position が初めて呼ばれたときに作る
 
     def __init__(self, input):
         self.input = input
-        self.read_ch()
+        self.next_token = self.tokens().__next__
 
-    def read_ch(self):
-        if self.read_position >= len(self.input):
-            self.ch = None
-        else:
-            self.ch = self.input[self.read_position]
-        self.position = self.read_position
-        self.read_position += 1
-
-    def next_token(self):
-        self.skip_whitespace()
-        if self.ch == '=':
-            if self.peek_ch() == '=':
-                self.read_ch()
-                tok = Token(EQ, '==')
-            else:
-                tok = Token(ASSIGN, self.ch)
-        elif self.ch == ';':
-            tok = Token(SEMICOLON, self.ch)
-        elif self.ch == '(':
-            tok = Token(LPAREN, self.ch)
-        elif self.ch == ')':
-            tok = Token(RPAREN, self.ch)
-        elif self.ch == '{':
-            tok = Token(LBRACE, self.ch)
-        elif self.ch == '}':
-            tok = Token(RBRACE, self.ch)
-        elif self.ch == '+':
-            tok = Token(PLUS, self.ch)
-        elif self.ch == ',':
-            tok = Token(COMMA, self.ch)
-        elif self.ch == '-':
-            tok = Token(MINUS, self.ch)
-        elif self.ch == '/':
-            tok = Token(SLASH, self.ch)
-        elif self.ch == '*':
-            tok = Token(ASTERISK, self.ch)
-        elif self.ch == '<':
-            tok = Token(LT, self.ch)
-        elif self.ch == '>':
-            tok = Token(GT, self.ch)
-        elif self.ch == '[':
-            tok = Token(LBRACKET, self.ch)
-        elif self.ch == ']':
-            tok = Token(RBRACKET, self.ch)
-        elif self.ch == ':':
-            tok = Token(COLON, self.ch)
-        elif self.ch == '!':
-            if self.peek_ch() == '=':
-                self.read_ch()
-                tok = Token(NOT_EQ, '!=')
-            else:
-                tok = Token(BANG, self.ch)
-        elif self.ch is None:
-            tok = Token(EOF, "")
-        elif self.ch == '"':
-            tok = Token(STRING, self.read_string())
-        else:
-            if self.ch.isalpha() or self.ch == '_':
-                return self.read_ident()
-            elif self.ch.isdigit():
-                tok =  Token(INT, self.read_integer())
-                return tok
+    def tokens(self):
+        yield from scan(token_pattern.finditer(self.input))
+        while True:
+            yield Token(EOF, "", len(self.input))
+
+    def position(self, offset):
+        """ Token の offset を (行, 列) にする """
+        if self.line_index is None:
+            self.line_index = LineIndex(self.input)
+        return self.line_index.position(offset)
+
+
+class TokenBuffer():
+    """ 入力全体の字句を列ごとの array で持つ。Token は作らない
+
+    i 番目の字句の種類は kinds[i]、literal は source[starts[i]:starts[i]+lengths[i]]。
+    最後は EOF。b1u3parser.BufferParser が添字でたどる。
+    """
+    source:str = None
+    kinds:array = None
+    starts:array = None
+    lengths:array = None
+    line_index:LineIndex = None # position が初めて呼ばれたときに作る
+
+    def __init__(self, source):
+        self.source = source
+        kinds = self.kinds = array('B')
+        starts = self.starts = array('I')
+        lengths = self.lengths = array('I')
+        add_kind = kinds.append
+        add_start = starts.append
+        add_length = lengths.append
+        get_keyword = keywords.get
+        get_operator = operators.__getitem__
+        for m in token_pattern.finditer(source):
+            group = m.lastindex
+            start, end = m.span(group)
+            if group == IDENT_GROUP:
+                add_kind(get_keyword(source[start:end], IDENT))
+            elif group == OPERATOR_GROUP:
+                add_kind(get_operator(source[start:end]))
+            elif group == INT_GROUP:
+                add_kind(INT)
+            elif group == STRING_GROUP:
+                add_kind(STRING)
             else:
-                tok = Token(ILLEGAL, self.ch)
-        self.read_ch()
-        return tok
-
-    def read_ident(self):
-        """ 現在読んでいる位置から文字が出なくなるまでの位置までの文字をとる """
-        pos = self.position
-        while self.ch and (self.ch.isalpha() or self.ch == '_' or self.ch.isdigit()):
-            self.read_ch()
-        s = self.input[pos:self.position]
-        if keywords[s] is not None:
-            return Token(keywords[s], s)
+                add_kind(ILLEGAL)
+            add_start(start)
+            add_length(end - start)
+        add_kind(EOF)
+        add_start(len(source))
+        add_length(0)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def literal(self, i):
+        start = self.starts[i]
+        return self.source[start:start+self.lengths[i]]
+
+    def offset(self, i):
+        """ starts は literal の位置なので、文字列は開きの " の分だけ戻す """
+        kind = self.kinds[i]
+        return self.starts[i] - 1 if kind == STRING else self.starts[i]
+
+    def token(self, i):
+        return Token(self.kinds[i], self.literal(i), self.offset(i))
+
+    def position(self, offset):
+        """ Token の offset を (行, 列) にする """
+        if self.line_index is None:
+            self.line_index = LineIndex(self.source)
+        return self.line_index.position(offset)
+
+
+# StreamLexer が一度に読む量
+CHUNK_SIZE = 1 << 14
+
+
+class StreamLexer():
+    """ ファイルオブジェクト、bytes などのバッファ、mmap、str を chunk_size ずつ読んで字句に分ける
+
+    バイト列は encoding で少しずつデコードするので、入力全体を一つの str にしない。
+    バッファの末尾で終わる字句は次のチャンクに続くかもしれないので、次を読むまで残しておく。
+    Parser からは Lexer と同じに使える。
+    """
+    source = None
+    chunk_size:int = CHUNK_SIZE
+    encoding:str = 'utf-8'
+    next_token = None
+    line_index:LineIndex = None # 読んだところまでの行の表
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.line_index = LineIndex()
+        self.next_token = self.tokens().__next__
+
+    def chunks(self):
+        """ 入力を str の断片にして順に返す """
+        source = self.source
+        size = self.chunk_size
+        if hasattr(source, 'read'):
+            read = lambda: source.read(size)
         else:
-            return Token(IDENT, self.input[pos:self.position])
-
-    def skip_whitespace(self):
-        while self.ch == ' ' or self.ch == '\r' or self.ch == '\n' or self. ch == '\t':
-            self.read_ch()
-
-    def read_integer(self):
-        pos = self.position
-        while self.ch and self.ch.isdigit():
-            self.read_ch()
-        return self.input[pos: self.position]
-
-    def peek_ch(self):
-        if self.read_position >= len(self.input):
-            return None
-        return self.input[self.read_position]
-
-    def read_string(self):
-        pos = self.position+1
-        while True :
-            self.read_ch()
-            if self.ch == '"' or self.ch is None:
+            view = source if type(source) is str else memoryview(source).cast('B')
+            pos = 0
+            def read():
+                nonlocal pos
+                data = view[pos:pos+size]
+                pos += size
+                return data
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        while True:
+            data = read()
+            if len(data) == 0:
                 break
-        return self.input[pos:self.position]
-
+            yield data if type(data) is str else decoder.decode(data)
+        yield decoder.decode(b'', final=True)
 
+    def tokens(self):
+        rest = ''
+        base = 0 # buf の先頭の入力での位置
+        for text in self.chunks():
+            self.line_index.add(text, base + len(rest))
+            buf = rest + text
+            end = len(buf)
+            cut = end
+            done = []
+            rest = ''
+            for m in token_pattern.finditer(buf):
+                if m.end() == end:
+                    cut = m.start()
+                    rest = buf[cut:]
+                    break
+                done.append(m)
+            yield from scan(done, base)
+            base += cut
+        yield from scan(token_pattern.finditer(rest), base)
+        while True:
+            yield Token(EOF, "", base + len(rest))
 
+    def position(self, offset):
+        """ Token の offset を (行, 列) にする。offset まで読み終わっている必要がある """
+        return self.line_index.position(offset)
@@ -0,0 +1,553 @@
+""" AST を Python のソースに変換し、compile() して実行するバックエンド
+
+Monkey の関数は Python の関数 (クロージャ) になり、整数演算は型を確かめたうえで
+int の演算として直接埋め込まれる。それ以外の演算は評価器の関数に任せるので、
+エラーのメッセージは評価器と同じになる。
+"""
+import re
+import b1u3ast, b1u3object, b1u3evaluator, b1u3resolver
+from b1u3compiler import CompileError
+from b1u3evaluator import TRUE, FALSE, NULL
+
+Integer = b1u3object.Integer
+
+
+class MonkeyError(Exception):
+    """ 生成したコードの中で Error を上まで伝えるための例外 """
+    error:b1u3object.Error=None
+
+    def __init__(self, error):
+        super().__init__(error.msg)
+        self.error = error
+
+
+class PyFunction(b1u3object.Function):
+    """ 生成した Python の関数を包む。inspect のために元の AST を持つ """
+    __slots__ = ('fn', 'arity')
+
+    def __init__(self, fn=None, arity=0, parameters=None, body=None):
+        super().__init__(parameters=parameters, body=body)
+        self.fn = fn
+        self.arity = arity
+
+
+# --- 生成したコードから呼ばれる関数 ---
+
+def _check(obj):
+    if b1u3evaluator.is_error(obj):
+        raise MonkeyError(obj)
+    return obj
+
+def _function(fn, node):
+    return PyFunction(fn=fn, arity=len(node.parameters), parameters=node.parameters, body=node.body)
+
+def _call(f, *args):
+    if type(f) is PyFunction:
+        if len(args) != f.arity:
+            raise MonkeyError(b1u3evaluator.new_error(f"wrong number of arguments: want={f.arity}, got={len(args)}"))
+        return f.fn(*args)
+    elif isinstance(f, b1u3object.Builtin):
+        return _check(f.fn(*args))
+    elif type(f) is b1u3object.Memo:
+        return _check(b1u3evaluator.apply_memo(f, args))
+    raise MonkeyError(b1u3evaluator.new_error(f"not a function: {f.type()}"))
+
+def apply_py_function(f, args):
+    """ 組み込み関数から PyFunction を呼ぶ。MonkeyError は Error にして返す """
+    try:
+        return _call(f, *args)
+    except MonkeyError as e:
+        return e.error
+
+
+b1u3evaluator.appliers[PyFunction] = apply_py_function
+
+
+def _infix(operator, left, right):
+    return _check(b1u3evaluator.eval_infix_expression(operator, left, right, None))
+
+def _minus(right):
+    return _check(b1u3evaluator.eval_minus_operator_expression(right, None))
+
+def _index(left, index):
+    return _check(b1u3evaluator.eval_index_expression(left, index))
+
+def _iterate(seq):
+    if seq.tag is b1u3object.ARRAY_OBJ:
+        return seq.elements
+    elements = b1u3evaluator.iterate(seq)
+    if type(elements) is b1u3object.Error:
+        raise MonkeyError(elements)
+    if seq.tag is b1u3object.LAZY_OBJ:
+        return _check_elements(elements)
+    return elements
+
+def _check_elements(elements):
+    """ LAZY の途中で起きた Error を MonkeyError にする """
+    for e in elements:
+        if e.tag is b1u3object.ERROR_OBJ:
+            raise MonkeyError(e)
+        yield e
+
+def _hash_key(key):
+    if not isinstance(key, b1u3object.Hashable):
+        raise MonkeyError(b1u3evaluator.new_error(f"unusable as hash key: {key.type()}"))
+    return key.hash_key()
+
+
+# let される前の関数のローカル変数の値
+_UNBOUND = object()
+
+
+runtime = {
+        'TRUE': TRUE,
+        'FALSE': FALSE,
+        'NULL': NULL,
+        'Integer': Integer,
+        'new_integer': b1u3object.new_integer,
+        'Array': b1u3object.Array,
+        'Hash': b1u3object.Hash,
+        'HashPair': b1u3object.HashPair,
+        'PyFunction': PyFunction,
+        '_function': _function,
+        '_call': _call,
+        '_infix': _infix,
+        '_minus': _minus,
+        '_index': _index,
+        '_hash_key': _hash_key,
+        '_iterate': _iterate,
+        '_UNBOUND': _UNBOUND,
+}
+
+arithmetic_ops = {'+', '-', '*', '/'}
+comparison_ops = {'<', '>', '==', '!='}
+python_ops = {'+': '+', '-': '-', '*': '*', '/': '//', '<': '<', '>': '>', '==': '==', '!=': '!='}
+
+simple_expr = re.compile(r'^(v_\w+|u_[0-9a-f]+|_t\d+|_k\d+|TRUE|FALSE|NULL)$')
+
+
+def py_name(name):
+    """ Monkey の名前を Python の変数名にする
+
+    Python は ASCII でない名前を NFKC で正規化するので (ﬁ と fi が同じになる)、
+    ASCII でない名前は UTF-8 の 16 進にして u_ を付ける。
+    """
+    if name.isascii():
+        return 'v_' + name
+    return 'u_' + name.encode('utf-8', 'surrogatepass').hex()
+
+
+def monkey_name(var):
+    """ py_name の逆 """
+    if var.startswith('u_'):
+        return bytes.fromhex(var[2:]).decode('utf-8', 'surrogatepass')
+    return var[2:]
+
+
+def is_constant(expr):
+    return expr.startswith('_k') or expr in ('TRUE', 'FALSE', 'NULL')
+
+
+def collect_lets(statements, names, assigned=None):
+    """ 関数本体 (if と loop の中を含み、内側の fn は含まない) で let される名前を集める
+
+    assigned を渡すと、x = ... で書き換えられる名前もそこに集める。
+    """
+    for s in statements:
+        if isinstance(s, b1u3ast.LetStatement):
+            names.add(s.name.value)
+            collect_lets_in_expression(s.value, names, assigned)
+        elif isinstance(s, b1u3ast.ExpressionStatement):
+            collect_lets_in_expression(s.expression, names, assigned)
+        elif isinstance(s, b1u3ast.ReturnStatement):
+            collect_lets_in_expression(s.return_value, names, assigned)
+        elif isinstance(s, b1u3ast.AssignStatement):
+            if assigned is not None:
+                assigned.add(s.name.value)
+            collect_lets_in_expression(s.value, names, assigned)
+        elif isinstance(s, b1u3ast.WhileStatement):
+            collect_lets_in_expression(s.condition, names, assigned)
+            collect_lets(s.body.statements, names, assigned)
+        elif isinstance(s, b1u3ast.ForStatement):
+            names.add(s.variable.value)
+            collect_lets_in_expression(s.iterable, names, assigned)
+            collect_lets(s.body.statements, names, assigned)
+    return names
+
+
+def collect_lets_in_expression(node, names, assigned=None):
+    if isinstance(node, b1u3ast.IfExpression):
+        collect_lets_in_expression(node.condition, names, assigned)
+        collect_lets(node.consequence.statements, names, assigned)
+        if node.alternative is not None:
+            collect_lets(node.alternative.statements, names, assigned)
+    elif isinstance(node, (b1u3ast.InfixExpression, b1u3ast.IndexExpression)):
+        collect_lets_in_expression(node.left, names, assigned)
+        collect_lets_in_expression(node.right if isinstance(node, b1u3ast.InfixExpression) else node.index, names, assigned)
+    elif isinstance(node, b1u3ast.PrefixExpression):
+        collect_lets_in_expression(node.right, names, assigned)
+    elif isinstance(node, b1u3ast.CallExpression):
+        collect_lets_in_expression(node.function, names, assigned)
+        for a in node.arguments:
+            collect_lets_in_expression(a, names, assigned)
+    elif isinstance(node, b1u3ast.ArrayLiteral):
+        for e in node.elements:
+            collect_lets_in_expression(e, names, assigned)
+    elif isinstance(node, b1u3ast.HashLiteral):
+        for k, v in node.pairs.items():
+            collect_lets_in_expression(k, names, assigned)
+            collect_lets_in_expression(v, names, assigned)
+
+
+class Transpiler():
+    """ Program を def _program(): ... という Python のソースにする
+
+    定数は _k<n> という名前で constants に入る。
+    """
+    lines:list=None
+    constants:dict=None
+    handlers=None
+
+    def __init__(self, constants=None):
+        """ Session では前回の constants を引き継ぐ """
+        self.lines = []
+        self.constants = constants if constants is not None else {}
+        self.level = 0
+        self.temps = 0
+        self.scopes = [] # 外側の関数から順に、そのローカル変数の名前から Python の変数名への dict
+        self.handlers = {
+                b1u3ast.IntegerLiteral: self.gen_integer_literal,
+                b1u3ast.StringLiteral: self.gen_string_literal,
+                b1u3ast.Boolean: self.gen_boolean,
+                b1u3ast.Identifier: self.gen_identifier,
+                b1u3ast.PrefixExpression: self.gen_prefix_expression,
+                b1u3ast.InfixExpression: self.gen_infix_expression,
+                b1u3ast.IfExpression: self.gen_if_expression,
+                b1u3ast.FunctionLiteral: self.gen_function_literal,
+                b1u3ast.CallExpression: self.gen_call_expression,
+                b1u3ast.ArrayLiteral: self.gen_array_literal,
+                b1u3ast.HashLiteral: self.gen_hash_literal,
+                b1u3ast.IndexExpression: self.gen_index_expression,
+        }
+
+    def transpile(self, program):
+        self.emit('def _program():')
+        self.level += 1
+        assigned = set()
+        names = collect_lets(program.statements, set(), assigned) | assigned
+        if names:
+            self.emit('global ' + ', '.join(sorted(py_name(n) for n in names)))
+        self.gen_statements(program.statements, None)
+        self.level -= 1
+        return '\n'.join(self.lines) + '\n'
+
+    # --- helpers ---
+
+    def emit(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def temp(self):
+        self.temps += 1
+        return f'_t{self.temps}'
+
+    def add_constant(self, obj):
+        name = f'_k{len(self.constants)}'
+        self.constants[name] = obj
+        return name
+
+    def atom(self, expr):
+        """ 何度参照しても副作用のない式にする """
+        if simple_expr.match(expr):
+            return expr
+        t = self.temp()
+        self.emit(f'{t} = {expr}')
+        return t
+
+    def gen_operands(self, left_node, right_node):
+        """ 右辺が文を出力するときも左辺を先に評価する """
+        left = self.atom(self.gen_expr(left_node))
+        mark = len(self.lines)
+        right = self.atom(self.gen_expr(right_node))
+        if len(self.lines) > mark and not (left.startswith('_t') or is_constant(left)):
+            t = self.temp()
+            self.lines.insert(mark, '    ' * self.level + f'{t} = {left}')
+            left = t
+        return left, right
+
+    # --- statements ---
+
+    def gen_statements(self, statements, target):
+        """ target が None なら最後の文の値を return し、そうでなければ target に代入する """
+        if len(statements) == 0:
+            self.finish(target, 'None')
+            return
+        for i, s in enumerate(statements):
+            last = i == len(statements) - 1
+            if isinstance(s, b1u3ast.LetStatement):
+                self.emit(f'{self.binding(s.name.value)} = {self.gen_expr(s.value)}')
+                if last:
+                    self.finish(target, 'None')
+            elif isinstance(s, b1u3ast.ReturnStatement):
+                self.emit(f'return {self.gen_expr(s.return_value)}')
+                return
+            elif isinstance(s, b1u3ast.AssignStatement):
+                value = self.gen_expr(s.value)
+                name = s.name.value
+                if not any(name in scope for scope in self.scopes):
+                    # グローバルは let 済みか確かめる。なければ NameError になる
+                    self.emit(py_name(name))
+                self.emit(f'{self.binding(name)} = {value}')
+                if last:
+                    self.finish(target, 'None')
+            elif isinstance(s, b1u3ast.WhileStatement):
+                self.gen_while(s)
+                if last:
+                    self.finish(target, 'None')
+            elif isinstance(s, b1u3ast.ForStatement):
+                self.gen_for(s)
+                if last:
+                    self.finish(target, 'None')
+            elif isinstance(s, b1u3ast.ExpressionStatement):
+                if last and isinstance(s.expression, b1u3ast.IfExpression):
+                    self.gen_if(s.expression, target)
+                elif last:
+                    self.finish(target, self.gen_expr(s.expression))
+                else:
+                    expr = self.gen_expr(s.expression)
+                    if not simple_expr.match(expr):
+                        self.emit(expr)
+            else:
+                raise CompileError(f'cannot transpile {s.__class__.__name__}')
+
+    def gen_while(self, node):
+        self.emit('while True:')
+        self.level += 1
+        cond = self.atom(self.gen_expr(node.condition))
+        self.emit(f'if {cond} is FALSE or {cond} is NULL:')
+        self.emit('    break')
+        self.gen_statements(node.body.statements, self.temp())
+        self.level -= 1
+
+    def gen_for(self, node):
+        iterable = self.gen_expr(node.iterable)
+        self.emit(f'for {self.binding(node.variable.value)} in _iterate({iterable}):')
+        self.level += 1
+        self.gen_statements(node.body.statements, self.temp())
+        self.level -= 1
+
+    def finish(self, target, expr):
+        if target is None:
+            self.emit(f'return {expr}')
+        else:
+            self.emit(f'{target} = {expr}')
+
+    # --- expressions ---
+
+    def gen_expr(self, node):
+        try:
+            handler = self.handlers[node.__class__]
+        except KeyError:
+            raise CompileError(f'cannot transpile {node.__class__.__name__}')
+        return handler(node)
+
+    def gen_integer_literal(self, node):
+        return self.add_constant(Integer(value=node.value))
+
+    def gen_string_literal(self, node):
+        return self.add_constant(b1u3object.String(value=node.value))
+
+    def gen_boolean(self, node):
+        return 'TRUE' if node.value else 'FALSE'
+
+    def binding(self, name):
+        """ name を束縛している一番内側の Python の変数名。代入と let に使う """
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return py_name(name)
+
+    def gen_identifier(self, node):
+        return self.variable(node.value, len(self.scopes))
+
+    def variable(self, name, depth):
+        """ name を読む式。let される前に読まれうる変数は、まだなら外側の束縛を読む """
+        for i in range(depth - 1, -1, -1):
+            var = self.scopes[i].get(name)
+            if var is not None:
+                if not var.startswith('s'):
+                    return var
+                return f'({self.variable(name, i)} if {var} is _UNBOUND else {var})'
+        return py_name(name)
+
+    def gen_prefix_expression(self, node):
+        right = self.atom(self.gen_expr(node.right))
+        if node.operator == '!':
+            return f'(TRUE if {right} is FALSE or {right} is NULL else FALSE)'
+        elif node.operator == '-':
+            return f'(new_integer(-{right}.value) if type({right}) is Integer else _minus({right}))'
+        raise CompileError(f'unknown operator {node.operator}')
+
+    def gen_infix_expression(self, node):
+        op = node.operator
+        if op not in python_ops:
+            raise CompileError(f'unknown operator {op}')
+        left, right = self.gen_operands(node.left, node.right)
+        guards = []
+        operands = []
+        for operand in (left, right):
+            const = self.constants.get(operand)
+            if type(const) is Integer:
+                operands.append(str(const.value))
+            else:
+                guards.append(f'type({operand}) is Integer')
+                operands.append(f'{operand}.value')
+        if len(guards) == 0:
+            # 定数同士の演算は評価器に任せる (ゼロ除算もそのまま)
+            return f'_infix({op!r}, {left}, {right})'
+        pyop = python_ops[op]
+        if op in arithmetic_ops:
+            fast = f'new_integer({operands[0]} {pyop} {operands[1]})'
+        else:
+            fast = f'(TRUE if {operands[0]} {pyop} {operands[1]} else FALSE)'
+        return f'({fast} if {" and ".join(guards)} else _infix({op!r}, {left}, {right}))'
+
+    def gen_if_expression(self, node):
+        t = self.temp()
+        self.gen_if(node, t)
+        return t
+
+    def gen_if(self, node, target):
+        cond = self.atom(self.gen_expr(node.condition))
+        self.emit(f'if {cond} is not NULL and {cond} is not FALSE:')
+        self.level += 1
+        self.gen_statements(node.consequence.statements, target)
+        self.level -= 1
+        self.emit('else:')
+        self.level += 1
+        if node.alternative is not None:
+            self.gen_statements(node.alternative.statements, target)
+        else:
+            self.finish(target, 'NULL')
+        self.level -= 1
+
+    def gen_function_literal(self, node):
+        name = f'_f{self.temp()[2:]}'
+        params = ', '.join(py_name(p.value) for p in node.parameters)
+        self.emit(f'def {name}({params}):')
+        self.level += 1
+        assigned = set()
+        params = {p.value for p in node.parameters}
+        local_names = collect_lets(node.body.statements, set(params), assigned)
+        outer = [n for n in sorted(assigned - local_names) if any(n in scope for scope in self.scopes)]
+        if outer:
+            # 外側の関数の変数への代入は、Python のクロージャのセルを書き換える
+            self.emit('nonlocal ' + ', '.join(self.binding(n) for n in outer))
+        rest = sorted(assigned - local_names - set(outer))
+        if rest:
+            self.emit('global ' + ', '.join(py_name(n) for n in rest))
+        # let より前に読まれうるローカル変数は別の名前にして、それまでは外側の束縛を読む
+        late = b1u3resolver.collect_late_reads(node.body.statements, set(params), set()) & (local_names - params)
+        scope = {n: py_name(n) for n in local_names}
+        for n in sorted(late):
+            scope[n] = f's{name[2:]}_{py_name(n)}'
+            self.emit(f'{scope[n]} = _UNBOUND')
+        self.scopes.append(scope)
+        self.gen_statements(node.body.statements, None)
+        self.scopes.pop()
+        self.level -= 1
+        return f'_function({name}, {self.add_constant(node)})'
+
+    def gen_call_expression(self, node):
+        if node.function.symbol == b1u3evaluator.QUOTE_SYMBOL:
+            return self.gen_quote(node)
+        fn = self.atom(self.gen_expr(node.function))
+        args = []
+        for a in node.arguments:
+            mark = len(self.lines)
+            expr = self.gen_expr(a)
+            if len(self.lines) > mark:
+                # 後の引数が文を出力するなら、それまでの引数は先に評価しておく
+                for i, prev in enumerate(args):
+                    if not (prev.startswith('_t') or is_constant(prev)):
+                        t = self.temp()
+                        self.lines.insert(mark, '    ' * self.level + f'{t} = {prev}')
+                        args[i] = t
+            args.append(expr)
+        args = [self.atom(a) for a in args]
+        joined = ', '.join(args)
+        return (f'({fn}.fn({joined}) if type({fn}) is PyFunction and {fn}.arity == {len(args)} '
+                f'else _call({fn}{", " if args else ""}{joined}))')
+
+    def gen_quote(self, node):
+        def check(n):
+            if b1u3evaluator.is_unquote_call(n):
+                raise CompileError('unquote is only supported by the tree-walking evaluator')
+            return n
+        b1u3ast.modify(node.arguments[0], check)
+        return self.add_constant(b1u3object.Quote(node=node.arguments[0]))
+
+    def gen_array_literal(self, node):
+        elements = self.gen_list(node.elements)
+        return f'Array(elements=[{", ".join(elements)}])'
+
+    def gen_list(self, nodes):
+        res = []
+        for n in nodes:
+            res.append(self.atom(self.gen_expr(n)))
+        return res
+
+    def gen_hash_literal(self, node):
+        t = self.temp()
+        self.emit(f'{t} = {{}}')
+        for k, v in node.pairs.items():
+            key = self.atom(self.gen_expr(k))
+            hashed = self.temp()
+            self.emit(f'{hashed} = _hash_key({key})')
+            value = self.gen_expr(v)
+            self.emit(f'{t}[{hashed}] = HashPair(key={key}, value={value})')
+        return f'Hash(pairs={t})'
+
+    def gen_index_expression(self, node):
+        left, index = self.gen_operands(node.left, node.index)
+        return f'_index({left}, {index})'
+
+
+not_found = re.compile(r"'(v_\w+|u_[0-9a-f]+)'")
+
+
+class Namespace():
+    """ 生成したコードを実行するグローバル変数の入れ物。Session の間で引き継ぐ """
+    globals:dict=None
+    constants:dict=None
+
+    def __init__(self):
+        self.constants = {}
+        self.globals = dict(runtime)
+        for name, fn in b1u3evaluator.builtins.items():
+            self.globals[py_name(name)] = fn
+
+    def run(self, program):
+        transpiler = Transpiler(constants=self.constants)
+        source = transpiler.transpile(program)
+        try:
+            code = compile(source, '<monkey>', 'exec')
+        except SyntaxError as e:
+            return b1u3evaluator.new_error(f'compile error: {e.msg}')
+        self.globals.update(self.constants)
+        exec(code, self.globals)
+        try:
+            return self.globals['_program']()
+        except MonkeyError as e:
+            return e.error
+        except NameError as e:
+            m = not_found.search(str(e))
+            if m is None:
+                raise
+            return b1u3evaluator.new_error(f"identifier not found: {monkey_name(m.group(1))}")
+        except RecursionError:
+            return b1u3evaluator.new_error("maximum recursion depth exceeded")
+
+
+def transpile(program):
+    """ デバッグ用に、program から生成される Python のソースを返す """
+    return Transpiler().transpile(program)
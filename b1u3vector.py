@@ -0,0 +1,124 @@
+""" Monkey の Array の中身に使う永続ベクタ
+
+Clojure の PersistentVector と同じく、32 分木の trie と末尾の tail を持つ。
+append は変更した経路だけをコピーして新しい Vector を返し、元の Vector は
+そのまま使える。index と append は O(log32 n)、len と rest と slice は O(1)。
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+class Vector:
+    """ 中身を変更しない列。ノードは list だが共有したあとは書き換えない
+
+    見えるのは trie と tail の [start, end) の範囲で、rest と slice はこの範囲を
+    狭めた Vector を作るだけで中身はコピーしない。
+    """
+    __slots__ = ('count', 'shift', 'root', 'tail', 'start', 'end')
+
+    def __init__(self, count, shift, root, tail, start=0, end=None):
+        self.count = count # trie と tail に入っている要素の数 (範囲の外も含む)
+        self.shift = shift
+        self.root = root
+        self.tail = tail
+        self.start = start
+        self.end = count if end is None else end
+
+    @staticmethod
+    def from_list(items):
+        """ items を葉に分けて下から木を組む。items はコピーする """
+        n = len(items)
+        tail_offset = ((n - 1) >> BITS) << BITS if n > 0 else 0
+        nodes = [items[i:i+WIDTH] for i in range(0, tail_offset, WIDTH)]
+        shift = BITS
+        while len(nodes) > WIDTH:
+            nodes = [nodes[i:i+WIDTH] for i in range(0, len(nodes), WIDTH)]
+            shift += BITS
+        return Vector(n, shift, nodes, list(items[tail_offset:]))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def leaf_for(self, i):
+        """ 全体での位置 i を含む葉を返す """
+        if i >= self.count - len(self.tail):
+            return self.tail
+        node = self.root
+        level = self.shift
+        while level > 0:
+            node = node[(i >> level) & MASK]
+            level -= BITS
+        return node
+
+    def __getitem__(self, i):
+        if i < 0 or i >= self.end - self.start:
+            raise IndexError('vector index out of range')
+        i += self.start
+        return self.leaf_for(i)[i & MASK]
+
+    def __iter__(self):
+        i = self.start
+        end = self.end
+        tail_offset = self.count - len(self.tail)
+        while i < tail_offset and i < end:
+            leaf = self.leaf_for(i)
+            j = i & MASK
+            n = min(WIDTH - j, end - i)
+            yield from leaf[j:j+n]
+            i += n
+        if i < end:
+            yield from self.tail[i - tail_offset:end - tail_offset]
+
+    def append(self, value):
+        """ value を末尾に足した新しい Vector を返す """
+        if self.end != self.count:
+            # 後ろを切った view の先は別の要素が入っているので作り直す
+            return Vector.from_list(list(self)).append(value)
+        if len(self.tail) < WIDTH:
+            return Vector(self.count + 1, self.shift, self.root, self.tail + [value], self.start)
+        # tail がいっぱいなので trie に移す
+        shift = self.shift
+        if (self.count >> BITS) > (1 << shift):
+            root = [self.root, new_path(shift, self.tail)]
+            shift += BITS
+        else:
+            root = self.push_tail(shift, self.root, self.tail)
+        return Vector(self.count + 1, shift, root, [value], self.start)
+
+    def push_tail(self, level, parent, tail):
+        i = ((self.count - 1) >> level) & MASK
+        node = list(parent)
+        if level == BITS:
+            child = tail
+        elif i < len(parent):
+            child = self.push_tail(level - BITS, parent[i], tail)
+        else:
+            child = new_path(level - BITS, tail)
+        if i < len(node):
+            node[i] = child
+        else:
+            node.append(child)
+        return node
+
+    def rest(self):
+        """ 先頭を除いた Vector を返す。中身は共有する """
+        return self.slice(1, self.end - self.start)
+
+    def slice(self, start, end):
+        """ [start, end) の view を返す。範囲は 0 から len(self) に丸める """
+        n = self.end - self.start
+        start = min(max(start, 0), n)
+        end = min(max(end, start), n)
+        return Vector(self.count, self.shift, self.root, self.tail, self.start + start, self.start + end)
+
+
+def new_path(level, node):
+    while level > 0:
+        node = [node]
+        level -= BITS
+    return node
+
+
+EMPTY = Vector(0, BITS, [], [])
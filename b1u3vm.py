@@ -0,0 +1,386 @@
+""" b1u3compiler の出力を実行するスタックマシン """
+import b1u3object, b1u3evaluator
+from b1u3code import (
+        OpAdd, OpAddConst, OpArray, OpBang, OpCall, OpClosure, OpConstant,
+        OpCurrentClosure, OpDiv, OpEqual, OpEqualConst, OpFalse, OpGetBuiltin, OpGetFree,
+        OpGetGlobal, OpGetLocal, OpGreaterThan, OpGreaterThanConst, OpHash, OpIndex,
+        OpIter, OpIterNext, OpJump, OpJumpNotTruthy, OpLessThan, OpLessThanConst, OpMinus,
+        OpMul, OpNotEqual, OpNotEqualConst, OpNull, OpPop, OpReturn, OpReturnValue,
+        OpSetGlobal, OpSetLocal, OpSub, OpSubConst, OpTrue,
+        OpMakeCell, OpGetCell, OpSetCell, OpGetFreeCell, OpSetFreeCell,
+        OpGetLocalOr, OpGetCellOr, OpGetFreeOr, OpGetFreeCellOr)
+from b1u3evaluator import TRUE, FALSE, NULL, new_error
+
+Integer = b1u3object.Integer
+new_integer = b1u3object.new_integer
+Closure = b1u3object.Closure
+Builtin = b1u3object.Builtin
+Memo = b1u3object.Memo
+
+# オペコードから評価器の演算子への対応。整数以外はこれで評価器に任せる
+infix_operators = {
+        OpAdd: '+',
+        OpSub: '-',
+        OpMul: '*',
+        OpDiv: '/',
+        OpEqual: '==',
+        OpNotEqual: '!=',
+        OpGreaterThan: '>',
+        OpLessThan: '<',
+        OpAddConst: '+',
+        OpSubConst: '-',
+        OpEqualConst: '==',
+        OpNotEqualConst: '!=',
+        OpGreaterThanConst: '>',
+        OpLessThanConst: '<',
+}
+
+binary_ops = frozenset([
+        OpAdd, OpSub, OpMul, OpDiv,
+        OpEqual, OpNotEqual, OpGreaterThan, OpLessThan
+])
+
+
+def integer_infix(op, left, right):
+    """ 両辺が Integer のときの演算 """
+    if op == '+':
+        return new_integer(left+right)
+    elif op == '-':
+        return new_integer(left-right)
+    elif op == '*':
+        return new_integer(left*right)
+    elif op == '/':
+        return new_integer(left//right)
+    elif op == '<':
+        return TRUE if left < right else FALSE
+    elif op == '>':
+        return TRUE if left > right else FALSE
+    elif op == '==':
+        return TRUE if left == right else FALSE
+    else:
+        return TRUE if left != right else FALSE
+
+
+class Cell():
+    """ クロージャと共有するローカル変数の入れ物。value が None なら let される前 """
+    __slots__ = ('value',)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class Frame():
+    cl:Closure=None
+    ip:int=0
+    base_pointer:int=0
+    memo:Memo=None # memo の関数の呼び出しなら、戻るときに結果を入れる Memo
+    key:tuple=None
+
+    def __init__(self, cl, base_pointer):
+        self.cl = cl
+        self.ip = 0
+        self.base_pointer = base_pointer
+
+
+# 最後に run を始めた VM。組み込み関数から Closure を呼ぶときに使う
+current = None
+
+
+def apply_closure(cl, args):
+    """ 組み込み関数から cl を呼ぶ。実行中の VM と同じ constants と globals を使う """
+    global current
+    parent = current
+    fn = cl.fn
+    if len(args) != fn.num_parameters:
+        return new_error(f"wrong number of arguments: want={fn.num_parameters}, got={len(args)}")
+    vm = VM.__new__(VM)
+    vm.constants = parent.constants
+    vm.globals = parent.globals
+    vm.global_names = parent.global_names
+    vm.stack = list(args)
+    vm.stack.extend([None] * (fn.num_locals - len(args)))
+    vm.frames = [Frame(cl, 0)]
+    try:
+        res = vm.run()
+    finally:
+        current = parent
+    return NULL if res is None else res
+
+
+b1u3evaluator.appliers[Closure] = apply_closure
+
+
+class VM():
+    constants:list=None
+    globals:list=None
+    global_names:list=None
+    stack:list=None
+    frames:list=None
+
+    def __init__(self, bytecode, globals=None):
+        """ REPL では前回の globals を引き継ぐ """
+        self.constants = bytecode.constants
+        self.global_names = bytecode.global_names
+        self.globals = globals if globals is not None else []
+        while len(self.globals) < len(self.global_names):
+            self.globals.append(None)
+        main_fn = b1u3object.CompiledFunction(instructions=bytecode.instructions, num_locals=0, num_parameters=0)
+        self.stack = []
+        self.frames = [Frame(Closure(fn=main_fn, free=[]), 0)]
+
+    def run(self):
+        """ プログラムを実行して評価結果を返す。エラーが起きたらその Error で止まる """
+        global current
+        current = self
+        constants = self.constants
+        globals = self.globals
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        frames = self.frames
+        builtins = list(b1u3evaluator.builtins.values())
+        frame = frames[-1]
+        ins = frame.cl.fn.instructions
+        ip = frame.ip
+        bp = frame.base_pointer
+        while True:
+            op = ins[ip]
+            if op == OpGetLocal:
+                push(stack[bp + ins[ip+1]])
+                ip += 2
+            elif op == OpConstant:
+                push(constants[ins[ip+1]])
+                ip += 2
+            elif op == OpJumpNotTruthy:
+                cond = pop()
+                if cond is FALSE or cond is NULL:
+                    ip = ins[ip+1]
+                else:
+                    ip += 2
+            elif op == OpJump:
+                ip = ins[ip+1]
+            elif op == OpGetGlobal:
+                value = globals[ins[ip+1]]
+                if value is None:
+                    return new_error(f"identifier not found: {self.global_names[ins[ip+1]]}")
+                push(value)
+                ip += 2
+            elif op == OpGetFree:
+                push(frame.cl.free[ins[ip+1]])
+                ip += 2
+            elif op == OpGetBuiltin:
+                push(builtins[ins[ip+1]])
+                ip += 2
+            elif op == OpCurrentClosure:
+                push(frame.cl)
+                ip += 1
+            elif op == OpIterNext:
+                e = next(stack[-1], None)
+                if e is None:
+                    pop()
+                    ip = ins[ip+1]
+                elif e.tag is b1u3object.ERROR_OBJ:
+                    return e
+                else:
+                    push(e)
+                    ip += 2
+            elif OpAddConst <= op <= OpLessThanConst:
+                left = stack[-1]
+                right = constants[ins[ip+1]]
+                operator = infix_operators[op]
+                if type(left) is Integer and type(right) is Integer:
+                    stack[-1] = integer_infix(operator, left.value, right.value)
+                else:
+                    res = b1u3evaluator.eval_infix_expression(operator, left, right, None)
+                    if b1u3evaluator.is_error(res):
+                        return res
+                    stack[-1] = res
+                ip += 2
+            elif op in binary_ops:
+                right = pop()
+                left = stack[-1]
+                operator = infix_operators[op]
+                if type(left) is Integer and type(right) is Integer:
+                    stack[-1] = integer_infix(operator, left.value, right.value)
+                else:
+                    res = b1u3evaluator.eval_infix_expression(operator, left, right, None)
+                    if b1u3evaluator.is_error(res):
+                        return res
+                    stack[-1] = res
+                ip += 1
+            elif op == OpCall:
+                num_args = ins[ip+1]
+                ip += 2
+                callee = stack[-1-num_args]
+                if isinstance(callee, Closure):
+                    fn = callee.fn
+                    if num_args != fn.num_parameters:
+                        return new_error(f"wrong number of arguments: want={fn.num_parameters}, got={num_args}")
+                    frame.ip = ip
+                    bp = len(stack) - num_args
+                    frame = Frame(callee, bp)
+                    frames.append(frame)
+                    # let される前のローカル変数は None
+                    for _ in range(fn.num_locals - num_args):
+                        push(None)
+                    ins = fn.instructions
+                    ip = 0
+                elif isinstance(callee, Builtin):
+                    args = stack[len(stack)-num_args:]
+                    del stack[len(stack)-num_args-1:]
+                    res = callee.fn(*args)
+                    if b1u3evaluator.is_error(res):
+                        return res
+                    push(res if res is not None else NULL)
+                elif type(callee) is Memo:
+                    args = stack[len(stack)-num_args:]
+                    key = b1u3evaluator.memo_key(args)
+                    if type(key) is b1u3object.Error:
+                        return key
+                    res = b1u3evaluator.memo_lookup(callee, key)
+                    fn = callee.fn
+                    if res is not None:
+                        del stack[len(stack)-num_args-1:]
+                        push(res)
+                    elif isinstance(fn, Closure):
+                        # Closure と同じくフレームを積み、戻るときに結果を入れる
+                        if num_args != fn.fn.num_parameters:
+                            return new_error(f"wrong number of arguments: want={fn.fn.num_parameters}, got={num_args}")
+                        frame.ip = ip
+                        bp = len(stack) - num_args
+                        frame = Frame(fn, bp)
+                        frame.memo = callee
+                        frame.key = key
+                        frames.append(frame)
+                        for _ in range(fn.fn.num_locals - num_args):
+                            push(None)
+                        ins = fn.fn.instructions
+                        ip = 0
+                    else:
+                        del stack[len(stack)-num_args-1:]
+                        res = b1u3evaluator.apply_function(fn, args)
+                        if b1u3evaluator.is_error(res):
+                            return res
+                        if res is None:
+                            res = NULL
+                        else:
+                            b1u3evaluator.memo_store(callee, key, res)
+                        push(res)
+                else:
+                    return new_error(f"not a function: {callee.type()}")
+            elif op == OpReturnValue or op == OpReturn:
+                value = pop() if op == OpReturnValue else NULL
+                if len(frames) == 1:
+                    # トップレベルの return はプログラムの終了
+                    return value if op == OpReturnValue else None
+                if frame.memo is not None:
+                    b1u3evaluator.memo_store(frame.memo, frame.key, value)
+                frames.pop()
+                del stack[bp-1:]
+                push(value)
+                frame = frames[-1]
+                ins = frame.cl.fn.instructions
+                ip = frame.ip
+                bp = frame.base_pointer
+            elif op == OpPop:
+                pop()
+                ip += 1
+            elif op == OpSetLocal:
+                stack[bp + ins[ip+1]] = pop()
+                ip += 2
+            elif op == OpSetGlobal:
+                globals[ins[ip+1]] = pop()
+                ip += 2
+            elif op == OpTrue:
+                push(TRUE)
+                ip += 1
+            elif op == OpFalse:
+                push(FALSE)
+                ip += 1
+            elif op == OpNull:
+                push(NULL)
+                ip += 1
+            elif op == OpBang:
+                stack[-1] = b1u3evaluator.eval_bang_operator_expression(stack[-1], None)
+                ip += 1
+            elif op == OpMinus:
+                res = b1u3evaluator.eval_minus_operator_expression(stack[-1], None)
+                if b1u3evaluator.is_error(res):
+                    return res
+                stack[-1] = res
+                ip += 1
+            elif op == OpClosure:
+                fn = constants[ins[ip+1]]
+                num_free = ins[ip+2]
+                free = stack[len(stack)-num_free:]
+                del stack[len(stack)-num_free:]
+                push(Closure(fn=fn, free=free))
+                ip += 3
+            elif op == OpGetCell:
+                push(stack[bp + ins[ip+1]].value)
+                ip += 2
+            elif op == OpSetCell:
+                stack[bp + ins[ip+1]].value = pop()
+                ip += 2
+            elif op == OpGetFreeCell:
+                push(frame.cl.free[ins[ip+1]].value)
+                ip += 2
+            elif op == OpSetFreeCell:
+                frame.cl.free[ins[ip+1]].value = pop()
+                ip += 2
+            elif op == OpMakeCell:
+                stack[bp + ins[ip+1]] = Cell(stack[bp + ins[ip+1]])
+                ip += 2
+            elif OpGetLocalOr <= op <= OpGetFreeCellOr:
+                if op == OpGetLocalOr:
+                    value = stack[bp + ins[ip+1]]
+                elif op == OpGetCellOr:
+                    value = stack[bp + ins[ip+1]].value
+                elif op == OpGetFreeOr:
+                    value = frame.cl.free[ins[ip+1]]
+                else:
+                    value = frame.cl.free[ins[ip+1]].value
+                if value is None:
+                    # 続く命令で外側の変数を読む
+                    ip += 3
+                else:
+                    push(value)
+                    ip = ins[ip+2]
+            elif op == OpArray:
+                n = ins[ip+1]
+                elements = stack[len(stack)-n:]
+                del stack[len(stack)-n:]
+                push(b1u3object.Array(elements=elements))
+                ip += 2
+            elif op == OpHash:
+                n = ins[ip+1]
+                res = self.build_hash(stack[len(stack)-n:])
+                if b1u3evaluator.is_error(res):
+                    return res
+                del stack[len(stack)-n:]
+                push(res)
+                ip += 2
+            elif op == OpIter:
+                elements = b1u3evaluator.iterate(stack[-1])
+                if type(elements) is b1u3object.Error:
+                    return elements
+                stack[-1] = elements
+                ip += 1
+            elif op == OpIndex:
+                index = pop()
+                res = b1u3evaluator.eval_index_expression(stack[-1], index)
+                if b1u3evaluator.is_error(res):
+                    return res
+                stack[-1] = res
+                ip += 1
+            else:
+                raise ValueError(f'unknown opcode {op}')
+
+    def build_hash(self, items):
+        pairs = {}
+        for i in range(0, len(items), 2):
+            key = items[i]
+            if not isinstance(key, b1u3object.Hashable):
+                return new_error(f"unusable as hash key: {key.type()}")
+            pairs[key.hash_key()] = b1u3object.HashPair(key=key, value=items[i+1])
+        return b1u3object.Hash(pairs=pairs)
@@ -0,0 +1,165 @@
+import unittest
+import b1u3token, b1u3parser, b1u3object, b1u3compiler, b1u3code
+from b1u3code import make
+
+
+class CompilerTest(unittest.TestCase):
+    def help_test_compile(self, input, optimize=True):
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        program = p.parse_program()
+        compiler = b1u3compiler.Compiler(optimize=optimize)
+        compiler.compile(program)
+        return compiler.bytecode()
+
+    def help_test_instructions(self, expected, actual):
+        concatted = []
+        for ins in expected:
+            concatted.extend(ins)
+        self.assertEqual(b1u3code.instructions_string(concatted), b1u3code.instructions_string(actual))
+
+    def test_integer_arithmetic(self):
+        bytecode = self.help_test_compile('1 + 2', optimize=False)
+        self.help_test_instructions([
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpConstant, 1),
+            make(b1u3code.OpAdd),
+            make(b1u3code.OpReturnValue),
+        ], bytecode.instructions)
+        self.assertEqual([c.value for c in bytecode.constants], [1, 2])
+
+    def test_constant_folding(self):
+        tests = [
+            ['1 + 2 * 3', 7],
+            ['-5 - 10', -15],
+            ['10 / 3', 3],
+        ]
+        for tt in tests:
+            bytecode = self.help_test_compile(tt[0])
+            self.assertEqual(bytecode.instructions[0], b1u3code.OpConstant)
+            self.assertEqual(len(bytecode.instructions), 3)
+            self.assertEqual(bytecode.constants[bytecode.instructions[1]].value, tt[1])
+        bytecode = self.help_test_compile('1 < 2')
+        self.help_test_instructions([make(b1u3code.OpTrue), make(b1u3code.OpReturnValue)], bytecode.instructions)
+
+    def test_fused_constant_ops(self):
+        bytecode = self.help_test_compile('let a = 1; a + 2; a < 3')
+        self.help_test_instructions([
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpSetGlobal, 0),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpAddConst, 1),
+            make(b1u3code.OpPop),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpLessThanConst, 2),
+            make(b1u3code.OpReturnValue),
+        ], bytecode.instructions)
+
+    def test_no_fusion_across_jump_target(self):
+        bytecode = self.help_test_compile('let a = true; (if (a) { 1 } else { 2 }) + 3')
+        ops = []
+        i = 0
+        while i < len(bytecode.instructions):
+            op = bytecode.instructions[i]
+            ops.append(op)
+            i += 1 + b1u3code.lookup(op).operand_count
+        self.assertIn(b1u3code.OpAddConst, ops)
+        bytecode = self.help_test_compile('let a = true; 3 + if (a) { 1 } else { 2 }')
+        self.assertNotIn(b1u3code.OpAddConst, bytecode.instructions[-3:])
+        self.assertEqual(bytecode.instructions[-2], b1u3code.OpAdd)
+
+    def test_while_loop(self):
+        bytecode = self.help_test_compile('let i = 0; while (i < 3) { i = i + 1; }')
+        self.help_test_instructions([
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpSetGlobal, 0),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpLessThanConst, 1),
+            make(b1u3code.OpJumpNotTruthy, 18),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpAddConst, 2),
+            make(b1u3code.OpSetGlobal, 0),
+            make(b1u3code.OpJump, 4),
+            make(b1u3code.OpReturn),
+        ], bytecode.instructions)
+
+    def test_for_loop(self):
+        bytecode = self.help_test_compile('for (x in [1]) { x; }')
+        self.help_test_instructions([
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpArray, 1),
+            make(b1u3code.OpIter),
+            make(b1u3code.OpIterNext, 14),
+            make(b1u3code.OpSetGlobal, 0),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpPop),
+            make(b1u3code.OpJump, 5),
+            make(b1u3code.OpReturn),
+        ], bytecode.instructions)
+
+    def test_cells(self):
+        # 内側から代入される変数はセルにして共有する
+        bytecode = self.help_test_compile('fn(n) { fn() { n = 1 } }')
+        inner = bytecode.constants[1]
+        self.help_test_instructions([
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpSetFreeCell, 0),
+            make(b1u3code.OpReturn),
+        ], inner.instructions)
+        outer = bytecode.constants[2]
+        self.help_test_instructions([
+            make(b1u3code.OpMakeCell, 0),
+            make(b1u3code.OpGetLocal, 0),
+            make(b1u3code.OpClosure, 1, 1),
+            make(b1u3code.OpReturnValue),
+        ], outer.instructions)
+
+    def test_unbound_local(self):
+        # if の中の let のあとの読み出しは、値がなければ外側 (ここではグローバル) を読む
+        bytecode = self.help_test_compile('fn(n) { if (n) { let a = 1 }; a }')
+        self.help_test_instructions([
+            make(b1u3code.OpGetLocal, 0),
+            make(b1u3code.OpJumpNotTruthy, 11),
+            make(b1u3code.OpConstant, 0),
+            make(b1u3code.OpSetLocal, 1),
+            make(b1u3code.OpNull),
+            make(b1u3code.OpJump, 12),
+            make(b1u3code.OpNull),
+            make(b1u3code.OpPop),
+            make(b1u3code.OpGetLocalOr, 1, 18),
+            make(b1u3code.OpGetGlobal, 0),
+            make(b1u3code.OpReturnValue),
+        ], bytecode.constants[1].instructions)
+        self.assertEqual(bytecode.global_names, ['a'])
+
+    def test_assign_function_name(self):
+        with self.assertRaises(b1u3compiler.CompileError):
+            self.help_test_compile('let f = fn() { f = 1 };')
+
+    def test_closures(self):
+        bytecode = self.help_test_compile('fn(a) { fn(b) { a + b } }')
+        inner = bytecode.constants[0]
+        self.help_test_instructions([
+            make(b1u3code.OpGetFree, 0),
+            make(b1u3code.OpGetLocal, 0),
+            make(b1u3code.OpAdd),
+            make(b1u3code.OpReturnValue),
+        ], inner.instructions)
+        outer = bytecode.constants[1]
+        self.help_test_instructions([
+            make(b1u3code.OpGetLocal, 0),
+            make(b1u3code.OpClosure, 0, 1),
+            make(b1u3code.OpReturnValue),
+        ], outer.instructions)
+
+    def test_symbol_table(self):
+        g = b1u3compiler.SymbolTable()
+        a = g.define('a')
+        self.assertEqual(a, b1u3compiler.Symbol('a', b1u3compiler.GLOBAL_SCOPE, 0))
+        self.assertEqual(g.define('a'), a)
+        local = b1u3compiler.SymbolTable(g)
+        b = local.define('b')
+        self.assertEqual(b, b1u3compiler.Symbol('b', b1u3compiler.LOCAL_SCOPE, 0))
+        nested = b1u3compiler.SymbolTable(local)
+        self.assertEqual(nested.resolve('b'), b1u3compiler.Symbol('b', b1u3compiler.FREE_SCOPE, 0))
+        self.assertEqual(nested.resolve('a'), a)
+        self.assertIsNone(nested.resolve('c'))
@@ -1,4 +1,7 @@
-import b1u3token, b1u3parser, b1u3object, b1u3evaluator, unittest
+import b1u3ast, b1u3token, b1u3parser, b1u3object, b1u3evaluator, unittest
+
+# memo の関数が自分を 3000 段呼ぶ
+DEEP_MEMO = 'let c = memo(fn(n) { if (n == 0) { 0 } else { 1 + c(n - 1) } }, 100000); c(3000)'
 
 class EvaluatorTest(unittest.TestCase):
     def test_eval_integer_expression(self):
@@ -168,6 +171,19 @@ class EvaluatorTest(unittest.TestCase):
             evaluated = self.help_test_eval(tt[0])
             self.help_test_integer_object(evaluated, tt[1])
 
+    def test_wrong_number_of_arguments(self):
+        # 足りない引数を外側の同じ名前の変数で埋めない
+        tests = [
+            ['let f = fn(a, b) { b }; let b = 7; f(1);', 'wrong number of arguments: want=2, got=1'],
+            ['let f = fn(x) { x }; f(1, 2);', 'wrong number of arguments: want=1, got=2'],
+            ['let g = fn(a) { a }; let f = fn() { g() }; f();', 'wrong number of arguments: want=1, got=0'],
+            ['map([1], fn(a, b) { b });', 'wrong number of arguments: want=2, got=1'],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+            self.assertEqual(evaluated.msg, tt[1])
+
     def test_string_literal(self):
         input = '"Hello World";'
         evaluated = self.help_test_eval(input)
@@ -186,7 +202,22 @@ class EvaluatorTest(unittest.TestCase):
             ['len("four");', 4],
             ['len("hello world")', 11],
             ['len(1)', "argument to `len` not supported, got INTEGER"],
-            ['len("one", "two")', "wrong number of arguments. got=2, want=1"]
+            ['len("one", "two")', "wrong number of arguments. got=2, want=1"],
+            ['len([1, 2, 3])', 3],
+            ['first([1, 2, 3])', 1],
+            ['last([1, 2, 3])', 3],
+            ['first(1)', "argument to `first` must be ARRAY, got INTEGER"],
+            ['last(1)', "argument to `last` must be ARRAY, got INTEGER"],
+            ['rest([1, 2, 3])[0]', 2],
+            ['len(rest(rest([1, 2, 3])))', 1],
+            ['let a = [1]; let b = push(a, 2); len(a) + b[1]', 3],
+            ['slice([1, 2, 3, 4], 1, 3)[0]', 2],
+            ['len(slice([1, 2, 3, 4], 1, 3))', 2],
+            ['len(slice([1, 2, 3, 4], 3, 100))', 1],
+            ['len(slice([1, 2, 3, 4], 3, 1))', 0],
+            ['last(push(slice([1, 2, 3, 4], 0, 2), 5)) + len(push(slice([1, 2, 3, 4], 0, 2), 5))', 8],
+            ['slice([1], 0)', "wrong number of arguments. got=2, want=3"],
+            ['slice([1], "a", 1)', "argument to `slice` must be INTEGER, got STRING"],
         ]
         for tt in tests:
             evaluated = self.help_test_eval(tt[0])
@@ -241,7 +272,9 @@ class EvaluatorTest(unittest.TestCase):
                 "thr"+ "ee": 6 / 2,
                 4: 4,
                 true: 5,
-                false: 6
+                false: 6,
+                1: 7,
+                "eno": 8
         }"""
         evaluated = self.help_test_eval(input)
         self.assertTrue(isinstance(evaluated, b1u3object.Hash), f"Eval didn't return Hash. got={type(evaluated)}")
@@ -251,13 +284,260 @@ class EvaluatorTest(unittest.TestCase):
                 b1u3object.String(value="three").hash_key(): 3,
                 b1u3object.Integer(value=4).hash_key(): 4,
                 b1u3evaluator.TRUE.hash_key(): 5,
-                b1u3evaluator.FALSE.hash_key(): 6
+                b1u3evaluator.FALSE.hash_key(): 6,
+                b1u3object.Integer(value=1).hash_key(): 7,
+                b1u3object.String(value="eno").hash_key(): 8,
         }
         self.assertEqual(len(evaluated.pairs), len(expected), f"Hash has wrong num of pairs. got={len(evaluated.pairs)}")
         for expectedKey, expectedValue in expected.items():
             p = evaluated.pairs[expectedKey]
             self.help_test_integer_object(p.value, expectedValue)
 
+    def test_hash_builtins(self):
+        tests = [
+            ['let h = {"a": 1}; let g = set(h, "b", 2); g["b"] + len(keys(h))', 3],
+            ['let h = {"a": 1, "b": 2}; let g = delete(h, "a"); len(keys(g)) + h["a"]', 2],
+            ['let h = delete({"a": 1}, "x"); h["a"]', 1],
+            ['let m = merge({"a": 1, "b": 2}, {"b": 20, "c": 30}); m["a"] + m["b"] + m["c"]', 51],
+            ['let v = values({1: 10, true: 20, "1": 30}); v[0] + v[1] + v[2]', 60],
+            ['if (has({1: 2}, 1)) { 1 } else { 0 }', 1],
+            ['if (has({1: 2}, true)) { 1 } else { 0 }', 0],
+            ['set([], 1, 2)', "argument to `set` must be HASH, got ARRAY"],
+            ['set({}, fn(x) { x }, 2)', "unusable as hash key: FUNCTION"],
+            ['merge({}, 1)', "argument to `merge` must be HASH, got INTEGER"],
+            ['keys({}, 1)', "wrong number of arguments. got=2, want=1"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_hash_order(self):
+        # キーの型 (BOOLEAN, INTEGER, STRING) と値の順。PYTHONHASHSEED によらない
+        h = '{"b": 1, 3: 0, "a": 2, true: 5, 1: 0}'
+        tests = [
+            [f'keys({h})', '[true, 1, 3, a, b]'],
+            [f'values({h})', '[5, 0, 0, 2, 1]'],
+            [h, '{true: 5, 1: 0, 3: 0, a: 2, b: 1}'],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertEqual(evaluated.inspect(), tt[1])
+
+    def test_string_builtins(self):
+        tests = [
+            ['join(split("a,b,c", ","), "-")', "a-b-c"],
+            ['len(split("a b  c", " "))', 4],
+            ['split("abc", "")[2]', "c"],
+            ['join([], ",")', ""],
+            ['substr("hello world", 6, 5)', "world"],
+            ['substr("hello", 3, 100)', "lo"],
+            ['substr("hello", -2, 2)', "he"],
+            ['index_of("hello", "l")', 2],
+            ['index_of("hello", "z")', -1],
+            ['replace("a-b-c", "-", "+")', "a+b+c"],
+            ['upper("Monkey")', "MONKEY"],
+            ['lower("Monkey")', "monkey"],
+            ['if (contains("monkey", "key")) { 1 } else { 0 }', 1],
+            ['if (contains("monkey", "Key")) { 1 } else { 0 }', 0],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.String), f"evaluated is not String, got={evaluated}")
+                self.assertEqual(evaluated.value, tt[1])
+
+    def test_string_builtin_errors(self):
+        tests = [
+            ['split("a", 1)', "argument to `split` must be STRING, got INTEGER"],
+            ['join(["a", 1], ",")', "argument to `join` must be ARRAY of STRING, got INTEGER"],
+            ['join("a", ",")', "argument to `join` must be ARRAY, got STRING"],
+            ['substr("a", "b", 1)', "argument to `substr` must be INTEGER, got STRING"],
+            ['upper("a", "b")', "wrong number of arguments. got=2, want=1"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+            self.assertEqual(evaluated.msg, tt[1])
+
+    def test_higher_order_builtins(self):
+        tests = [
+            ['let a = map([1, 2, 3], fn(x) { x * 2 }); a[0] + a[1] + a[2]', 12],
+            ['let k = 10; map([1, 2], fn(x) { x + k })[1]', 12],
+            ['len(filter(range(10), fn(x) { x > 6 }))', 3],
+            ['reduce([1, 2, 3, 4], 0, fn(acc, x) { acc + x })', 10],
+            ['reduce([], 7, fn(acc, x) { acc + x })', 7],
+            ['sum(range(101))', 5050],
+            ['sum(range(10, 0, -2))', 30],
+            ['len(range(3, 1))', 0],
+            ['if (any([1, 2, 3], fn(x) { x > 2 })) { 1 } else { 0 }', 1],
+            ['if (all([1, 2, 3], fn(x) { x > 2 })) { 1 } else { 0 }', 0],
+            ['if (all([true, 1])) { 1 } else { 0 }', 1],
+            ['if (any([false])) { 1 } else { 0 }', 0],
+            ['let fact = fn(n) { if (n == 0) { 1 } else { n * fact(n - 1) } }; sum(map(range(5), fact))', 34],
+            ['sum(map([[1, 2], [3]], fn(xs) { sum(map(xs, fn(x) { x * 10 })) }))', 60],
+            ['map([1], len)', "argument to `len` not supported, got INTEGER"],
+            ['map([1], fn(x) { x + true })', "type mismatch: INTEGER + BOOLEAN"],
+            ['sum([1, "a"])', "argument to `sum` must be ARRAY of INTEGER, got STRING"],
+            ['map(1, fn(x) { x })', "argument to `map` must be ARRAY, got INTEGER"],
+            ['range(1, 2, 0)', "argument to `range` must not be zero step"],
+            ['map([1], 1)', "not a function: INTEGER"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_vec(self):
+        tests = [
+            ['len(vec(range(5)))', 5],
+            ['sum(vec([1, 2, 3]) * 2)', 12],
+            ['(vec([1, 2, 3]) + vec([10, 20, 30]))[2]', 33],
+            ['(10 - vec([1, 2, 3]))[0]', 9],
+            ['(vec([7, -7]) / 2)[1]', -4],
+            ['sum(vec(range(1000)))', 499500],
+            ['vec([1, 2])[5]', None],
+            ['len(filter(vec([1, 5, 9]) > 4, fn(b) { b }))', 2],
+            ['vec([1, 2]) + vec([1])', "length mismatch: VEC(2) + VEC(1)"],
+            ['vec([1, 2]) / 0', "division by zero: VEC / INTEGER"],
+            ['vec([1]) + "a"', "type mismatch: VEC + STRING"],
+            ['vec(1)', "argument to `vec` must be ARRAY, got INTEGER"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if tt[1] is None:
+                self.assertIs(evaluated, b1u3evaluator.NULL)
+            elif isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_vec_falls_back_to_array(self):
+        self.assertEqual(self.help_test_eval('vec([1, 2, 3])').inspect(), 'vec[1, 2, 3]')
+        self.assertEqual(self.help_test_eval('vec([1, "a"])').inspect(), '[1, a]')
+        self.assertEqual(self.help_test_eval('vec([1, 99999999999999999999])').type(), b1u3object.ARRAY_OBJ)
+        self.assertEqual(self.help_test_eval('vec([1, 2]) == vec([1, 3])').inspect(), '[true, false]')
+
+    def test_lazy_sequences(self):
+        tests = [
+            ['collect(lazy_range(4))', [0, 1, 2, 3]],
+            ['collect(lazy_range(10, 0, -3))', [10, 7, 4, 1]],
+            ['collect(take(lazy_map(lazy_range(100000000000), fn(x) { x * x }), 4))', [0, 1, 4, 9]],
+            ['collect(take(lazy_filter(lazy_range(1000000000), fn(x) { x / 7 * 7 == x }), 3))', [0, 7, 14]],
+            ['collect(lazy_map([1, 2], fn(x) { x + 1 }))', [2, 3]],
+            ['let s = lazy_map(lazy_range(3), fn(x) { x + 1 }); sum(s) + sum(s)', 12],
+            ['reduce(lazy_range(1, 5), 1, fn(acc, x) { acc * x })', 24],
+            ['len(map(take(lazy_range(10), 3), fn(x) { x }))', 3],
+            ['collect(take(lazy_range(3), 0))', []],
+            ['sum(lazy_map(lazy_range(3), fn(x) { x + true }))', "type mismatch: INTEGER + BOOLEAN"],
+            ['collect(take(lazy_filter(lazy_range(3), fn(x) { y }), 1))', "identifier not found: y"],
+            ['take(lazy_range(3), -1)', "argument to `take` must be non-negative INTEGER, got -1"],
+            ['lazy_map(1, fn(x) { x })', "argument to `lazy_map` must be ARRAY, got INTEGER"],
+            ['lazy_range(1, 2, 0)', "argument to `lazy_range` must not be zero step"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], list):
+                self.assertEqual(evaluated.inspect(), b1u3object.Array(elements=[b1u3object.Integer(value=v) for v in tt[1]]).inspect())
+            elif isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_loops(self):
+        tests = [
+            ['let i = 0; let total = 0; while (i < 10) { i = i + 1; total = total + i; }; total', 55],
+            ['let i = 0; while (false) { i = 1; }; i', 0],
+            ['let total = 0; for (x in [1, 2, 3]) { total = total + x * x; }; total', 14],
+            ['let total = 0; for (x in lazy_range(5)) { total = total + x; }; total', 10],
+            ['let total = 0; for (x in vec([4, 5])) { total = total + x; }; total', 9],
+            ['let x = 0; for (x in [7, 8]) { }; x', 8],
+            ['let f = fn(xs) { for (x in xs) { if (x > 2) { return x; } }; 0 }; f([1, 3, 5])', 3],
+            ['let f = fn(n) { let i = 0; while (true) { if (i == n) { return i; } i = i + 1; } }; f(7)', 7],
+            ['let f = fn(n) { let acc = 1; while (n > 0) { acc = acc * n; n = n - 1; }; acc }; f(5)', 120],
+            ['let count = 0; let bump = fn() { count = count + 1 }; bump(); bump(); count', 2],
+            ['let i = 0; let pairs = 0; while (i < 3) { for (j in range(i)) { pairs = pairs + 1; }; i = i + 1; }; pairs', 3],
+            ['y = 1', "identifier not found: y"],
+            ['let f = fn() { z = 1 }; f()', "identifier not found: z"],
+            ['for (x in 1) { x }', "for loop over INTEGER not supported"],
+            ['while (1 + true) { }', "type mismatch: INTEGER + BOOLEAN"],
+            ['let n = 0; for (x in lazy_map([1], fn(x) { -true })) { n = n + 1 }; n', "unknown operator: -BOOLEAN"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_assign_captured_variable(self):
+        input = 'let counter = fn() { let n = 0; fn() { n = n + 1; n } }; let c = counter(); c(); c(); c()'
+        self.help_test_integer_object(self.help_test_eval(input), 3)
+
+    def test_late_bindings(self):
+        # クロージャは呼ばれたときの束縛を読み、let より前の読み出しは外側を読む
+        tests = [
+            ['fn() { let x = 1; let g = fn() { x }; let x = 2; g() }()', 2],
+            ['let f = fn(x) { let g = fn() { x }; let x = x + 1; g() }; f(1)', 2],
+            ['fn() { let g = fn() { h() }; let h = fn() { 1 }; g() }()', 1],
+            ['let f = fn(n) { if (n > 0) { let a = n; }; a }; f(3)', 3],
+            ['let f = fn(n) { if (n > 0) { let a = n; }; a }; f(0)', 'identifier not found: a'],
+            ['let x = 10; let f = fn() { let g = fn() { x }; let a = g(); let x = 2; a + g() }; f()', 12],
+            ['let x = 1; let f = fn() { let i = 0; let s = 0; while (i < 2) { s = s + x; let x = 5; i = i + 1; }; s }; f()', 6],
+            ['let f = fn() { let fs = []; let i = 0; while (i < 3) { let j = i; fs = push(fs, fn() { j }); i = i + 1; }; fs[0]() }; f()', 2],
+            ['let x = 5; let f = fn(c) { if (c) { let x = 1; }; let g = fn() { x }; g() }; f(false) + f(true)', 6],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_memo(self):
+        tests = [
+            ['let fib = memo(fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }, 100); fib(30)', 832040],
+            ['let fib = memo(fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }, 100); fib(30); memo_stats(fib)["misses"]', 31],
+            ['let fib = memo(fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }, 100); fib(30); memo_stats(fib)["hits"]', 28],
+            ['let sq = memo(fn(x) { x * x }, 2); sq(1); sq(2); sq(1); sq(3); sq(2); memo_stats(sq)["evictions"]', 2],
+            ['let sq = memo(fn(x) { x * x }, 2); sq(1); sq(2); sq(1); sq(3); sq(2); memo_stats(sq)["size"]', 2],
+            ['let add = memo(fn(a, b) { a + b }, 10); add(1, 2) + add(2, 1) + add(1, 2)', 9],
+            ['let f = memo(len, 2); f("ab") + f("ab")', 4],
+            ['let f = memo(fn(x) { x }, 3); f([1])', "unusable as memo key: ARRAY"],
+            ['let f = memo(fn(x) { -x }, 3); f(true)', "unknown operator: -BOOLEAN"],
+            ['memo(1, 3)', "argument to `memo` must be FUNCTION, got INTEGER"],
+            ['memo(len, 0)', "argument to `memo` must be positive INTEGER, got 0"],
+            ['memo_stats(len)', "argument to `memo_stats` must be memo, got BUILTIN"],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            if isinstance(tt[1], int):
+                self.help_test_integer_object(evaluated, tt[1])
+            else:
+                self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+                self.assertEqual(evaluated.msg, tt[1])
+
+    def test_memo_deep_recursion(self):
+        # 木をたどる評価器は Python の再帰で呼ぶので深さに限りがあるが、Python の例外にはしない
+        evaluated = self.help_test_eval(DEEP_MEMO)
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f"evaluated is not Error object, got={evaluated}")
+        self.assertEqual(evaluated.msg, 'maximum recursion depth exceeded')
+
+    def test_hash_inspect(self):
+        self.assertEqual(self.help_test_eval('{1: "one"}').inspect(), '{1: one}')
+
     def test_defines_macro(self):
         input = """
         let number = 1;
@@ -315,3 +595,62 @@ class EvaluatorTest(unittest.TestCase):
 
 
 
+
+    def test_trace_hook(self):
+        seen = []
+        b1u3evaluator.set_trace_hook(lambda node: seen.append(type(node)))
+        try:
+            evaluated = self.help_test_eval('1 + 2')
+        finally:
+            b1u3evaluator.set_trace_hook(None)
+        self.help_test_integer_object(evaluated, 3)
+        self.assertEqual(seen, [b1u3ast.Program, b1u3ast.ExpressionStatement, b1u3ast.InfixExpression, b1u3ast.IntegerLiteral, b1u3ast.IntegerLiteral])
+
+    def test_error_in_arguments(self):
+        tests = [
+            ['len(foo)', 'identifier not found: foo'],
+            ['[1, -true, 3]', 'unknown operator: -BOOLEAN']
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not b1u3object.Error')
+            self.assertEqual(evaluated.msg, tt[1])
+
+    def test_integer_literal_is_cached(self):
+        program = b1u3parser.Parser(b1u3token.Lexer('100000')).parse_program()
+        first = b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+        second = b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+        self.assertIs(first, second)
+
+
+class TailCallTest(unittest.TestCase):
+    def help_test_eval(self, input:str):
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        return b1u3evaluator.b1u3eval(p.parse_program(), b1u3object.Environment())
+
+    def test_tail_recursion_does_not_grow_stack(self):
+        tests = [
+            ['let loop = fn(n, acc) { if (n == 0) { acc } else { loop(n - 1, acc + 1) } }; loop(20000, 0);', 20000],
+            ['let loop = fn(n) { if (n == 0) { return 7; }; return loop(n - 1); }; loop(20000);', 7],
+            ['let even = fn(n) { if (n == 0) { true } else { odd(n - 1) } }; let odd = fn(n) { if (n == 0) { false } else { even(n - 1) } }; if (even(20001)) { 1 } else { 0 }', 0],
+            ['let walk = fn(arr, acc) { if (len(arr) == 0) { acc } else { walk(rest(arr), acc + arr[0]) } }; walk([1, 2, 3, 4], 0);', 10],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Integer), f'got={evaluated}')
+            self.assertEqual(evaluated.value, tt[1])
+
+    def test_marks_only_tail_positions(self):
+        p = b1u3parser.Parser(b1u3token.Lexer('fn(n) { f(n); let x = g(n); if (n) { return h(n) + 1; }; if (n) { i(n) } else { j(n) } }'))
+        fn = p.parse_program().statements[0].expression
+        b1u3evaluator.mark_tail_calls(fn.body)
+        stmts = fn.body.statements
+        self.assertFalse(stmts[0].expression.tail)
+        self.assertFalse(stmts[1].value.tail)
+        self.assertFalse(stmts[2].expression.consequence.statements[0].return_value.left.tail)
+        self.assertTrue(stmts[3].expression.consequence.statements[0].expression.tail)
+        self.assertTrue(stmts[3].expression.alternative.statements[0].expression.tail)
+
+    def test_non_tail_recursion_still_works(self):
+        evaluated = self.help_test_eval('let count = fn(n) { if (n == 0) { 0 } else { 1 + count(n - 1) } }; count(50);')
+        self.assertEqual(evaluated.value, 50)
@@ -0,0 +1,75 @@
+import random
+import unittest
+from b1u3hamt import Map, EMPTY
+
+
+class Key:
+    """ ハッシュ値を自由に決められるキー """
+    def __init__(self, name, h):
+        self.name = name
+        self.h = h
+
+    def __hash__(self):
+        return self.h
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.name == other.name
+
+
+class MapTest(unittest.TestCase):
+    def check(self, m, expected):
+        self.assertEqual(len(m), len(expected))
+        self.assertEqual(dict(m.items()), expected)
+        for k, v in expected.items():
+            self.assertEqual(m[k], v)
+            self.assertIn(k, m)
+
+    def test_against_dict(self):
+        rng = random.Random(1)
+        m = EMPTY
+        expected = {}
+        for _ in range(20000):
+            k = rng.randrange(3000)
+            if rng.random() < 0.3:
+                m = m.delete(k)
+                expected.pop(k, None)
+            else:
+                m = m.set(k, k * 2)
+                expected[k] = k * 2
+        self.check(m, expected)
+        self.assertNotIn(-1, m)
+        self.assertIsNone(m.get(-1))
+        with self.assertRaises(KeyError):
+            m[-1]
+
+    def test_persistent(self):
+        a = Map.from_dict({i: i for i in range(100)})
+        b = a.set(1, 'x').delete(2).set(200, 200)
+        self.check(a, {i: i for i in range(100)})
+        self.assertEqual(b[1], 'x')
+        self.assertNotIn(2, b)
+        self.assertEqual(len(b), 100)
+        self.assertIs(a.delete(1000), a)
+
+    def test_collisions(self):
+        keys = [Key(f'k{i}', 42) for i in range(5)] + [Key('other', 42 + (1 << 40))]
+        m = EMPTY
+        for i, k in enumerate(keys):
+            m = m.set(k, i)
+        self.check(m, {k: i for i, k in enumerate(keys)})
+        m = m.set(keys[0], 'x')
+        self.assertEqual(m[keys[0]], 'x')
+        for k in keys[:-1]:
+            m = m.delete(k)
+        self.check(m, {keys[-1]: 5})
+        self.assertEqual(len(m.delete(keys[-1])), 0)
+
+    def test_merge(self):
+        a = Map.from_dict({1: 'a', 2: 'b'})
+        b = Map.from_dict({2: 'c', 3: 'd'})
+        self.check(a.merge(b), {1: 'a', 2: 'c', 3: 'd'})
+        self.check(a, {1: 'a', 2: 'b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
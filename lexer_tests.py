@@ -1,3 +1,7 @@
+import io
+import re
+import sys
+import unicodedata
 import unittest
 import b1u3token
 import b1u3parser
@@ -172,3 +176,116 @@ class LexerTest(unittest.TestCase):
 
 
 
+
+    def test_next_token7(self):
+        input = 'x_1 = café != 2; ? "fn" "unterminated  \n '
+        tests = [
+            (b1u3token.IDENT, "x_1"),
+            (b1u3token.ASSIGN, "="),
+            (b1u3token.IDENT, "café"),
+            (b1u3token.NOT_EQ, "!="),
+            (b1u3token.INT, "2"),
+            (b1u3token.SEMICOLON, ";"),
+            (b1u3token.ILLEGAL, "?"),
+            (b1u3token.STRING, "fn"),
+            (b1u3token.STRING, "unterminated  \n "),
+            (b1u3token.EOF, ''),
+            (b1u3token.EOF, '')
+        ]
+        lexer = b1u3token.Lexer(input)
+        for i, t in enumerate(tests):
+            token = lexer.next_token()
+            self.assertEqual(t[0], token.type, f'tests[{i}]: token type wrong expected {t[0]}, got {token.type}')
+            self.assertEqual(t[1], token.literal, f'tests[{i}]: literal wrong expected "{t[1]}", got "{token.literal}"')
+
+    def test_unicode_digits(self):
+        # isalpha / isdigit の規則どおり: '½' は文字でも数字でもない, '²' は数字
+        input = '½ 9² x²½ ٣٤ ²'
+        tests = [
+            (b1u3token.ILLEGAL, "½"),
+            (b1u3token.INT, "9²"),
+            (b1u3token.IDENT, "x²"),
+            (b1u3token.ILLEGAL, "½"),
+            (b1u3token.INT, "٣٤"),
+            (b1u3token.INT, "²"),
+            (b1u3token.EOF, ''),
+        ]
+        lexer = b1u3token.Lexer(input)
+        for i, t in enumerate(tests):
+            token = lexer.next_token()
+            self.assertEqual(t[0], token.type, f'tests[{i}]: token type wrong expected {t[0]}, got {token.type}')
+            self.assertEqual(t[1], token.literal, f'tests[{i}]: literal wrong expected "{t[1]}", got "{token.literal}"')
+
+    def test_unicode_tables(self):
+        # token_pattern に埋め込んだ表は、全部の文字を調べた結果と同じ
+        if unicodedata.unidata_version != b1u3token._UNIDATA_VERSION:
+            self.skipTest(f'tables are for Unicode {b1u3token._UNIDATA_VERSION}')
+        chars = ''.join(map(chr, range(sys.maxunicode + 1)))
+        digits, numerics = b1u3token._unicode_exceptions()
+        self.assertEqual(''.join(re.findall('[%s]' % b1u3token._EXTRA_DIGITS, chars)), digits)
+        self.assertEqual(''.join(re.findall('[%s]' % b1u3token._NUMERICS, chars)), numerics)
+
+    def test_token_names(self):
+        self.assertEqual(b1u3token.names[b1u3token.LET], 'LET')
+        self.assertEqual(b1u3token.names[b1u3token.NOT_EQ], '!=')
+        self.assertEqual(str(b1u3token.Token(b1u3token.IDENT, 'x')), '{ type: IDENT, literal: x }')
+
+    def test_stream_lexer(self):
+        input = 'let café = "a b"; x != 10; ?'
+        lexer = b1u3token.Lexer(input)
+        want = []
+        while True:
+            token = lexer.next_token()
+            want.append((token.type, token.literal))
+            if token.type == b1u3token.EOF:
+                break
+        data = input.encode('utf-8')
+        # どのチャンクの境目でも、どの入力の形でも同じ字句になる
+        for size in range(1, 8):
+            for source in [data, bytearray(data), io.BytesIO(data), io.StringIO(input), input]:
+                lexer = b1u3token.StreamLexer(source, chunk_size=size)
+                got = []
+                for _ in want:
+                    token = lexer.next_token()
+                    got.append((token.type, token.literal))
+                self.assertEqual(want, got, f'chunk_size={size}, source={type(source).__name__}')
+
+    def test_token_positions(self):
+        input = 'let a = 1;\nlet s = "x\ny";\n  a + é\n'
+        want = [(1, 1), (1, 5), (1, 7), (1, 9), (1, 10), (2, 1), (2, 5), (2, 7), (2, 9), (3, 3),
+                (4, 3), (4, 5), (4, 7), (5, 1)]
+        lexers = [b1u3token.Lexer(input), b1u3token.StreamLexer(input.encode('utf-8'), chunk_size=3)]
+        for lexer in lexers:
+            got = []
+            while True:
+                token = lexer.next_token()
+                got.append(lexer.position(token.offset))
+                if token.type == b1u3token.EOF:
+                    break
+            self.assertEqual(want, got)
+        buffer = b1u3token.TokenBuffer(input)
+        self.assertEqual(want, [buffer.position(buffer.token(i).offset) for i in range(len(buffer))])
+
+    def test_line_index(self):
+        index = b1u3token.LineIndex('ab\n\ncd\n')
+        self.assertEqual(index.starts, [0, 3, 4, 7])
+        self.assertEqual(index.position(0), (1, 1))
+        self.assertEqual(index.position(2), (1, 3))
+        self.assertEqual(index.position(3), (2, 1))
+        self.assertEqual(index.position(5), (3, 2))
+        self.assertEqual(index.position(7), (4, 1))
+
+    def test_identifiers_are_interned(self):
+        lexer = b1u3token.Lexer('let total = total + tot' + 'al;')
+        idents = []
+        while True:
+            token = lexer.next_token()
+            if token.type == b1u3token.EOF:
+                break
+            if token.type == b1u3token.IDENT:
+                idents.append(token.literal)
+        self.assertEqual(len(idents), 3)
+        self.assertTrue(idents[0] is idents[1] and idents[1] is idents[2])
+        symbol = b1u3token.symbols.id('total')
+        self.assertEqual(b1u3token.symbols.id('to' + 'tal'), symbol)
+        self.assertTrue(b1u3token.symbols.names[symbol] is idents[0])
@@ -1,4 +1,5 @@
 import unittest
+import b1u3object
 from b1u3object import String
 
 
@@ -11,5 +12,80 @@ class ObjectTest(unittest.TestCase):
         self.assertEqual(hello1.hash_key(), hello2.hash_key())
         self.assertEqual(diff1.hash_key(), diff2.hash_key())
         self.assertNotEqual(hello1.hash_key(), diff1.hash_key())
+        # 和が同じ文字列
+        self.assertNotEqual(String(value="ab").hash_key(), String(value="ba").hash_key())
 
+    def test_hash_key_is_type_aware(self):
+        keys = [
+            b1u3object.Integer(value=1).hash_key(),
+            b1u3object.Boolean(value=True).hash_key(),
+            String(value="1").hash_key(),
+            b1u3object.Integer(value=0).hash_key(),
+            b1u3object.Boolean(value=False).hash_key(),
+        ]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(b1u3object.Integer(value=1).hash_key(), b1u3object.Integer(value=1).hash_key())
+        self.assertNotEqual(b1u3object.Integer(value=1).hash_key(), b1u3object.Boolean(value=True).hash_key())
 
+    def test_values_have_no_dict(self):
+        values = [
+            b1u3object.Integer(value=1),
+            b1u3object.Boolean(value=True),
+            b1u3object.Null(),
+            String(value="a"),
+            b1u3object.Array(elements=[]),
+            b1u3object.Hash(pairs={}),
+            b1u3object.Error(msg="e"),
+        ]
+        for v in values:
+            self.assertFalse(hasattr(v, '__dict__'), f'{type(v).__name__} has __dict__')
+
+    def test_type_tags(self):
+        self.assertIs(b1u3object.Integer(value=1).tag, b1u3object.INTEGER_OBJ)
+        self.assertIs(String(value="a").tag, b1u3object.STRING_OBJ)
+        self.assertEqual(b1u3object.Array(elements=[]).type(), b1u3object.ARRAY_OBJ)
+        self.assertIs(b1u3object.Closure(fn=None, free=[]).tag, b1u3object.FUNCTION_OBJ)
+
+    def test_small_integers_are_shared(self):
+        self.assertIs(b1u3object.new_integer(7), b1u3object.new_integer(7))
+        self.assertIs(b1u3object.new_integer(b1u3object.SMALL_INT_MIN), b1u3object.new_integer(b1u3object.SMALL_INT_MIN))
+        big = b1u3object.SMALL_INT_MAX + 1
+        self.assertIsNot(b1u3object.new_integer(big), b1u3object.new_integer(big))
+        self.assertEqual(b1u3object.new_integer(big).value, big)
+
+    def test_small_int_range(self):
+        lo, hi = b1u3object.SMALL_INT_MIN, b1u3object.SMALL_INT_MAX
+        try:
+            b1u3object.set_small_int_range(0, -1)
+            self.assertIsNot(b1u3object.new_integer(1), b1u3object.new_integer(1))
+            b1u3object.set_small_int_range(-100, 100000)
+            self.assertIs(b1u3object.new_integer(-100), b1u3object.new_integer(-100))
+            self.assertIs(b1u3object.new_integer(100000), b1u3object.new_integer(100000))
+        finally:
+            b1u3object.set_small_int_range(lo, hi)
+
+    def test_hash_key_is_cached(self):
+        for v in [b1u3object.Integer(value=5000), b1u3object.Boolean(value=True), String(value="x")]:
+            self.assertIs(v.hash_key(), v.hash_key())
+
+    def test_rope_concat(self):
+        piece = String(value="x" * 100)
+        s = String(value="")
+        for _ in range(100000):
+            s = b1u3object.concat_strings(s, piece)
+        self.assertEqual(s.length, 100 * 100000)
+        self.assertEqual(s.value, "x" * (100 * 100000))
+        self.assertEqual(s.hash_key(), String(value="x" * (100 * 100000)).hash_key())
+
+    def test_short_concat_is_flat(self):
+        s = b1u3object.concat_strings(String(value="ab"), String(value="cd"))
+        self.assertEqual(s.text, "abcd")
+        self.assertIsNone(s.left)
+
+    def test_rope_keeps_parts(self):
+        a = String(value="a" * 300)
+        b = b1u3object.concat_strings(a, String(value="b"))
+        c = b1u3object.concat_strings(b, String(value="c"))
+        self.assertEqual(c.inspect(), "a" * 300 + "bc")
+        self.assertEqual(b.inspect(), "a" * 300 + "b")
+        self.assertEqual(a.inspect(), "a" * 300)
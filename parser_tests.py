@@ -62,6 +62,17 @@ class ParserTest(unittest.TestCase):
             self.assertTrue(isinstance(s, b1u3ast.ReturnStatement), 's is not ReturnStatement')
             self.assertEqual(s.token_literal(), 'return', f"s is not 'return', got={s.token_literal()}")
 
+    def test_return_call_expression(self):
+        input = 'return add(1, 2);'
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        program = p.parse_program()
+        self.check_parser_errors(p)
+        self.assertEqual(len(program.statements), 1, f'p.statements does not contain 1 statements. got={len(program.statements)}')
+        stmt = program.statements[0]
+        self.assertTrue(isinstance(stmt, b1u3ast.ReturnStatement), 's is not ReturnStatement')
+        self.assertTrue(isinstance(stmt.return_value, b1u3ast.CallExpression), 'return_value is not CallExpression')
+        self.assertEqual(repr(stmt), 'return add(1, 2);')
+
     def test_identifier_expression(self):
         input = 'foobar;'
         l = b1u3token.Lexer(input)
@@ -295,6 +306,25 @@ class ParserTest(unittest.TestCase):
             self.assertEqual(len(exp.alternative.statements), 1, f'exp.alternative.statements does not have 1 statement, got={len(exp.alternative.statements)}')
 
 
+    def test_loop_statements(self):
+        input = 'while (x < y) { x = x + 1; } for (e in arr) { e }'
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        program = p.parse_program()
+        self.check_parser_errors(p)
+        self.assertEqual(len(program.statements), 2, f'p.statements does not contain 2 statements. got={len(program.statements)}')
+        stmt = program.statements[0]
+        self.assertTrue(isinstance(stmt, b1u3ast.WhileStatement), f'stmt is not ast.WhileStatement. got={type(stmt)}')
+        self.help_test_infix_expression(stmt.condition, 'x', '<', 'y')
+        assign = stmt.body.statements[0]
+        self.assertTrue(isinstance(assign, b1u3ast.AssignStatement), f'stmt is not ast.AssignStatement. got={type(assign)}')
+        self.help_test_identifier(assign.name, 'x')
+        self.help_test_infix_expression(assign.value, 'x', '+', 1)
+        stmt = program.statements[1]
+        self.assertTrue(isinstance(stmt, b1u3ast.ForStatement), f'stmt is not ast.ForStatement. got={type(stmt)}')
+        self.help_test_identifier(stmt.variable, 'e')
+        self.help_test_identifier(stmt.iterable, 'arr')
+        self.assertEqual(repr(program), 'while (x < y) { x = (x + 1); }for (e in arr) { e }')
+
     def test_function_literal_parsing(self):
         input = "fn(x, y) { x+y }"
         l = b1u3token.Lexer(input)
@@ -444,3 +474,47 @@ class ParserTest(unittest.TestCase):
         self.assertTrue(isinstance(body_stmt, b1u3ast.ExpressionStatement))
         self.help_test_infix_expression(body_stmt.expression, 'x', '+', 'y')
 
+
+    def test_buffer_parser(self):
+        tests = [
+            'let x = fn(a, b) { if (a < b) { "s" } else { [1, {"k": a}][0] } }; x(1, -2) * 3;',
+            'while (x != 1) { x = x / 2; } for (i in xs) { puts(i); }',
+            'macro(a) { quote(unquote(a)) }; return !true;',
+            'let = 1; let x 5; fn(',
+            '(1 + ',
+            '',
+        ]
+        for tt in tests:
+            p = b1u3parser.Parser(b1u3token.Lexer(tt))
+            want = repr(p.parse_program())
+            bp = b1u3parser.BufferParser(b1u3token.TokenBuffer(tt))
+            got = repr(bp.parse_program())
+            self.assertEqual(want, got)
+            self.assertEqual(p.errors, bp.errors)
+
+    def test_positions(self):
+        input = 'let x = 1;\nlet = 2;\nx + )'
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        program = p.parse_program()
+        self.assertEqual(p.errors, [
+            'expected next token to be IDENT, got = at line 2, column 5',
+            'no prefix parse function for = found at line 2, column 5',
+            'no prefix parse function for ) found at line 3, column 5',
+        ])
+        self.assertEqual(p.position(program.offset()), (1, 1))
+        self.assertEqual(p.position(program.statements[0].value.offset()), (1, 9))
+
+    def test_identifier_symbols(self):
+        input = 'let f = fn(x) { x }; f(quote(x))'
+        for p in [b1u3parser.Parser(b1u3token.Lexer(input)), b1u3parser.BufferParser(b1u3token.TokenBuffer(input))]:
+            program = p.parse_program()
+            self.check_parser_errors(p)
+            let = program.statements[0]
+            param = let.value.parameters[0]
+            body = let.value.body.statements[0].expression
+            self.assertEqual(param.symbol, body.symbol)
+            self.assertTrue(param.value is body.value)
+            call = program.statements[1].expression
+            self.assertEqual(call.function.symbol, let.name.symbol)
+            self.assertEqual(call.arguments[0].function.symbol, b1u3token.QUOTE_SYMBOL)
+            self.assertIsNone(let.value.symbol)
@@ -0,0 +1,61 @@
+import b1u3ast, b1u3token, b1u3parser, b1u3object, b1u3evaluator, b1u3resolver, unittest
+import evaluator_tests
+
+
+class ResolverTest(evaluator_tests.EvaluatorTest):
+    """ 名前解決してから評価しても結果が変わらないことを確かめる """
+    def help_test_eval(self, input:str):
+        program = b1u3resolver.resolve(self.help_test_parse_program(input))
+        return b1u3evaluator.b1u3eval(program, b1u3object.Environment())
+
+    def test_annotations(self):
+        program = b1u3resolver.resolve(self.help_test_parse_program(
+            'let a = 1; fn(x) { let y = x; fn(z) { a + x + y + z } }'))
+        outer = program.statements[1].expression
+        self.assertEqual(outer.layout.names, ('x', 'y'))
+        inner = outer.body.statements[1].expression
+        self.assertEqual(inner.layout.names, ('z',))
+        # (((a + x) + y) + z)
+        body = inner.body.statements[0].expression
+        z = body.right
+        y = body.left.right
+        x = body.left.left.right
+        a = body.left.left.left
+        self.assertEqual((z.depth, z.slot), (0, 0))
+        self.assertEqual((y.depth, y.slot), (1, 1))
+        self.assertEqual((x.depth, x.slot), (1, 0))
+        self.assertEqual(a.scope, b1u3resolver.GLOBAL)
+        self.assertIsNone(a.slot)
+
+    def test_frames(self):
+        tests = [
+            ['let a = fn(x) { fn(y) { fn(z) { x + y + z } } }; a(1)(2)(3)', 6],
+            ['let x = 10; let f = fn() { let g = fn() { x }; let x = 5; g() }; f()', 5],
+            ['let y = 1; let f = fn(c) { if (c) { let y = 2; }; y }; f(false)', 1],
+            ['let y = 1; let f = fn(c) { if (c) { let y = 2; }; y }; f(true)', 2],
+            ['let len = fn(x) { 42 }; let f = fn() { len("abc") }; f()', 42],
+            ['let f = fn() { len("abc") }; f()', 3],
+            ['let f = fn(x) { let x = x + 1; x }; f(1)', 2],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(self.help_test_eval(tt[0]), tt[1])
+
+    def test_frame_errors(self):
+        evaluated = self.help_test_eval('let f = fn() { missing }; f()')
+        self.assertTrue(isinstance(evaluated, b1u3object.Error))
+        self.assertEqual(evaluated.msg, 'identifier not found: missing')
+
+    def test_quote_in_function(self):
+        evaluated = self.help_test_eval('let f = fn(x) { quote(unquote(x) + y) }; f(4)')
+        self.assertTrue(isinstance(evaluated, b1u3object.Quote))
+        self.assertEqual(repr(evaluated.node), '(4 + y)')
+
+
+class EnvironmentTest(unittest.TestCase):
+    def test_lookup_through_outer(self):
+        outer = b1u3object.Environment()
+        outer['a'] = b1u3object.Integer(value=1)
+        env = b1u3object.new_enclosed_environment(b1u3object.new_enclosed_environment(outer))
+        self.assertEqual(env['a'].value, 1)
+        with self.assertRaises(KeyError):
+            env['b']
@@ -0,0 +1,61 @@
+import b1u3token, b1u3parser, b1u3object, b1u3evaluator, b1u3engine, b1u3stackeval, unittest
+import evaluator_tests
+
+
+class StackEvalTest(evaluator_tests.EvaluatorTest):
+    """ 評価器のテストをそのまま Python の再帰を使わない評価器で走らせる """
+    def help_test_eval(self, input:str):
+        p = b1u3parser.Parser(b1u3token.Lexer(input))
+        return b1u3stackeval.b1u3eval(p.parse_program(), b1u3object.Environment())
+
+    def test_deep_recursion(self):
+        tests = [
+            ['let count = fn(n) { if (n == 0) { 0 } else { 1 + count(n - 1) } }; count(100000);', 100000],
+            ['let count = fn(n) { if (n == 0) { return 0; }; return count(n - 1) + 1; }; count(100000);', 100000],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(b1u3engine.run(tt[0], engine='stack'), tt[1])
+
+    def test_memo_deep_recursion(self):
+        # memo の関数も継続を積んで呼ぶ
+        self.help_test_integer_object(self.help_test_eval(evaluator_tests.DEEP_MEMO), 3000)
+        stats = self.help_test_eval(evaluator_tests.DEEP_MEMO + '; c(3000); memo_stats(c)')
+        self.assertEqual(stats.inspect(), '{evictions: 0, hits: 1, misses: 3001, size: 3001}')
+        evaluated = b1u3engine.run(evaluator_tests.DEEP_MEMO, engine='stack', max_depth=3000)
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+        self.assertEqual(evaluated.msg, 'maximum call depth exceeded: 3000')
+
+    def test_tail_calls_do_not_count(self):
+        input = 'let loop = fn(n) { if (n == 0) { return 7; }; return loop(n - 1); }; loop(1000);'
+        self.help_test_integer_object(b1u3engine.run(input, engine='stack', max_depth=10), 7)
+
+    def test_max_depth(self):
+        input = 'let count = fn(n) { if (n == 0) { 0 } else { 1 + count(n - 1) } }; count(100);'
+        self.help_test_integer_object(b1u3engine.run(input, engine='stack', max_depth=101), 100)
+        evaluated = b1u3engine.run(input, engine='stack', max_depth=100)
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+        self.assertEqual(evaluated.msg, 'maximum call depth exceeded: 100')
+
+    def test_builtin_callbacks(self):
+        # map などから呼ばれる関数もこの評価器で評価され、呼び出しの深さは max_depth に数える
+        count = 'let count = fn(n) { if (n == 0) { 0 } else { 1 + count(n - 1) } }; '
+        evaluated = b1u3engine.run(count + 'map([1], fn(x) { count(5000) })[0]', engine='stack')
+        self.help_test_integer_object(evaluated, 5000)
+        evaluated = b1u3engine.run(count + 'reduce([1, 2], 0, fn(acc, x) { acc + count(3000 * x) })', engine='stack')
+        self.help_test_integer_object(evaluated, 9000)
+        input = count + 'map([1], fn(x) { count(98) })[0]'
+        self.help_test_integer_object(b1u3engine.run(input, engine='stack', max_depth=100), 98)
+        evaluated = b1u3engine.run(count + 'map([1], fn(x) { count(99) })', engine='stack', max_depth=100)
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+        self.assertEqual(evaluated.msg, 'maximum call depth exceeded: 100')
+
+    def test_session_keeps_env(self):
+        session = b1u3engine.Session(engine='stack')
+        self.assertIsNone(session.run('let a = 1;'))
+        self.assertIsNone(session.run(''))
+        session.run('let add = fn(x) { x + a };')
+        self.help_test_integer_object(session.run('add(5)'), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
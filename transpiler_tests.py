@@ -0,0 +1,73 @@
+import b1u3token, b1u3parser, b1u3object, b1u3engine, b1u3transpiler, unittest
+import evaluator_tests
+
+
+class TranspilerTest(evaluator_tests.EvaluatorTest):
+    """ 評価器のテストをそのまま Python に変換したコードで走らせる """
+    def help_test_eval(self, input:str):
+        return b1u3engine.run(input, engine='py')
+
+    def test_trace_hook(self):
+        # 変換したコードは b1u3eval を通らない
+        pass
+
+    def test_closures(self):
+        tests = [
+            ['let newAdder = fn(a) { fn(b) { a + b } }; let addTwo = newAdder(2); addTwo(3);', 5],
+            ['let f = fn() { let g = fn(n) { if (n == 0) { 0 } else { g(n - 1) } }; g(10) }; f();', 0],
+            ['let fib = fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }; fib(15);', 610],
+            ['let f = fn(x) { if (x > 1) { let y = x * 2; } else { let y = 0; }; y + 1 }; f(3);', 7],
+            ['let x = 1; let f = fn() { x }; let x = 2; f();', 2],
+            # let より前の読み出しは外側の x
+            ['let x = 10; let f = fn() { let y = x; let x = 2; y }; f();', 10],
+            ['let x = 10; let f = fn() { let g = fn() { x }; let a = g(); let x = 2; a + g() }; f();', 12],
+            ['let x = 1; let f = fn() { let i = 0; let s = 0; while (i < 2) { s = s + x; let x = 5; i = i + 1 }; s }; f();', 6],
+            ['let f = fn(a) { let g = fn() { let y = a; let a = 3; y + a }; g() }; f(4);', 7],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(self.help_test_eval(tt[0]), tt[1])
+
+    def test_identifiers(self):
+        # Python の名前にならない名前や、NFKC で同じになる名前も別の変数にする
+        tests = [
+            ['let x² = 1; x²', 1],
+            ['let ﬁ = 1; let fi = 2; ﬁ', 1],
+            ['let ﬁ = 1; let fi = 2; fi', 2],
+            ['let f = fn(é) { let g = fn() { é }; let é = é + 1; g() }; f(1);', 2],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(self.help_test_eval(tt[0]), tt[1])
+        evaluated = self.help_test_eval('let fi = 2; ﬁ')
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+        self.assertEqual(evaluated.msg, 'identifier not found: ﬁ')
+
+    def test_python_syntax_error(self):
+        # Python の compile が受け付けないソースになっても例外は外に出さない
+        evaluated = self.help_test_eval('while (false) { ' * 25 + '}' * 25)
+        self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+        self.assertEqual(evaluated.msg, 'compile error: too many statically nested blocks')
+
+    def test_evaluation_order(self):
+        input = 'let x = 1; x + if (true) { let x = 10; x } else { 0 }'
+        self.help_test_integer_object(self.help_test_eval(input), 11)
+
+    def test_transpiler_errors(self):
+        tests = [
+            ['let f = fn() { g() }; f();', 'identifier not found: g'],
+            ['let f = fn() { let y = x; let x = 2; y }; f();', 'identifier not found: x'],
+            ['let f = fn(x) { x + "a" }; f(1);', 'type mismatch: INTEGER + STRING'],
+            ['let f = fn(x) { x }; f(1, 2);', 'wrong number of arguments: want=1, got=2'],
+            ['"a"()', 'not a function: STRING'],
+            ['len(1)', 'argument to `len` not supported, got INTEGER'],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+            self.assertEqual(evaluated.msg, tt[1])
+
+    def test_generated_source(self):
+        p = b1u3parser.Parser(b1u3token.Lexer('let add = fn(a, b) { a + b }; add(1, 2)'))
+        source = b1u3transpiler.transpile(p.parse_program())
+        self.assertIn('def _program():', source)
+        self.assertIn('new_integer(v_a.value + v_b.value) if type(v_a) is Integer and type(v_b) is Integer', source)
+        compile(source, '<monkey>', 'exec')
@@ -0,0 +1,76 @@
+import unittest
+import b1u3object
+from b1u3vector import Vector, EMPTY
+
+
+class VectorTest(unittest.TestCase):
+    sizes = [0, 1, 31, 32, 33, 64, 1024, 1056, 1057, 33825]
+
+    def test_append_and_index(self):
+        v = EMPTY
+        for i in range(max(self.sizes)):
+            v = v.append(i)
+        self.assertEqual(len(v), max(self.sizes))
+        for i in range(len(v)):
+            self.assertEqual(v[i], i)
+        self.assertEqual(list(v), list(range(len(v))))
+        with self.assertRaises(IndexError):
+            v[len(v)]
+
+    def test_from_list(self):
+        for n in self.sizes:
+            v = Vector.from_list(list(range(n)))
+            self.assertEqual(len(v), n)
+            self.assertEqual(list(v), list(range(n)))
+            # from_list で作っても append を続けられる
+            v = v.append(n).append(n + 1)
+            self.assertEqual(list(v), list(range(n + 2)))
+            self.assertEqual(v[n + 1], n + 1)
+
+    def test_append_does_not_change_original(self):
+        for n in self.sizes:
+            v = Vector.from_list(list(range(n)))
+            w = v.append('x')
+            self.assertEqual(len(v), n)
+            self.assertEqual(list(v), list(range(n)))
+            self.assertEqual(w[n], 'x')
+
+    def test_rest(self):
+        for n in self.sizes[1:]:
+            v = Vector.from_list(list(range(n)))
+            r = v.rest()
+            self.assertEqual(len(r), n - 1)
+            self.assertEqual(list(r), list(range(1, n)))
+            if n > 1:
+                self.assertEqual(r[0], 1)
+            self.assertEqual(list(r.append('x'))[-1], 'x')
+            self.assertEqual(len(v), n)
+
+    def test_slice(self):
+        for n in self.sizes:
+            v = Vector.from_list(list(range(n)))
+            for start, end in [(0, n), (1, n - 1), (n // 3, n // 2), (n - 1, n + 5), (-3, 2), (5, 1)]:
+                expected = list(range(n))[max(start, 0):max(end, 0)]
+                s = v.slice(start, end)
+                self.assertEqual(len(s), len(expected), f'n={n}, slice({start}, {end})')
+                self.assertEqual(list(s), expected)
+                if len(expected) > 0:
+                    self.assertEqual(s[len(expected) - 1], expected[-1])
+                with self.assertRaises(IndexError):
+                    s[len(expected)]
+                self.assertEqual(list(s.append('x')), expected + ['x'])
+                self.assertEqual(list(s.rest()), expected[1:])
+            self.assertEqual(list(v), list(range(n)))
+
+    def test_slice_of_slice(self):
+        v = Vector.from_list(list(range(100)))
+        self.assertEqual(list(v.slice(10, 90).slice(5, 10)), list(range(15, 20)))
+        self.assertEqual(list(v.slice(10, 90).slice(70, 100)), list(range(80, 90)))
+
+    def test_array_view_inspect(self):
+        arr = b1u3object.Array(elements=Vector.from_list([b1u3object.Integer(value=i) for i in range(5)]).slice(1, 3))
+        self.assertEqual(arr.inspect(), '[1, 2]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import b1u3token, b1u3parser, b1u3object, b1u3evaluator, b1u3engine, unittest
+import evaluator_tests
+
+
+class VMTest(evaluator_tests.EvaluatorTest):
+    """ 評価器のテストをそのまま VM で走らせる """
+    def help_test_eval(self, input:str):
+        return b1u3engine.run(input, engine='vm')
+
+    def test_trace_hook(self):
+        # VM は b1u3eval を通らない
+        pass
+
+    def test_closures(self):
+        tests = [
+            ['let newAdder = fn(a) { fn(b) { a + b } }; let addTwo = newAdder(2); addTwo(3);', 5],
+            ['let newAdder = fn(a, b) { let c = a + b; fn(d) { c + d } }; newAdder(1, 2)(8);', 11],
+            ['let f = fn() { let g = fn(n) { if (n == 0) { 0 } else { g(n - 1) } }; g(10) }; f();', 0],
+            ['let fib = fn(n) { if (n < 2) { n } else { fib(n - 1) + fib(n - 2) } }; fib(15);', 610],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(self.help_test_eval(tt[0]), tt[1])
+
+    def test_builtins_on_arrays(self):
+        tests = [
+            ['len([1, 2, 3])', 3],
+            ['rest([1, 2, 3])[1]', 3],
+            ['push([1, 2], 3)[2]', 3],
+            ['let map = fn(arr, f) { let iter = fn(arr, acc) { if (len(arr) == 0) { acc } else { iter(rest(arr), push(acc, f(arr[0]))) } }; iter(arr, []) }; map([1, 2, 3], fn(x) { x * 2 })[2];', 6],
+        ]
+        for tt in tests:
+            self.help_test_integer_object(self.help_test_eval(tt[0]), tt[1])
+
+    def test_deep_recursion(self):
+        input = 'let count = fn(n) { if (n == 0) { 0 } else { 1 + count(n - 1) } }; count(20000);'
+        self.help_test_integer_object(self.help_test_eval(input), 20000)
+
+    def test_memo_deep_recursion(self):
+        # memo の関数も Closure と同じくフレームを積んで呼ぶ
+        self.help_test_integer_object(self.help_test_eval(evaluator_tests.DEEP_MEMO), 3000)
+        stats = self.help_test_eval(evaluator_tests.DEEP_MEMO + '; c(3000); memo_stats(c)')
+        self.assertEqual(stats.inspect(), '{evictions: 0, hits: 1, misses: 3001, size: 3001}')
+
+    def test_vm_errors(self):
+        tests = [
+            ['let f = fn(x) { x }; f(1, 2);', 'wrong number of arguments: want=1, got=2'],
+            ['let f = fn() { -"a" }; f();', 'unknown operator: -STRING'],
+            ['1(2)', 'not a function: INTEGER'],
+            ['let f = fn() { g() }; f();', 'identifier not found: g'],
+        ]
+        for tt in tests:
+            evaluated = self.help_test_eval(tt[0])
+            self.assertTrue(isinstance(evaluated, b1u3object.Error), f'evaluated is not Error, got={evaluated}')
+            self.assertEqual(evaluated.msg, tt[1])
+
+    def test_session_keeps_globals(self):
+        session = b1u3engine.Session(engine='vm')
+        self.assertIsNone(session.run('let a = 1;'))
+        session.run('let add = fn(x) { x + a };')
+        session.run('let a = 10;')
+        self.help_test_integer_object(session.run('add(5)'), 15)